@@ -14,6 +14,69 @@ class Settings(BaseSettings):
     DEEPSEEK_API_KEY: str = ""
     DEEPSEEK_BASE_URL: str = "https://api.deepseek.com"
 
+    # DeepSeek HTTP 連接池（全局共享 client，於 lifespan 中建立）
+    DEEPSEEK_MAX_CONNECTIONS: int = 50          # 最大連接數
+    DEEPSEEK_MAX_KEEPALIVE: int = 20            # 最大保活連接數
+    DEEPSEEK_KEEPALIVE_EXPIRY: float = 60.0     # 空閒連接保活秒數
+    DEEPSEEK_HTTP2: bool = False                # 啟用 HTTP/2 多路複用（需安裝 h2）
+    DEEPSEEK_CONNECT_TIMEOUT: float = 10.0      # 建立連接超時（秒）
+    DEEPSEEK_TIMEOUT: float = 60.0              # 非流式請求超時（秒）
+    DEEPSEEK_STREAM_TIMEOUT: float = 120.0      # 流式請求超時（秒）
+
+    # LLM 並發准入控制（interactive > module > batch）
+    LLM_MAX_CONCURRENCY: int = 16               # 同時進行的 DeepSeek 請求上限
+    LLM_MAX_QUEUE: int = 64                     # 排隊請求上限，超出即返回 429
+    LLM_QUEUE_RETRY_AFTER: int = 5              # 無歷史數據時的 Retry-After 秒數
+
+    # LLM 回覆緩存（僅對顯式 cache=True 的調用生效）
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_DIR: str = ".cache"               # SQLite 緩存文件目錄（相對 backend/）
+    LLM_CACHE_TTL: int = 7 * 24 * 3600          # 緩存有效期（秒）
+    LLM_CACHE_MEMORY_ITEMS: int = 512           # 內存 LRU 條目上限
+    LLM_CACHE_DISK_MAX_MB: int = 200            # 磁盤緩存總大小上限
+    LLM_SINGLE_FLIGHT: bool = True              # 合併同時在途的相同請求
+
+    # LLM 容錯：重試 / 空閒超時 / 對沖請求 / 熔斷
+    LLM_MAX_RETRIES: int = 2                    # 首 token 前的可重試錯誤最多重試次數
+    LLM_RETRY_BASE_DELAY: float = 0.5           # 指數退避基數（秒，帶隨機抖動）
+    LLM_RETRY_MAX_DELAY: float = 4.0            # 單次退避上限（秒）
+    LLM_FIRST_TOKEN_TIMEOUT: float = 30.0       # 流式請求等待首個 token 的上限（秒）
+    LLM_STREAM_IDLE_TIMEOUT: float = 30.0       # 流式輸出中途超過此秒數無數據即中止
+    LLM_HEDGE_ENABLED: bool = False             # 首 token 過慢時發起對沖請求
+    LLM_HEDGE_PERCENTILE: float = 95.0          # 觸發對沖的首 token 延遲分位數
+    LLM_HEDGE_MIN_DELAY: float = 2.0            # 對沖觸發點下限（秒）
+    LLM_BREAKER_FAILURES: int = 5               # 連續失敗多少次後熔斷
+    LLM_BREAKER_RESET_TIMEOUT: float = 30.0     # 熔斷冷卻秒數，之後放行一個探測請求
+
+    # Prompt 輸入預算（估算 token 數，超出時裁剪歷史消息 / 檔案內容）
+    LLM_AGENT_INPUT_BUDGET: int = 6000          # 精進旅程 Agent 對話
+    LLM_MODULE_INPUT_BUDGET: int = 3000         # 各模組端點
+
+    # Agent 對話滾動摘要（移出歷史窗口的消息在後台壓縮進對話摘要）
+    AGENT_DIGEST_ENABLED: bool = True
+    AGENT_DIGEST_BATCH: int = 10                # 窗口外累計多少條未摘要消息才觸發一次壓縮
+    AGENT_DIGEST_MAX_TOKENS: int = 600          # 摘要長度上限（估算 token 數）
+
+    # Agent 對話結果後寫隊列（狀態先回覆，消息 / ACTION / 階段推進在後台批量落庫）
+    AGENT_WRITE_BATCH_SIZE: int = 50            # 單個事務最多合併的對話輪數
+    AGENT_WRITE_FLUSH_INTERVAL: float = 0.02    # 湊批等待秒數
+    AGENT_WRITE_MAX_QUEUE: int = 1000           # 待寫隊列上限，滿時提交方等待
+
+    # Agent 對話輪次串行化、冪等重放與斷點續傳
+    AGENT_TURN_REPLAY_TTL: float = 600.0        # 已完成輪次保留供重放 / 續傳的秒數
+    AGENT_TURN_REPLAY_MAX: int = 500            # 保留的已完成輪次數上限（超出淘汰最早完成的）
+    AGENT_TURN_ORPHAN_GRACE: float = 15.0       # 客戶端斷開後輪次繼續生成、等待重連的秒數
+
+    # 旅程 Markdown 導出（流式生成，渲染結果按對話緩存）
+    EXPORT_PAGE_SIZE: int = 200                 # 對話記錄每頁讀取的消息數
+    EXPORT_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # 導出緩存總大小上限（字節）
+    EXPORT_BULK_YIELD_PER: int = 500            # 批量導出時服務端游標每次讀取的行數
+    EXPORT_BULK_MAX_STUDENTS: int = 500         # 單次批量導出的學生數上限
+
+    # 學生 Prompt 上下文緩存（檔案寫入後自動失效）
+    STUDENT_CONTEXT_CACHE_ITEMS: int = 1000     # 緩存學生數上限（LRU 淘汰）
+    STUDENT_CONTEXT_CACHE_TTL: float = 300.0    # 條目最長有效秒數（兜底多進程部署）
+
     # 訊飛語音 API
     XUNFEI_APP_ID: str = ""
     XUNFEI_API_KEY: str = ""
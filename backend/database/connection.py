@@ -1,7 +1,7 @@
 import logging
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 from config import get_settings
 
 logger = logging.getLogger("jingjin")
@@ -25,9 +25,9 @@ async def get_db() -> AsyncSession:
             raise
 
 
-async def init_db():
+async def init_db() -> set[str]:
     """
-    初始化數據庫表結構。
+    初始化數據庫表結構，返回本次新建的表名。
     使用 checkfirst=True（create_all 默認行為）：
     - 如果表已存在，跳過不覆蓋
     - 如果表不存在，自動建立
@@ -57,3 +57,57 @@ async def init_db():
             logger.info(f"  新建數據表: {', '.join(created)}")
         else:
             logger.info("  所有表已存在，無需變更（數據完整保留）")
+
+        # create_all 不會給已有表補建新增的欄位和索引，這裡補上
+        columns = await conn.run_sync(_ensure_columns)
+        if columns:
+            logger.info(f"  新增欄位: {', '.join(columns)}")
+        added = await conn.run_sync(_ensure_indexes)
+        if added:
+            logger.info(f"  新建索引: {', '.join(added)}")
+    return created
+
+
+def _ensure_columns(sync_conn) -> list[str]:
+    """為已有表補建模型中新增的欄位（可空，或帶 server_default；只增不改，已有欄位和數據不受影響）"""
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+    preparer = sync_conn.dialect.identifier_preparer
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            col_type = column.type.compile(dialect=sync_conn.dialect)
+            if column.nullable:
+                constraint = "NULL"
+            elif column.server_default is not None:
+                constraint = f"NOT NULL DEFAULT {column.server_default.arg}"
+            else:
+                logger.warning(f"  欄位 {table.name}.{column.name} 不可為空且無默認值，無法自動補建，請手動遷移")
+                continue
+            sync_conn.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"ADD COLUMN {preparer.format_column(column)} {col_type} {constraint}"
+            ))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _ensure_indexes(sync_conn) -> list[str]:
+    """為已有表補建模型中聲明、但數據庫中尚不存在的索引（只增不刪）"""
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables or not table.indexes:
+            continue
+        present = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(sync_conn)
+                added.append(index.name)
+    return added
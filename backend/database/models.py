@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, Text, Float, DateTime, ForeignKey, JSON, Enum
+    Column, Integer, String, Text, Float, DateTime, ForeignKey, JSON, Enum, Index
 )
 from sqlalchemy.orm import relationship
 from database.connection import Base
@@ -234,6 +234,10 @@ class ConversationStatus(str, enum.Enum):
 class Conversation(Base):
     """Agent 對話會話 — 串聯七大模組的精進旅程"""
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 對話列表按 (updated_at, id) 倒序游標分頁，只掃描當頁所需的行
+        Index("ix_conversations_student_updated", "student_id", "updated_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     student_id = Column(Integer, ForeignKey("students.id"))
@@ -241,6 +245,9 @@ class Conversation(Base):
     scenario = Column(Enum(ScenarioType), default=ScenarioType.ACADEMIC)
     current_phase = Column(String(50), default="time_compass")
     phase_context = Column(JSON, default=dict)     # 各階段收集到的關鍵信息
+    history_digest = Column(Text, nullable=True)   # 歷史窗口之外的早前對話摘要（後台滾動更新）
+    digest_upto_id = Column(Integer, nullable=True)  # 已納入摘要的最後一條消息 ID
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # 樂觀鎖版本號
     status = Column(Enum(ConversationStatus), default=ConversationStatus.ACTIVE)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -248,12 +255,19 @@ class Conversation(Base):
     student = relationship("Student", backref="conversations")
     messages = relationship("ChatMessage", back_populates="conversation",
                             cascade="all, delete-orphan",
-                            order_by="ChatMessage.created_at")
+                            order_by="(ChatMessage.created_at, ChatMessage.id)")
+
+    # ORM 更新時帶上 WHERE version = 舊值 並自增；期間被其他事務修改則拋出 StaleDataError
+    __mapper_args__ = {"version_id_col": version}
 
 
 class ChatMessage(Base):
     """對話消息"""
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # 按對話取最近 N 條消息（ORDER BY created_at DESC, id DESC LIMIT N）走索引，不掃全對話
+        Index("ix_chat_messages_conv_created", "conversation_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
@@ -264,3 +278,25 @@ class ChatMessage(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     conversation = relationship("Conversation", back_populates="messages")
+
+
+class ConversationArtifact(Base):
+    """Agent ACTION 在旅程中創建的記錄（刪除 / 導出 / 列出旅程數據時按索引定位，不再掃描消息 JSON）"""
+    __tablename__ = "conversation_artifacts"
+    __table_args__ = (
+        Index("ux_conversation_artifacts_target", "conversation_id", "kind", "target_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
+    kind = Column(String(30), nullable=False)      # time_entry / goal / action_plan / learning_record
+    target_id = Column(Integer, nullable=False)    # 對應表中的記錄 ID
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DataMigration(Base):
+    """已完成的後台數據遷移（如 conversation_artifacts 補建）；沒有記錄的遷移在下次啟動時重新執行"""
+    __tablename__ = "data_migrations"
+
+    name = Column(String(64), primary_key=True)
+    completed_at = Column(DateTime, default=datetime.utcnow)
@@ -1,9 +1,20 @@
 import logging
 import sys
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from database.connection import init_db
+from services.ai_service import init_http_client, close_http_client, get_llm_stats
+from services.llm_governor import LLMQueueFullError
+from services.llm_resilience import LLMCircuitOpenError
+from services.llm_usage import EndpointContextMiddleware
+from services import history_digest
+from services.turn_writer import turn_writer
+from services.turn_streams import turn_registry
+from services.conversation_export import export_cache
+from services.student_context import student_context_cache
+from services.conversation_artifacts import start_backfill
 
 # ===================== 統一日誌配置 =====================
 logging.basicConfig(
@@ -31,10 +42,19 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"✗ 數據庫初始化失敗: {e}")
         raise
+    # 從已有消息的 action_metadata 補建旅程關聯記錄（完成後記入 data_migrations，不再執行）
+    backfill = start_backfill()
+    await init_http_client()
     logger.info("✓ 後端服務就緒 (http://localhost:8000)")
     logger.info("  API 文檔: http://localhost:8000/docs")
     logger.info("=" * 50)
     yield
+    if backfill is not None and not backfill.done():
+        backfill.cancel()
+    await turn_registry.drain()
+    await turn_writer.stop()
+    await history_digest.drain()
+    await close_http_client()
     logger.info("精進學習系統 - 已停止")
 
 
@@ -51,7 +71,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # 對話列表的下一頁游標
 )
+# 記錄當前請求的端點，用於按端點統計 LLM 用量和上下文緩存命中率
+app.add_middleware(EndpointContextMiddleware)
+
+
+@app.exception_handler(LLMQueueFullError)
+async def llm_queue_full_handler(request: Request, exc: LLMQueueFullError):
+    """LLM 排隊已滿 → 429 + Retry-After"""
+    logger.warning(f"LLM 隊列已滿，拒絕請求: {request.url.path} ({exc.priority})")
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(LLMCircuitOpenError)
+async def llm_circuit_open_handler(request: Request, exc: LLMCircuitOpenError):
+    """DeepSeek 熔斷中 → 503 + Retry-After"""
+    logger.warning(f"LLM 熔斷中，拒絕請求: {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 # 延遲導入路由，避免循環引用
 from routers import (
@@ -83,4 +129,15 @@ app.include_router(voice.router, prefix="/api/voice", tags=["語音交互"])
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "ok", "message": "精進學習系統運行中"}
+    llm = get_llm_stats()
+    status = "degraded" if llm["resilience"]["circuit"]["state"] != "closed" else "ok"
+    return {
+        "status": status,
+        "message": "精進學習系統運行中",
+        "llm": llm,
+        "history_digest": history_digest.get_stats(),
+        "turn_writer": turn_writer.get_stats(),
+        "turn_registry": turn_registry.get_stats(),
+        "export_cache": export_cache.get_stats(),
+        "student_context": student_context_cache.get_stats(),
+    }
@@ -8,6 +8,7 @@ AI 回覆約定：
 3. 當前階段完成時，在回覆末尾附加：<!--PHASE_COMPLETE:{"summary":"本階段小結"}-->
 4. ACTION 和 PHASE_COMPLETE 標記對用戶不可見，由引擎解析處理
 """
+from prompts.compiled import CompiledPrompt, ContentMemo, compile_prompt, fingerprint
 
 # ===================== 階段定義 =====================
 
@@ -155,28 +156,48 @@ AGENT_SYSTEM_PROMPT = """你是「精進教練」，一個基於采銅《精進
 - ACTION 標記可以在任何時候使用，每當對話中產生了值得記錄的內容
 - PHASE_COMPLETE 只在你確信階段目標已達成時使用
 - 這些標記對學生不可見，你不需要提及它們
-- 每條回覆最多包含一個 ACTION 和一個 PHASE_COMPLETE
+- 每個 ACTION 標記保存一條記錄；同一條回覆中收集到多條記錄時（如多項時間活動），請逐條附加多個 ACTION 標記
+- 每條回覆最多包含一個 PHASE_COMPLETE
 - 不要在每條回覆都加標記，只在確實有結構化數據時才加
 """
 
 
-def build_phase_prompt(phase_key: str) -> str:
-    """構建當前階段的引導 Prompt"""
+def build_phase_definition(phase_key: str) -> str:
+    """單個階段的固定定義（不含「當前」等每輪變化的信息）"""
     phase = PHASES.get(phase_key)
     if not phase:
         return ""
 
     return f"""
-## 當前階段：{phase['name']}（第 {phase['order']}/7 步）
+### 第 {phase['order']} 步：{phase['name']}
 **書中章節**：{phase['book_chapter']}
 **引導目標**：{phase['goal']}
 **完成標準**：{phase['completion_criteria']}
-
-### 引導方向（參考，不必逐字照搬）：
+**引導方向**（參考，不必逐字照搬）：
 {chr(10).join(f'- {q}' for q in phase['guide_questions'])}
 """
 
 
+# 所有學生、所有階段共用且逐字節不變的 system prompt 前綴，
+# 以便命中 DeepSeek 的上下文緩存（按前綴匹配）
+AGENT_STATIC_PROMPT = "\n".join(
+    [AGENT_SYSTEM_PROMPT, "## 七步階段定義"] + [build_phase_definition(k) for k in PHASE_ORDER]
+)
+
+
+def build_phase_prompt(phase_key: str) -> str:
+    """構建當前階段的引導 Prompt（階段細節見靜態前綴中的階段定義）"""
+    phase = PHASES.get(phase_key)
+    if not phase:
+        return ""
+
+    return f"""
+## 當前階段：{phase['name']}（第 {phase['order']}/7 步）
+請按上方「第 {phase['order']} 步：{phase['name']}」的引導目標和完成標準帶領學生，
+本階段目標達成後再附加 PHASE_COMPLETE 標記。
+"""
+
+
 def build_phase_context_prompt(phase_context: dict) -> str:
     """構建前序階段成果的上下文 Prompt"""
     if not phase_context:
@@ -212,35 +233,100 @@ def build_phase_context_prompt(phase_context: dict) -> str:
     return "\n".join(parts) if len(parts) > 1 else ""
 
 
+def build_history_digest_prompt(history_digest: str) -> str:
+    """構建早前對話摘要的上下文 Prompt"""
+    if not history_digest:
+        return ""
+    return f"\n## 早前對話摘要（更早的對話已不在下方消息中，請延續其中的信息）\n{history_digest}"
+
+
+# ===================== 編譯後的靜態片段 =====================
+
+AGENT_SCENARIO_LABELS = {
+    "academic": "學科提升",
+    "expression": "表達能力提升",
+    "interview": "面試能力提升",
+}
+
+AGENT_STATIC = compile_prompt(AGENT_STATIC_PROMPT)
+AGENT_SCENARIO_SECTIONS = {
+    key: compile_prompt(f"\n## 場景：{label}") for key, label in AGENT_SCENARIO_LABELS.items()
+}
+AGENT_PHASE_SECTIONS = {key: compile_prompt(build_phase_prompt(key)) for key in PHASE_ORDER}
+
+# (階段, 場景) → 模板指紋：靜態前綴、場景段、階段段任一改動都會改變指紋
+AGENT_TEMPLATE_FINGERPRINTS = {
+    (phase, scenario): fingerprint(
+        AGENT_STATIC.fingerprint,
+        AGENT_SCENARIO_SECTIONS[scenario].fingerprint,
+        AGENT_PHASE_SECTIONS[phase].fingerprint,
+    )
+    for phase in PHASE_ORDER
+    for scenario in AGENT_SCENARIO_LABELS
+}
+
+# 前序階段成果按內容哈希記憶化（同一對話在同一階段內每輪內容相同）
+phase_context_memo = ContentMemo(build_phase_context_prompt)
+
+
+def _scenario_section(scenario: str) -> CompiledPrompt:
+    section = AGENT_SCENARIO_SECTIONS.get(scenario)
+    return section if section is not None else compile_prompt(f"\n## 場景：{scenario}")
+
+
+def _phase_section(phase_key: str) -> CompiledPrompt:
+    section = AGENT_PHASE_SECTIONS.get(phase_key)
+    return section if section is not None else compile_prompt(build_phase_prompt(phase_key))
+
+
+def agent_prompt_fingerprint(phase_key: str, scenario: str) -> str:
+    """Agent system prompt 的模板指紋（不含學生檔案、前序成果等動態內容）"""
+    fp = AGENT_TEMPLATE_FINGERPRINTS.get((phase_key, scenario))
+    if fp is None:
+        fp = fingerprint(
+            AGENT_STATIC.fingerprint,
+            _scenario_section(scenario).fingerprint,
+            _phase_section(phase_key).fingerprint,
+        )
+    return fp
+
+
 def build_agent_system_prompt(
     phase_key: str,
     scenario: str,
     student_context: str,
     phase_context: dict,
+    history_digest: str = "",
 ) -> str:
-    """組裝完整的 Agent System Prompt"""
-    parts = [AGENT_SYSTEM_PROMPT]
-
-    # 場景
-    scenario_labels = {
-        "academic": "學科提升",
-        "expression": "表達能力提升",
-        "interview": "面試能力提升",
-    }
-    parts.append(f"\n## 場景：{scenario_labels.get(scenario, scenario)}")
+    """組裝完整的 Agent System Prompt
 
-    # 當前階段
-    parts.append(build_phase_prompt(phase_key))
-
-    # 前序階段成果
-    ctx_prompt = build_phase_context_prompt(phase_context)
-    if ctx_prompt:
-        parts.append(ctx_prompt)
+    固定內容（AGENT_STATIC_PROMPT）在前且逐字節不變，
+    隨學生 / 對話 / 階段變化的內容依次追加在後：個人檔案 → 場景 → 前序成果 → 早前對話摘要 → 當前階段。
+    靜態片段取自導入時編譯好的模板，前序成果按內容記憶化。
+    """
+    parts = [AGENT_STATIC.text]
 
     # 學生檔案
     if student_context:
         parts.append(f"\n{student_context}")
 
+    # 場景
+    parts.append(_scenario_section(scenario).text)
+
+    # 前序階段成果
+    if phase_context:
+        ctx_prompt = phase_context_memo.get(phase_context).text
+        if ctx_prompt:
+            parts.append(ctx_prompt)
+
+    # 早前對話摘要（只在後台壓縮後變化）
+    digest_prompt = build_history_digest_prompt(history_digest)
+    if digest_prompt:
+        parts.append(digest_prompt)
+
+    # 當前階段
+    parts.append(_phase_section(phase_key).text)
+
     return "\n".join(parts)
 
 
@@ -273,3 +359,27 @@ def get_phase_opening(phase_key: str, phase_context: dict) -> str:
             f"（現在開始「{phase['name']}」階段。"
             f"引導目標：{phase['goal']}。請自然地開始引導。）"
         )
+
+
+# ===================== 對話滾動摘要 =====================
+
+HISTORY_DIGEST_PROMPT = """你負責為「精進教練」整理一段精進旅程的早前對話摘要。
+教練之後只能看到最近的若干條消息，更早的內容全靠這份摘要記住。
+
+要求：
+1. 在「已有摘要」的基礎上併入「新增對話」，輸出一份完整的新摘要（不是只寫新增部分）
+2. 保留對後續引導有用的事實：學生的時間安排、目標、假設、計劃、學到的知識、困惑、情緒和承諾
+3. 按時間順序用簡短條目書寫，使用繁體中文，不寫寒暄和教練的提問措辭
+4. 總長度控制在 {max_chars} 字以內，超出時合併或刪去最不重要的舊條目
+5. 只輸出摘要本身"""
+
+
+HISTORY_DIGEST_FINGERPRINT = fingerprint(HISTORY_DIGEST_PROMPT)
+
+
+def build_history_digest_messages(previous_digest: str, transcript: str, max_chars: int) -> list[dict]:
+    """構建滾動摘要請求的 messages"""
+    return [
+        {"role": "system", "content": HISTORY_DIGEST_PROMPT.format(max_chars=max_chars)},
+        {"role": "user", "content": f"【已有摘要】\n{previous_digest or '（暫無）'}\n\n【新增對話】\n{transcript}"},
+    ]
@@ -0,0 +1,61 @@
+"""
+Prompt 編譯層
+靜態 Prompt 片段（模組 × 場景、階段 × 場景）在導入時渲染一次，存為不可變的 CompiledPrompt，
+並附帶由內容計算的穩定指紋：Prompt 文案一改指紋即變，可與延遲、上下文緩存命中率對應起來。
+隨對話變化的片段（前序階段成果）按內容哈希記憶化，同一內容只渲染一次。
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Callable, NamedTuple
+
+from services.token_budget import estimate_tokens
+
+FINGERPRINT_LENGTH = 12
+
+
+def fingerprint(*parts: str) -> str:
+    """內容指紋（sha256 前 12 位）；多個片段按順序組合"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+class CompiledPrompt(NamedTuple):
+    text: str
+    fingerprint: str
+    tokens: int         # 估算 token 數（編譯時算一次）
+
+
+def compile_prompt(text: str) -> CompiledPrompt:
+    return CompiledPrompt(text, fingerprint(text), estimate_tokens(text))
+
+
+class ContentMemo:
+    """按輸入內容記憶化的渲染結果（LRU，條目數有上限）"""
+
+    def __init__(self, render: Callable[[dict], str], max_items: int = 1024):
+        self.render = render
+        self.max_items = max_items
+        self._items: OrderedDict[str, CompiledPrompt] = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, data: dict) -> CompiledPrompt:
+        # repr 即內容的規範文本（鍵順序由寫入方固定），比 json.dumps + sha256 便宜得多；
+        # 指紋只在未命中時對渲染結果計算一次
+        key = repr(data)
+        compiled = self._items.get(key)
+        if compiled is not None:
+            self._items.move_to_end(key)
+            self._stats["hits"] += 1
+            return compiled
+        self._stats["misses"] += 1
+        compiled = compile_prompt(self.render(data))
+        self._items[key] = compiled
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        return compiled
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "size": len(self._items)}
@@ -2,6 +2,10 @@
 精進學習系統 AI Prompt 模板
 基於《精進：如何成為一個很厲害的人》七大維度設計
 """
+from typing import Optional
+
+from prompts.compiled import CompiledPrompt, compile_prompt
+from services.token_budget import estimate_tokens
 
 SYSTEM_BASE = """你是「精進學習助手」，一個專為中學生設計的 AI 學習教練。
 你的設計理念來自采銅的《精進：如何成為一個很厲害的人》，核心信念是：
@@ -11,8 +15,27 @@ SYSTEM_BASE = """你是「精進學習助手」，一個專為中學生設計的
 回覆必須使用繁體中文（正體中文），絕對不要使用簡體字。"""
 
 
-def build_student_context(student_info: dict) -> str:
-    """根據個人檔案生成 Prompt 上下文前綴"""
+# 檔案超出預算時逐級裁剪：(興趣條數, 反饋條數, 長文本欄位截斷字數)
+_CONTEXT_LEVELS = [
+    (5, 3, None),
+    (5, 2, 200),
+    (3, 1, 100),
+    (3, 0, 60),
+    (0, 0, 30),
+]
+
+
+def _clip(text, limit: Optional[int]) -> str:
+    text = str(text)
+    return text if limit is None or len(text) <= limit else text[:limit] + "…"
+
+
+def _student_context_parts(
+    student_info: dict,
+    max_interests: int,
+    max_feedback: int,
+    text_limit: Optional[int],
+) -> list[str]:
     ctx_parts = [f"【學生檔案】姓名：{student_info.get('name', '同學')}"]
 
     if student_info.get("grade"):
@@ -20,11 +43,11 @@ def build_student_context(student_info: dict) -> str:
     if student_info.get("school"):
         ctx_parts.append(f"學校：{student_info['school']}")
     if student_info.get("target_direction"):
-        ctx_parts.append(f"目標方向：{student_info['target_direction']}")
+        ctx_parts.append(f"目標方向：{_clip(student_info['target_direction'], text_limit)}")
     if student_info.get("personality"):
-        ctx_parts.append(f"性格特點：{student_info['personality']}")
+        ctx_parts.append(f"性格特點：{_clip(student_info['personality'], text_limit)}")
     if student_info.get("learning_style"):
-        ctx_parts.append(f"學習風格：{student_info['learning_style']}")
+        ctx_parts.append(f"學習風格：{_clip(student_info['learning_style'], text_limit)}")
 
     # 能力畫像
     ability = student_info.get("ability_profile")
@@ -38,19 +61,41 @@ def build_student_context(student_info: dict) -> str:
                         f"深度:{ability.get('depth_score',50)} 獨特性:{ability.get('uniqueness_score',50)}")
 
     # 興趣
-    interests = student_info.get("interests", [])
+    interests = student_info.get("interests", [])[:max_interests]
     if interests:
-        interest_str = "、".join([f"{i['topic']}(深度{i['depth']})" for i in interests[:5]])
+        interest_str = "、".join([f"{i['topic']}(深度{i['depth']})" for i in interests])
         ctx_parts.append(f"【興趣圖譜】{interest_str}")
 
     # 反饋摘要
-    feedback = student_info.get("feedback_summaries", [])
-    if feedback:
-        for fb in feedback[:3]:
-            ctx_parts.append(f"【{fb.get('scenario','')}反饋】優勢：{fb.get('strengths','待評估')} | "
-                           f"短板：{fb.get('weaknesses','待評估')} | 趨勢：{fb.get('progress_trend','待觀察')}")
-
-    return "\n".join(ctx_parts)
+    feedback = student_info.get("feedback_summaries", [])[:max_feedback]
+    for fb in feedback:
+        ctx_parts.append(f"【{fb.get('scenario','')}反饋】優勢：{_clip(fb.get('strengths') or '待評估', text_limit)} | "
+                       f"短板：{_clip(fb.get('weaknesses') or '待評估', text_limit)} | "
+                       f"趨勢：{_clip(fb.get('progress_trend') or '待觀察', text_limit)}")
+
+    return ctx_parts
+
+
+def build_student_context(
+    student_info: dict,
+    max_tokens: Optional[int] = None,
+    memo: Optional[dict] = None,
+) -> str:
+    """根據個人檔案生成 Prompt 上下文前綴
+
+    指定 max_tokens 時按 _CONTEXT_LEVELS 逐級裁剪反饋、興趣和長文本，
+    直到估算 token 數不超過預算（最後一級無論大小都返回）。
+    memo 為按 max_tokens 記錄渲染結果的字典（見 services.student_context），同一預算直接複用。
+    """
+    if memo is not None and max_tokens in memo:
+        return memo[max_tokens]
+    for level in _CONTEXT_LEVELS:
+        text = "\n".join(_student_context_parts(student_info, *level))
+        if max_tokens is None or estimate_tokens(text) <= max_tokens:
+            break
+    if memo is not None:
+        memo[max_tokens] = text
+    return text
 
 
 # ===================== 七大模組 Prompt =====================
@@ -189,20 +234,50 @@ SCENARIO_PROMPTS = {
 }
 
 
-def build_full_prompt(module: str, scenario: str = None, student_info: dict = None) -> str:
-    """組裝完整的 System Prompt"""
-    parts = []
+# ===================== 編譯後的模板 =====================
 
-    # 1. 模組 Prompt
-    module_prompt = MODULE_PROMPTS.get(module, {})
-    parts.append(module_prompt.get("system", SYSTEM_BASE))
-
-    # 2. 場景修飾
+def _render_module_template(module: str, scenario: Optional[str]) -> str:
+    parts = [MODULE_PROMPTS.get(module, {}).get("system", SYSTEM_BASE)]
     if scenario and scenario in SCENARIO_PROMPTS:
         parts.append(SCENARIO_PROMPTS[scenario])
+    return "\n".join(parts)
 
-    # 3. 個人檔案上下文
-    if student_info:
-        parts.append("\n" + build_student_context(student_info))
 
-    return "\n".join(parts)
+# (模組, 場景) → 編譯後的模板；場景為 None 表示不帶場景修飾
+MODULE_TEMPLATES = {
+    (module, scenario): compile_prompt(_render_module_template(module, scenario))
+    for module in MODULE_PROMPTS
+    for scenario in [None, *SCENARIO_PROMPTS]
+}
+
+
+def get_module_template(module: str, scenario: Optional[str] = None) -> CompiledPrompt:
+    """模組 + 場景的靜態 Prompt（未知場景按無場景處理，未知模組使用 SYSTEM_BASE）"""
+    if scenario not in SCENARIO_PROMPTS:
+        scenario = None
+    template = MODULE_TEMPLATES.get((module, scenario))
+    if template is None:
+        template = MODULE_TEMPLATES[(module, scenario)] = compile_prompt(_render_module_template(module, scenario))
+    return template
+
+
+def build_full_prompt(
+    module: str,
+    scenario: str = None,
+    student_info: dict = None,
+    max_tokens: Optional[int] = None,
+    memo: Optional[dict] = None,
+) -> str:
+    """組裝完整的 System Prompt
+
+    max_tokens 為整個 system prompt 的預算；模組和場景 Prompt 固定保留（取自編譯好的模板），
+    剩餘預算留給個人檔案（不足時按優先級裁剪，memo 見 build_student_context）。
+    """
+    template = get_module_template(module, scenario)
+    if not student_info:
+        return template.text
+
+    ctx_budget = None
+    if max_tokens is not None:
+        ctx_budget = max(0, max_tokens - template.tokens)
+    return template.text + "\n\n" + build_student_context(student_info, ctx_budget, memo)
@@ -7,7 +7,8 @@ from database.connection import get_db
 from database.models import ActionPlan, LearningRecord, Question
 from schemas import ActionPlanCreate, ActionPlanOut, LearningRecordCreate, LearningRecordOut
 from services.ai_service import get_ai_response
-from services.learning_engine import get_student_full, student_to_context, smart_recommend_questions
+from services.learning_engine import smart_recommend_questions
+from services.student_context import get_student_context
 import json
 from datetime import datetime
 
@@ -34,8 +35,7 @@ async def create_plan(student_id: int, data: ActionPlanCreate, db: AsyncSession
 @router.post("/{student_id}/decompose-task")
 async def decompose_task(student_id: int, task_description: str, db: AsyncSession = Depends(get_db)):
     """圖層工作法 - AI 分解任務"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     message = (
         f"我要完成以下任務：{task_description}\n\n"
@@ -72,8 +72,7 @@ async def recommend_questions(student_id: int, scenario: str, db: AsyncSession =
 @router.post("/{student_id}/submit-practice")
 async def submit_practice(student_id: int, data: LearningRecordCreate, db: AsyncSession = Depends(get_db)):
     """提交練習並獲取 AI 即時反饋"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     # 如果有關聯題目，獲取題目信息
     question_info = ""
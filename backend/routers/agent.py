@@ -1,27 +1,38 @@
 """精進旅程 Agent 路由 — 引導式對話"""
 import json
-import re
 import logging
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse, Response
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
-from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.orm import aliased, selectinload
 
 from database.connection import get_db, async_session
-from database.models import (
-    Conversation, ChatMessage, TimeEntry, Goal, ActionPlan, LearningRecord,
-)
+from database.models import Conversation, ChatMessage, Student
 from schemas import (
-    ConversationCreate, ConversationUpdate, ConversationOut,
-    ConversationDetailOut, ChatMessageOut, AgentChatRequest,
+    ConversationCreate, ConversationUpdate, ConversationOut, ConversationListItemOut,
+    ConversationDetailOut, ChatMessageOut, ChatMessagePageOut, AgentChatRequest, ConversationArtifactsOut,
+)
+from services.agent_engine import (
+    prepare_chat_turn, prepare_start_turn, stream_reply, finish_turn, preview_state, strip_markers,
 )
-from services.agent_engine import agent_chat_stream, start_conversation_stream
+from services.conversation_artifacts import backfill_artifacts, delete_artifacts, load_artifacts
+from services.bulk_export import export_ndjson, export_zip, parse_cursor
+from services.conversation_export import export_cache, export_markdown
+from services.marker_scanner import MarkerScanner
+from services.turn_writer import turn_writer
+from services.turn_streams import IdempotencyConflict, TurnStream, parse_event_id, turn_registry
+from services.ai_service import admit_stream
 from prompts.agent_prompts import PHASES, PHASE_ORDER
+from config import get_settings
 
 router = APIRouter()
 logger = logging.getLogger("jingjin.agent")
+settings = get_settings()
+
+LIST_PREVIEW_CHARS = 80  # 對話列表中最後一條消息的預覽長度
 
 
 @router.post("/{student_id}/conversations", response_model=ConversationOut)
@@ -45,18 +56,80 @@ async def create_conversation(
     return conv
 
 
-@router.get("/{student_id}/conversations", response_model=list[ConversationOut])
+def _keyset_cursor(at: datetime, row_id: int) -> str:
+    """(時間, ID) 分頁游標"""
+    return f"{at.isoformat()},{row_id}"
+
+
+def _parse_keyset_cursor(raw: str) -> tuple[datetime, int]:
+    at, _, row_id = raw.rpartition(",")
+    try:
+        return datetime.fromisoformat(at), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"無效的分頁游標: {raw}")
+
+
+@router.get("/{student_id}/conversations", response_model=list[ConversationListItemOut])
 async def list_conversations(
     student_id: int,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
 ):
-    """列出學生的所有對話"""
-    result = await db.execute(
-        select(Conversation)
+    """
+    按最近更新倒序分頁列出學生的對話（游標為上一頁最後一條的 (updated_at, id)，
+    下一頁游標在 X-Next-Cursor 響應頭中，沒有更多時不返回）。
+    消息數和最後一條消息由關聯子查詢在同一條 SQL 中取出，走 (conversation_id, created_at, id) 索引。
+    """
+    message_count = (
+        select(func.count(ChatMessage.id))
+        .where(ChatMessage.conversation_id == Conversation.id)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    last_message = (
+        select(ChatMessage.id)
+        .where(ChatMessage.conversation_id == Conversation.id, ChatMessage.role != "system")
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(1)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    last = aliased(ChatMessage)
+    stmt = (
+        select(Conversation, message_count, last.role, last.content)
+        .outerjoin(last, last.id == last_message)
         .where(Conversation.student_id == student_id)
-        .order_by(Conversation.updated_at.desc())
+        .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)
     )
-    return result.scalars().all()
+    if cursor:
+        updated_at, conv_id = _parse_keyset_cursor(cursor)
+        stmt = stmt.where(or_(
+            Conversation.updated_at < updated_at,
+            and_(Conversation.updated_at == updated_at, Conversation.id < conv_id),
+        ))
+    rows = (await db.execute(stmt)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for conv, count, role, content in rows:
+        item = ConversationListItemOut.model_validate(conv)
+        item.message_count = count
+        if content is not None:
+            preview = strip_markers(content)
+            item.last_message = preview[:LIST_PREVIEW_CHARS] + ("…" if len(preview) > LIST_PREVIEW_CHARS else "")
+            item.last_message_role = role
+        ctx = conv.phase_context or {}
+        item.completed_phases = sum(1 for key in PHASE_ORDER if key in ctx)
+        item.total_phases = len(PHASE_ORDER)
+        items.append(item)
+    if has_more:
+        last_conv = rows[-1][0]
+        response.headers["X-Next-Cursor"] = _keyset_cursor(last_conv.updated_at, last_conv.id)
+    return items
 
 
 @router.patch("/{student_id}/conversations/{conv_id}", response_model=ConversationOut)
@@ -67,6 +140,7 @@ async def update_conversation(
     db: AsyncSession = Depends(get_db),
 ):
     """更新對話（重命名等）"""
+    await turn_writer.barrier(conv_id)
     result = await db.execute(
         select(Conversation)
         .where(Conversation.id == conv_id, Conversation.student_id == student_id)
@@ -86,60 +160,25 @@ async def delete_conversation(
     conv_id: int,
     db: AsyncSession = Depends(get_db),
 ):
-    """刪除精進旅程及其所有關聯數據"""
-    # 1. 查詢 conversation + messages
-    result = await db.execute(
-        select(Conversation)
-        .options(selectinload(Conversation.messages))
+    """刪除精進旅程及其所有關聯數據（按 conversation_artifacts 索引批量刪除，不加載消息）"""
+    await turn_writer.barrier(conv_id)
+    # 表上線前的舊對話可能尚未補建關聯記錄（全量補建未完成或失敗），先補建本對話再刪除，
+    # 在本請求的事務第一次讀取之前執行，保證刪除時能看到補建的行
+    await backfill_artifacts(conversation_id=conv_id)
+    found = await db.scalar(
+        select(Conversation.id)
         .where(Conversation.id == conv_id, Conversation.student_id == student_id)
     )
-    conv = result.scalar_one_or_none()
-    if not conv:
+    if found is None:
         raise HTTPException(status_code=404, detail="對話不存在")
 
-    # 2. 從 action_metadata 收集所有由 Agent ACTION 創建的關聯記錄 ID
-    entry_ids = []
-    goal_ids = []
-    plan_ids = []
-    record_ids = []
-
-    for msg in conv.messages:
-        meta = msg.action_metadata
-        if not meta or not isinstance(meta, dict):
-            continue
-        action = meta.get("action")
-        if not action or not isinstance(action, dict):
-            continue
-        if action.get("success"):
-            if "entry_id" in action:
-                entry_ids.append(action["entry_id"])
-            if "goal_id" in action:
-                goal_ids.append(action["goal_id"])
-            if "plan_id" in action:
-                plan_ids.append(action["plan_id"])
-            if "record_id" in action:
-                record_ids.append(action["record_id"])
-
-    # 3. 批量刪除關聯數據
-    deleted_counts = {}
-    if entry_ids:
-        r = await db.execute(delete(TimeEntry).where(TimeEntry.id.in_(entry_ids)))
-        deleted_counts["time_entries"] = r.rowcount
-    if goal_ids:
-        # 先刪除關聯的 action_plans（goal_id FK）
-        await db.execute(delete(ActionPlan).where(ActionPlan.goal_id.in_(goal_ids)))
-        r = await db.execute(delete(Goal).where(Goal.id.in_(goal_ids)))
-        deleted_counts["goals"] = r.rowcount
-    if plan_ids:
-        r = await db.execute(delete(ActionPlan).where(ActionPlan.id.in_(plan_ids)))
-        deleted_counts["action_plans"] = r.rowcount
-    if record_ids:
-        r = await db.execute(delete(LearningRecord).where(LearningRecord.id.in_(record_ids)))
-        deleted_counts["learning_records"] = r.rowcount
-
-    # 4. 刪除 conversation（chat_messages 由 cascade 自動刪除）
-    await db.delete(conv)
-    await db.flush()
+    # 1. 批量刪除由 Agent ACTION 創建的關聯記錄
+    deleted_counts = await delete_artifacts(db, conv_id)
+
+    # 2. 刪除消息和 conversation
+    await db.execute(delete(ChatMessage).where(ChatMessage.conversation_id == conv_id))
+    await db.execute(delete(Conversation).where(Conversation.id == conv_id))
+    export_cache.discard(conv_id)
 
     logger.info(
         f"刪除旅程: conv={conv_id}, student={student_id}, "
@@ -148,36 +187,173 @@ async def delete_conversation(
     return {"ok": True, "deleted": deleted_counts}
 
 
+@router.get("/{student_id}/conversations/{conv_id}/artifacts", response_model=ConversationArtifactsOut)
+async def list_conversation_artifacts(
+    student_id: int,
+    conv_id: int,
+    db: AsyncSession = Depends(get_db),
+):
+    """列出旅程中由 Agent 保存的時間記錄、目標、行動計劃和學習記錄"""
+    await turn_writer.barrier(conv_id)
+    found = await db.scalar(
+        select(Conversation.id)
+        .where(Conversation.id == conv_id, Conversation.student_id == student_id)
+    )
+    if found is None:
+        raise HTTPException(status_code=404, detail="對話不存在")
+    artifacts = await load_artifacts(db, conv_id)
+    return ConversationArtifactsOut(
+        time_entries=artifacts["time_entry"],
+        goals=artifacts["goal"],
+        action_plans=artifacts["action_plan"],
+        learning_records=artifacts["learning_record"],
+    )
+
+
 @router.get("/{student_id}/conversations/{conv_id}", response_model=ConversationDetailOut)
 async def get_conversation(
     student_id: int,
     conv_id: int,
+    messages: bool = Query(True, description="為 false 時只返回對話狀態，消息改用 /messages 分頁加載"),
     db: AsyncSession = Depends(get_db),
 ):
     """獲取對話詳情（含歷史消息）"""
-    result = await db.execute(
-        select(Conversation)
-        .options(selectinload(Conversation.messages))
-        .where(Conversation.id == conv_id, Conversation.student_id == student_id)
-    )
-    conv = result.scalar_one_or_none()
+    await turn_writer.barrier(conv_id)
+    stmt = select(Conversation).where(Conversation.id == conv_id, Conversation.student_id == student_id)
+    if messages:
+        stmt = stmt.options(selectinload(Conversation.messages))
+    conv = (await db.execute(stmt)).scalar_one_or_none()
     if not conv:
         raise HTTPException(status_code=404, detail="對話不存在")
+    if not messages:
+        return ConversationDetailOut(**ConversationOut.model_validate(conv).model_dump())
     return conv
 
 
+@router.get("/{student_id}/conversations/{conv_id}/messages", response_model=ChatMessagePageOut)
+async def list_messages(
+    student_id: int,
+    conv_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    分頁獲取對話消息（不含 system）：不帶 before 時取最新 limit 條，
+    帶 before（上一頁返回的 next_before）時取其之前的 limit 條；每頁按時間正序返回。
+    助手消息中的 ACTION / PHASE_COMPLETE 標記已去掉。
+    """
+    await turn_writer.barrier(conv_id)
+    found = await db.scalar(
+        select(Conversation.id)
+        .where(Conversation.id == conv_id, Conversation.student_id == student_id)
+    )
+    if found is None:
+        raise HTTPException(status_code=404, detail="對話不存在")
+
+    stmt = (
+        select(ChatMessage)
+        .where(ChatMessage.conversation_id == conv_id, ChatMessage.role != "system")
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(limit + 1)
+    )
+    if before:
+        created_at, msg_id = _parse_keyset_cursor(before)
+        stmt = stmt.where(or_(
+            ChatMessage.created_at < created_at,
+            and_(ChatMessage.created_at == created_at, ChatMessage.id < msg_id),
+        ))
+    rows = (await db.execute(stmt)).scalars().all()
+    has_more = len(rows) > limit
+    page = list(reversed(rows[:limit]))
+
+    # 在輸出模型上清理標記，不改動 ORM 對象（否則會隨會話提交寫回數據庫）
+    out = []
+    for msg in page:
+        item = ChatMessageOut.model_validate(msg)
+        if msg.role == "assistant":
+            item.content = strip_markers(item.content)
+        out.append(item)
+    return ChatMessagePageOut(
+        messages=out,
+        has_more=has_more,
+        next_before=_keyset_cursor(page[0].created_at, page[0].id) if has_more else None,
+    )
+
+
+# /start 沒有請求體，以固定鍵去重：並發或重試的開場請求共用同一輪
+START_TURN_KEY = "start"
+
+
+def _turn_response(stream: TurnStream, last_event_id: Optional[str] = None) -> StreamingResponse:
+    """訂閱一輪對話的事件流；Last-Event-ID 屬於本輪時從下一個事件續傳，否則從頭重放"""
+    turn_id, seq = parse_event_id(last_event_id)
+    after = seq if turn_id == stream.turn_id else 0
+    return StreamingResponse(turn_registry.subscribe(stream, after), media_type="text/event-stream")
+
+
+def _attach_turn(conv_id: int, key: Optional[str], fingerprint: str) -> Optional[TurnStream]:
+    try:
+        return turn_registry.attach(conv_id, key, fingerprint)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+async def _ensure_conversation(student_id: int, conv_id: int) -> None:
+    async with async_session() as db:
+        found = await db.scalar(
+            select(Conversation.id)
+            .where(Conversation.id == conv_id, Conversation.student_id == student_id)
+        )
+    if found is None:
+        raise HTTPException(status_code=404, detail="對話不存在")
+
+
+@router.get("/{student_id}/conversations/{conv_id}/stream")
+async def resume_stream(
+    student_id: int,
+    conv_id: int,
+    last_event_id: Optional[str] = Header(None),
+):
+    """斷線重連：帶 Last-Event-ID 時從該事件之後續傳，不帶時從頭訂閱該對話最近一輪（SSE 流式）
+    輪次在斷線期間繼續生成，不會重新調用 AI；輪次已過期時返回 404，客戶端應改為重新加載對話。
+    """
+    await _ensure_conversation(student_id, conv_id)
+    turn_id, _ = parse_event_id(last_event_id)
+    stream = turn_registry.find(conv_id, turn_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="該輪對話已結束或已過期")
+    return _turn_response(stream, last_event_id)
+
+
+@router.post("/{student_id}/conversations/{conv_id}/stop")
+async def stop_turn(student_id: int, conv_id: int):
+    """停止生成：取消該對話正在生成的輪次（斷線不會取消輪次，主動停止需調用此接口）"""
+    await _ensure_conversation(student_id, conv_id)
+    return {"cancelled": turn_registry.cancel(conv_id)}
+
+
 @router.post("/{student_id}/conversations/{conv_id}/start")
-async def start_conversation(student_id: int, conv_id: int):
+async def start_conversation(
+    student_id: int,
+    conv_id: int,
+    last_event_id: Optional[str] = Header(None),
+):
     """啟動對話 — AI 發出第一條引導消息（SSE 流式）
-    使用自管理的 DB session 確保 StreamingResponse 期間 session 有效。
+    讀取和寫入各用一個短事務，AI 流式輸出期間不佔用數據庫連接。
     """
+    stream = _attach_turn(conv_id, START_TURN_KEY, str(student_id))
+    if stream is not None:
+        return _turn_response(stream, last_event_id)
+    # LLM 熔斷 / 隊列已滿時在響應開始前返回 503 / 429
+    admit_stream("interactive")
 
     async def event_generator():
-        async with async_session() as db:
-            try:
+        try:
+            await turn_writer.barrier(conv_id)
+            async with async_session() as db:
                 result = await db.execute(
                     select(Conversation)
-                    .options(selectinload(Conversation.messages))
                     .where(Conversation.id == conv_id, Conversation.student_id == student_id)
                 )
                 conv = result.scalar_one_or_none()
@@ -186,39 +362,58 @@ async def start_conversation(student_id: int, conv_id: int):
                     yield "data: [DONE]\n\n"
                     return
 
-                if conv.messages:
+                started = await db.scalar(
+                    select(ChatMessage.id).where(ChatMessage.conversation_id == conv.id).limit(1)
+                )
+                if started is not None:
                     yield f"data: {json.dumps({'error': '對話已啟動'}, ensure_ascii=False)}\n\n"
                     yield "data: [DONE]\n\n"
                     return
 
-                stream = start_conversation_stream(db, conv)
-                async for chunk in stream:
-                    yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
+                turn = await prepare_start_turn(db, conv)
 
-                await db.commit()
-                yield "data: [DONE]\n\n"
-            except Exception as e:
-                await db.rollback()
-                logger.error(f"Start conversation error: {e}")
-                yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
-                yield "data: [DONE]\n\n"
+            scanner = MarkerScanner()
+            async for chunk in stream_reply(turn.messages, scanner, "AI 開場調用失敗"):
+                yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+            await turn_writer.submit(finish_turn(turn, scanner))
+            yield "data: [DONE]\n\n"
+        except Exception as e:
+            logger.error(f"Start conversation error: {e}")
+            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+    return _turn_response(turn_registry.start(conv_id, START_TURN_KEY, str(student_id), event_generator))
 
 
 @router.post("/{student_id}/conversations/{conv_id}/chat")
-async def chat(student_id: int, conv_id: int, data: AgentChatRequest):
+async def chat(
+    student_id: int,
+    conv_id: int,
+    data: AgentChatRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=64),
+    last_event_id: Optional[str] = Header(None),
+):
     """發送消息並獲取 AI 回覆（SSE 流式）
-    使用自管理的 DB session 確保 StreamingResponse 期間 session 有效。
+    讀取和寫入各用一個短事務，AI 流式輸出期間不佔用數據庫連接。
+    同一對話的輪次串行執行；帶相同冪等鍵（請求體 idempotency_key 或 Idempotency-Key 頭）的重試
+    接入在途的輪次或重放已完成的結果（同時帶 Last-Event-ID 時從斷點續傳），不再重複調用 AI。
     """
     message = data.message
+    key = data.idempotency_key or idempotency_key
+    fingerprint = f"{student_id}:{message}"
+    stream = _attach_turn(conv_id, key, fingerprint)
+    if stream is not None:
+        return _turn_response(stream, last_event_id)
+    admit_stream("interactive")
 
     async def event_generator():
-        async with async_session() as db:
-            try:
+        try:
+            # 1. 等待上一輪結果落庫（讀己之寫），讀取對話元數據並組裝上下文，隨即釋放連接
+            await turn_writer.barrier(conv_id)
+            async with async_session() as db:
                 result = await db.execute(
                     select(Conversation)
-                    .options(selectinload(Conversation.messages))
                     .where(Conversation.id == conv_id, Conversation.student_id == student_id)
                 )
                 conv = result.scalar_one_or_none()
@@ -226,194 +421,48 @@ async def chat(student_id: int, conv_id: int, data: AgentChatRequest):
                     yield f"data: {json.dumps({'error': '對話不存在'}, ensure_ascii=False)}\n\n"
                     yield "data: [DONE]\n\n"
                     return
+                turn = await prepare_chat_turn(db, conv, message)
 
-                stream = agent_chat_stream(db, conv, message)
-                async for chunk in stream:
-                    yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
-
-                await db.commit()
+            # 2. 流式輸出（不持有數據庫連接）
+            scanner = MarkerScanner()
+            async for chunk in stream_reply(turn.messages, scanner, "AI 調用失敗"):
+                yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
 
-                # 發送最終的對話狀態更新
-                await db.refresh(conv)
-                state = {
-                    "type": "state_update",
-                    "current_phase": conv.current_phase,
-                    "phase_context": conv.phase_context,
-                    "status": conv.status.value if hasattr(conv.status, 'value') else str(conv.status),
-                }
-                yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
-                yield "data: [DONE]\n\n"
-            except Exception as e:
-                await db.rollback()
-                logger.error(f"Chat error: {e}")
-                yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
-                yield "data: [DONE]\n\n"
+            # 3. 按內存結果立即發送狀態更新；消息、ACTION、階段推進交給後寫隊列落庫
+            # （先入隊再回覆：客戶端在此後斷開也不會丟失本輪結果）
+            result = finish_turn(turn, scanner)
+            await turn_writer.submit(result)
+            yield f"data: {json.dumps(preview_state(result), ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        except Exception as e:
+            logger.error(f"Chat error: {e}")
+            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return _turn_response(turn_registry.start(conv_id, key, fingerprint, event_generator))
 
 
 @router.get("/{student_id}/conversations/{conv_id}/export")
-async def export_conversation(
-    student_id: int,
-    conv_id: int,
-    db: AsyncSession = Depends(get_db),
-):
-    """導出旅程為 Markdown 文件"""
-    ACTION_RE = re.compile(r"<!--ACTION:.*?-->", re.DOTALL)
-    PHASE_RE = re.compile(r"<!--PHASE_COMPLETE:.*?-->", re.DOTALL)
-
-    result = await db.execute(
-        select(Conversation)
-        .options(selectinload(Conversation.messages))
-        .where(Conversation.id == conv_id, Conversation.student_id == student_id)
-    )
-    conv = result.scalar_one_or_none()
+async def export_conversation(student_id: int, conv_id: int):
+    """導出旅程為 Markdown 文件（流式生成，對話記錄分頁讀取）"""
+    await turn_writer.barrier(conv_id)
+    # 響應體在依賴項退出後才開始生成，這裡用短會話只讀對話本身，消息由導出生成器分頁讀取
+    async with async_session() as db:
+        result = await db.execute(
+            select(Conversation).where(Conversation.id == conv_id, Conversation.student_id == student_id)
+        )
+        conv = result.scalar_one_or_none()
     if not conv:
         raise HTTPException(status_code=404, detail="對話不存在")
 
-    scenario_label = {"academic": "學科提升", "expression": "表達提升", "interview": "面試提升"}
-    status_label = {"active": "進行中", "completed": "已完成", "archived": "已歸檔"}
-    phase_names = {p: PHASES[p]["name"] for p in PHASE_ORDER}
-
-    lines: list[str] = []
-
-    # --- Header ---
-    lines.append(f"# 精進旅程：{conv.title}")
-    lines.append("")
-    scn = conv.scenario.value if hasattr(conv.scenario, "value") else str(conv.scenario)
-    sts = conv.status.value if hasattr(conv.status, "value") else str(conv.status)
-    lines.append(f"- **場景**：{scenario_label.get(scn, scn)}")
-    lines.append(f"- **狀態**：{status_label.get(sts, sts)}")
-    created = conv.created_at.strftime("%Y-%m-%d %H:%M") if conv.created_at else "—"
-    updated = conv.updated_at.strftime("%Y-%m-%d %H:%M") if conv.updated_at else "—"
-    lines.append(f"- **時間**：{created} ~ {updated}")
-    lines.append("")
-
-    # --- Phase overview ---
-    lines.append("## 旅程總覽")
-    lines.append("")
-    ctx = conv.phase_context or {}
-    current_idx = PHASE_ORDER.index(conv.current_phase) if conv.current_phase in PHASE_ORDER else 0
-    for i, key in enumerate(PHASE_ORDER):
-        name = phase_names[key]
-        if key in ctx:
-            mark = "[x]"
-        elif i == current_idx and sts != "completed":
-            mark = "[-]"  # current
-        else:
-            mark = "[ ]"
-        lines.append(f"- {mark} **{i+1}. {name}** — {PHASES[key]['book_chapter']}")
-    lines.append("")
-
-    # --- Phase summaries ---
-    if ctx:
-        lines.append("## 各階段成果")
-        lines.append("")
-        for key in PHASE_ORDER:
-            if key not in ctx:
-                continue
-            phase_data = ctx[key]
-            name = phase_names[key]
-            summary = phase_data.get("summary", "") if isinstance(phase_data, dict) else str(phase_data)
-            lines.append(f"### {PHASES[key]['order']}. {name}")
-            lines.append("")
-            lines.append(f"**小結**：{summary}")
-            lines.append("")
-
-    # --- Chat transcript ---
-    lines.append("## 完整對話記錄")
-    lines.append("")
-    for msg in conv.messages:
-        if msg.role == "system":
-            continue
-        role_label = "學生" if msg.role == "user" else "教練"
-        phase_label = phase_names.get(msg.phase_at_time, msg.phase_at_time or "")
-        # Clean markers
-        content = ACTION_RE.sub("", msg.content)
-        content = PHASE_RE.sub("", content).strip()
-        ts = msg.created_at.strftime("%H:%M") if msg.created_at else ""
-        lines.append(f"**{role_label}**（{phase_label} {ts}）：")
-        lines.append("")
-        lines.append(content)
-        lines.append("")
-        lines.append("---")
-        lines.append("")
-
-    # --- Action data ---
-    # Query related data created during this conversation's timeframe
-    if conv.created_at:
-        time_result = await db.execute(
-            select(TimeEntry)
-            .where(TimeEntry.student_id == student_id, TimeEntry.date >= conv.created_at)
-            .order_by(TimeEntry.date)
-        )
-        entries = time_result.scalars().all()
-
-        goal_result = await db.execute(
-            select(Goal)
-            .where(Goal.student_id == student_id, Goal.created_at >= conv.created_at)
-            .order_by(Goal.created_at)
-        )
-        goals = goal_result.scalars().all()
-
-        plan_result = await db.execute(
-            select(ActionPlan)
-            .where(ActionPlan.student_id == student_id, ActionPlan.created_at >= conv.created_at)
-            .order_by(ActionPlan.created_at)
-        )
-        plans = plan_result.scalars().all()
-
-        has_data = entries or goals or plans
-        if has_data:
-            lines.append("## 行動數據")
-            lines.append("")
-
-            if entries:
-                lines.append("### 時間記錄")
-                lines.append("")
-                half_labels = {"long": "長半衰期", "short": "短半衰期"}
-                for e in entries:
-                    hl = half_labels.get(e.half_life, e.half_life or "")
-                    lines.append(f"- {e.activity}（{e.duration_minutes} 分鐘，{hl}，收益值 {e.benefit_value}/5）")
-                lines.append("")
-
-            if goals:
-                lines.append("### 目標")
-                lines.append("")
-                for g in goals:
-                    lines.append(f"- **{g.title}**")
-                    if g.description:
-                        lines.append(f"  - 描述：{g.description}")
-                    if g.five_year_vision:
-                        lines.append(f"  - 五年願景：{g.five_year_vision}")
-                lines.append("")
-
-            if plans:
-                lines.append("### 行動計劃")
-                lines.append("")
-                for p in plans:
-                    lines.append(f"- **{p.title}**")
-                    if p.core_tasks:
-                        lines.append(f"  - 核心任務：{', '.join(p.core_tasks)}")
-                    if p.support_tasks:
-                        lines.append(f"  - 支撐任務：{', '.join(p.support_tasks)}")
-                lines.append("")
-
-    # --- Footer ---
-    lines.append("---")
-    lines.append("")
-    lines.append(f"*由精進學習系統導出 · {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC*")
-
-    md_content = "\n".join(lines)
-
     # Safe filename — URL-encode for non-ASCII chars (RFC 5987)
     from urllib.parse import quote
     safe_title = conv.title.replace("/", "_")[:30]
     ascii_name = f"jingjin_{conv.id}.md"
     utf8_name = f"jingjin_{conv.id}_{safe_title}.md"
 
-    return Response(
-        content=md_content.encode("utf-8"),
+    return StreamingResponse(
+        export_markdown(conv),
         media_type="text/markdown; charset=utf-8",
         headers={
             "Content-Disposition": f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(utf8_name)}"
@@ -421,6 +470,40 @@ async def export_conversation(
     )
 
 
+@router.get("/export")
+async def export_students(
+    student_ids: list[int] = Query(..., alias="student_id"),
+    format: str = Query("zip", pattern="^(zip|ndjson)$"),
+    cursor: Optional[str] = None,
+):
+    """批量導出學生的全部旅程和學習記錄（ZIP 或 NDJSON，流式生成，可按 cursor 續傳）"""
+    ids = sorted(set(student_ids))
+    if len(ids) > settings.EXPORT_BULK_MAX_STUDENTS:
+        raise HTTPException(status_code=400, detail=f"單次最多導出 {settings.EXPORT_BULK_MAX_STUDENTS} 名學生")
+    try:
+        position = parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    async with async_session() as db:
+        result = await db.execute(select(Student.id).where(Student.id.in_(ids)).order_by(Student.id))
+        found = list(result.scalars().all())
+    if not found:
+        raise HTTPException(status_code=404, detail="學生不存在")
+
+    stamp = datetime.utcnow().strftime("%Y%m%d")
+    if format == "ndjson":
+        return StreamingResponse(
+            export_ndjson(found, position),
+            media_type="application/x-ndjson; charset=utf-8",
+            headers={"Content-Disposition": f"attachment; filename=\"jingjin_export_{stamp}.ndjson\""},
+        )
+    return StreamingResponse(
+        export_zip(found, position),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=\"jingjin_export_{stamp}.zip\""},
+    )
+
+
 @router.post("/{student_id}/conversations/{conv_id}/skip-phase")
 async def skip_phase(
     student_id: int,
@@ -428,6 +511,7 @@ async def skip_phase(
     db: AsyncSession = Depends(get_db),
 ):
     """跳過當前階段，進入下一階段"""
+    await turn_writer.barrier(conv_id)
     result = await db.execute(
         select(Conversation)
         .where(Conversation.id == conv_id, Conversation.student_id == student_id)
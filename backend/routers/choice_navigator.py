@@ -7,7 +7,7 @@ from database.connection import get_db
 from database.models import Goal
 from schemas import GoalCreate, GoalOut
 from services.ai_service import get_ai_response, get_ai_response_full
-from services.learning_engine import get_student_full, student_to_context
+from services.student_context import get_student_context
 import json
 
 router = APIRouter()
@@ -33,8 +33,8 @@ async def create_goal(student_id: int, data: GoalCreate, db: AsyncSession = Depe
 @router.post("/{student_id}/explore-assumptions")
 async def explore_assumptions(student_id: int, goal_id: int, db: AsyncSession = Depends(get_db)):
     """AI 識別隱含假設"""
-    student = await get_student_full(db, student_id)
-    if not student:
+    ctx = await get_student_context(db, student_id)
+    if not ctx:
         return {"error": "學生不存在"}
 
     result = await db.execute(select(Goal).where(Goal.id == goal_id))
@@ -50,7 +50,6 @@ async def explore_assumptions(student_id: int, goal_id: int, db: AsyncSession =
         f"可能在束縛我的思維。同時，如果這個選擇讓我兩難，請幫我探索「第三選擇」。"
     )
 
-    ctx = student_to_context(student)
     stream = await get_ai_response("choice_navigator", goal.scenario.value if goal.scenario else None, ctx, message)
 
     async def event_generator():
@@ -69,8 +68,7 @@ async def explore_assumptions(student_id: int, goal_id: int, db: AsyncSession =
 @router.post("/{student_id}/decision-matrix")
 async def decision_matrix(student_id: int, options: list[str], criteria: list[str], db: AsyncSession = Depends(get_db)):
     """精細化選擇矩陣 - AI 輔助多維度打分"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     options_str = "、".join(options)
     criteria_str = "、".join(criteria)
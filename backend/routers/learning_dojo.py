@@ -4,7 +4,7 @@ from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.connection import get_db
 from services.ai_service import get_ai_response
-from services.learning_engine import get_student_full, student_to_context
+from services.student_context import get_student_context
 import json
 
 router = APIRouter()
@@ -18,8 +18,7 @@ async def question_centered_learning(
     db: AsyncSession = Depends(get_db),
 ):
     """以問題為中心的學習 - AI 引導提問"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     message = (
         f"我想學習關於「{topic}」的知識。\n\n"
@@ -48,8 +47,7 @@ async def decode_knowledge(
     db: AsyncSession = Depends(get_db),
 ):
     """知識解碼 - 從信息到知識到技能"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     message = (
         f"以下是我學到的內容：\n{content}\n\n"
@@ -79,8 +77,7 @@ async def knowledge_fusion(
     db: AsyncSession = Depends(get_db),
 ):
     """知識融合 - 跨學科知識關聯訓練"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     message = (
         f"我學了兩個看似不相關的知識：\n"
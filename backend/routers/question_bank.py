@@ -83,6 +83,7 @@ async def ai_generate_questions(
         scenario=scenario,
         student_info=None,
         user_message=prompt,
+        cache=True,
     )
 
     return {"generated": response}
@@ -7,7 +7,8 @@ from database.connection import get_db
 from database.models import LearningRecord, FeedbackSummary, AbilityProfile
 from schemas import ReflectionCreate, LearningRecordOut, FeedbackSummaryOut
 from services.ai_service import get_ai_response, get_ai_response_full
-from services.learning_engine import get_student_full, student_to_context
+from services.learning_engine import get_student_full
+from services.student_context import get_student_context
 import json
 
 router = APIRouter()
@@ -57,8 +58,7 @@ async def deep_feedback(
     db: AsyncSession = Depends(get_db),
 ):
     """AI 深度反饋"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     message = (
         f"以下是我的練習/作品內容：\n{content}\n\n"
@@ -88,8 +88,8 @@ async def update_profile_from_feedback(
     db: AsyncSession = Depends(get_db),
 ):
     """根據學習記錄更新個人檔案（精進閉環的關鍵環節）"""
-    student = await get_student_full(db, student_id)
-    if not student:
+    ctx = await get_student_context(db, student_id)
+    if not ctx:
         return {"error": "學生不存在"}
 
     # 獲取最近的學習記錄
@@ -105,7 +105,6 @@ async def update_profile_from_feedback(
     if not records:
         return {"message": "暫無學習記錄"}
 
-    ctx = student_to_context(student)
     records_text = "\n".join([
         f"- 內容:{r.content[:200] if r.content else '無'} | 反饋:{r.ai_feedback[:200] if r.ai_feedback else '無'} | 得分:{r.score}"
         for r in records
@@ -119,7 +118,7 @@ async def update_profile_from_feedback(
         f"只返回 JSON，不要其他內容。"
     )
 
-    response = await get_ai_response_full("review_hub", scenario, ctx, message)
+    response = await get_ai_response_full("review_hub", scenario, ctx, message, cache=True)
 
     # 更新反饋摘要
     fb_result = await db.execute(
@@ -6,7 +6,7 @@ from sqlalchemy import select
 from database.connection import get_db
 from database.models import AbilityProfile, LearningRecord
 from services.ai_service import get_ai_response
-from services.learning_engine import get_student_full, student_to_context
+from services.student_context import get_student_context
 import json
 
 router = APIRouter()
@@ -15,12 +15,10 @@ router = APIRouter()
 @router.post("/{student_id}/strength-analysis")
 async def strength_analysis(student_id: int, db: AsyncSession = Depends(get_db)):
     """長板優勢識別"""
-    student = await get_student_full(db, student_id)
-    if not student:
+    ctx = await get_student_context(db, student_id)
+    if not ctx:
         return {"error": "學生不存在"}
 
-    ctx = student_to_context(student)
-
     message = (
         f"基於我的能力畫像和興趣圖譜，請分析：\n"
         f"1. 我最突出的「長板」是什麼？（優勢領域）\n"
@@ -48,8 +46,7 @@ async def design_challenge(
     db: AsyncSession = Depends(get_db),
 ):
     """設計「必要的難度」挑戰"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     topic_hint = f"，當前學習主題是「{current_topic}」" if current_topic else ""
 
@@ -4,7 +4,7 @@ from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.connection import get_db
 from services.ai_service import get_ai_response
-from services.learning_engine import get_student_full, student_to_context
+from services.student_context import get_student_context
 import json
 
 router = APIRouter()
@@ -19,8 +19,7 @@ async def socratic_dialogue(
     db: AsyncSession = Depends(get_db),
 ):
     """蘇格拉底式問答 - 層層深入的思維訓練"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     if student_answer:
         message = (
@@ -53,8 +52,7 @@ async def simplify_thinking(
     db: AsyncSession = Depends(get_db),
 ):
     """斷捨離簡化練習 - 對複雜問題進行核心提煉"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     message = (
         f"以下是一個複雜的問題/情境：\n{complex_problem}\n\n"
@@ -83,8 +81,7 @@ async def structured_thinking(
     db: AsyncSession = Depends(get_db),
 ):
     """結構化思考模板"""
-    student = await get_student_full(db, student_id)
-    ctx = student_to_context(student) if student else None
+    ctx = await get_student_context(db, student_id)
 
     tool_prompts = {
         "argument": "論點→論據→結論 的三段式結構",
@@ -7,7 +7,7 @@ from database.connection import get_db
 from database.models import TimeEntry
 from schemas import TimeEntryCreate, TimeEntryOut, AIRequest
 from services.ai_service import get_ai_response
-from services.learning_engine import get_student_full, student_to_context
+from services.student_context import get_student_context
 import json
 
 router = APIRouter()
@@ -50,8 +50,8 @@ async def time_stats(student_id: int, db: AsyncSession = Depends(get_db)):
 @router.post("/{student_id}/ai-analyze")
 async def ai_analyze_time(student_id: int, db: AsyncSession = Depends(get_db)):
     """AI 分析時間使用品質"""
-    student = await get_student_full(db, student_id)
-    if not student:
+    ctx = await get_student_context(db, student_id)
+    if not ctx:
         return {"error": "學生不存在"}
 
     # 獲取最近的時間記錄
@@ -70,7 +70,6 @@ async def ai_analyze_time(student_id: int, db: AsyncSession = Depends(get_db)):
 
     message = f"請分析以下時間使用記錄，指出哪些是長半衰期活動、哪些是短半衰期活動，給出改進建議：\n{entries_text}"
 
-    ctx = student_to_context(student)
     stream = await get_ai_response("time_compass", None, ctx, message)
 
     async def event_generator():
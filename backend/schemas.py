@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -252,6 +252,11 @@ class ChatMessageOut(BaseModel):
     class Config:
         from_attributes = True
 
+class ChatMessagePageOut(BaseModel):
+    messages: List[ChatMessageOut] = []           # 按時間正序
+    has_more: bool = False                        # 是否還有更早的消息
+    next_before: Optional[str] = None             # 取更早一頁時作為 before 傳回
+
 class ConversationOut(BaseModel):
     id: int
     title: str
@@ -265,8 +270,22 @@ class ConversationOut(BaseModel):
     class Config:
         from_attributes = True
 
+class ConversationListItemOut(ConversationOut):
+    message_count: int = 0
+    last_message: Optional[str] = None            # 最後一條消息預覽（已去掉標記並截斷）
+    last_message_role: Optional[str] = None
+    completed_phases: int = 0
+    total_phases: int = 0
+
 class ConversationDetailOut(ConversationOut):
     messages: List[ChatMessageOut] = []
 
+class ConversationArtifactsOut(BaseModel):
+    time_entries: List[TimeEntryOut] = []
+    goals: List[GoalOut] = []
+    action_plans: List[ActionPlanOut] = []
+    learning_records: List[LearningRecordOut] = []
+
 class AgentChatRequest(BaseModel):
     message: str
+    idempotency_key: Optional[str] = Field(None, max_length=64)  # 同一條消息的重試使用相同的鍵
@@ -7,24 +7,32 @@
 4. 執行副作用（保存數據到對應模組表）
 5. 管理階段流轉
 """
-import json
 import re
 import logging
-from typing import AsyncGenerator, Optional
+from datetime import datetime
+from typing import AsyncGenerator, NamedTuple, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert, select
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
+
+from database.connection import async_session
 
 from database.models import (
-    Conversation, ChatMessage, TimeEntry, Goal, ActionPlan, LearningRecord,
+    Conversation, ChatMessage, ConversationArtifact, TimeEntry, Goal, ActionPlan, LearningRecord,
 )
 from services.ai_service import chat_completion_stream
-from services.learning_engine import get_student_full, student_to_context
+from services.llm_usage import current_prompt
+from services.marker_scanner import MarkerScanner
+from services.student_context import get_student_context, render_memo
 from prompts.agent_prompts import (
-    build_agent_system_prompt, get_phase_opening,
+    agent_prompt_fingerprint, build_agent_system_prompt, get_phase_opening,
     PHASES, PHASE_ORDER,
 )
 from prompts.templates import build_student_context
+from services.token_budget import (
+    INPUT_BUDGETS, MESSAGE_OVERHEAD_TOKENS, estimate_tokens, fit_history,
+)
 
 logger = logging.getLogger("jingjin.agent")
 
@@ -34,113 +42,156 @@ ACTION_PATTERN = re.compile(r"<!--ACTION:(.*?)-->", re.DOTALL)
 PHASE_COMPLETE_PATTERN = re.compile(r"<!--PHASE_COMPLETE:(.*?)-->", re.DOTALL)
 
 
-def parse_markers(text: str) -> tuple[str, Optional[dict], Optional[dict]]:
+def strip_markers(content: str) -> str:
+    """去掉已保存消息中的 ACTION / PHASE_COMPLETE 標記"""
+    content = ACTION_PATTERN.sub("", content)
+    return PHASE_COMPLETE_PATTERN.sub("", content).strip()
+
+
+# 為歷史消息預留的 token 數：個人檔案只能使用扣除此預留後的預算。
+# 取固定值而非按當輪歷史計算，保證同一學生每輪的檔案文本不變（prompt 前綴穩定，命中上下文緩存）
+HISTORY_RESERVE_TOKENS = 2000
+
+# 每輪最多帶入的歷史消息條數（只查詢這麼多條，與對話總長度無關）
+HISTORY_WINDOW = 30
+
+
+def parse_markers(text: str) -> tuple[str, list[dict], Optional[dict]]:
     """
     從 AI 回覆中提取 ACTION 和 PHASE_COMPLETE 標記。
-    返回 (clean_text, action_data, phase_complete_data)
+    返回 (clean_text, actions, phase_complete_data)，actions 按出現順序排列
     """
-    action_data = None
-    phase_data = None
+    scanner = MarkerScanner()
+    events = scanner.feed(text) + scanner.finish()
+    clean = "".join(e.text for e in events if e.kind == "text").strip()
+    return clean, scanner.all("action"), scanner.first("phase_complete")
 
-    # 提取 ACTION
-    action_match = ACTION_PATTERN.search(text)
-    if action_match:
-        try:
-            action_data = json.loads(action_match.group(1))
-        except json.JSONDecodeError:
-            logger.warning(f"無法解析 ACTION 標記: {action_match.group(1)}")
 
-    # 提取 PHASE_COMPLETE
-    phase_match = PHASE_COMPLETE_PATTERN.search(text)
-    if phase_match:
-        try:
-            phase_data = json.loads(phase_match.group(1))
-        except json.JSONDecodeError:
-            logger.warning(f"無法解析 PHASE_COMPLETE 標記: {phase_match.group(1)}")
+# ===================== 副作用執行 =====================
 
-    # 清理文本（移除標記）
-    clean = ACTION_PATTERN.sub("", text)
-    clean = PHASE_COMPLETE_PATTERN.sub("", clean).strip()
+def _build_time_entry(student_id: int, conversation: Conversation, data: dict) -> TimeEntry:
+    return TimeEntry(
+        student_id=student_id,
+        activity=data.get("activity", "未命名活動"),
+        duration_minutes=data.get("duration_minutes", 30),
+        half_life=data.get("half_life", "long"),
+        benefit_value=data.get("benefit_value", 3),
+    )
 
-    return clean, action_data, phase_data
 
+def _build_goal(student_id: int, conversation: Conversation, data: dict) -> Goal:
+    return Goal(
+        student_id=student_id,
+        scenario=conversation.scenario,
+        title=data.get("title", "未命名目標"),
+        description=data.get("description"),
+        five_year_vision=data.get("five_year_vision"),
+    )
+
+
+def _build_action_plan(student_id: int, conversation: Conversation, data: dict) -> ActionPlan:
+    return ActionPlan(
+        student_id=student_id,
+        title=data.get("title", "未命名計劃"),
+        core_tasks=data.get("core_tasks", []),
+        support_tasks=data.get("support_tasks", []),
+    )
+
+
+def _build_learning_record(student_id: int, conversation: Conversation, data: dict) -> LearningRecord:
+    return LearningRecord(
+        student_id=student_id,
+        module=data.get("module", "learning_dojo"),
+        scenario=conversation.scenario,
+        content=data.get("content", ""),
+    )
+
+
+# ACTION 類型 → (構造函數, 結果中的記錄 ID 鍵, conversation_artifacts.kind)
+ACTION_HANDLERS = {
+    "save_time_entry": (_build_time_entry, "entry_id", "time_entry"),
+    "save_goal": (_build_goal, "goal_id", "goal"),
+    "save_action_plan": (_build_action_plan, "plan_id", "action_plan"),
+    "save_learning_record": (_build_learning_record, "record_id", "learning_record"),
+}
 
-# ===================== 副作用執行 =====================
 
-async def execute_action(
+async def execute_actions(
     db: AsyncSession,
     student_id: int,
     conversation: Conversation,
-    action: dict,
-) -> Optional[dict]:
-    """根據 ACTION 標記執行數據保存"""
-    action_type = action.get("type", "")
-    data = action.get("data", {})
-    result = {"type": action_type, "success": False}
+    actions: list[dict],
+) -> list[dict]:
+    """
+    執行一條回覆中的全部 ACTION 標記，返回與 actions 一一對應的結果。
+    按類型分組後 add_all，整批只 flush 一次；flush 在 SAVEPOINT 中進行，
+    失敗時本批記錄全部標記為失敗，不影響同一事務中的消息和階段推進。
+    保存成功的記錄同時登記到 conversation_artifacts。
+    """
+    results: list[dict] = []
+    groups: dict[str, list[tuple[dict, object]]] = {}
+    for action in actions:
+        action_type = action.get("type", "")
+        result = {"type": action_type, "success": False}
+        results.append(result)
+        handler = ACTION_HANDLERS.get(action_type)
+        if handler is None:
+            logger.warning(f"未知 ACTION 類型: {action_type}")
+            continue
+        data = action.get("data")
+        try:
+            obj = handler[0](student_id, conversation, data if isinstance(data, dict) else {})
+        except Exception as e:
+            logger.error(f"執行 ACTION 失敗: {e}")
+            result["error"] = str(e)
+            continue
+        groups.setdefault(action_type, []).append((result, obj))
+
+    if not groups:
+        return results
 
     try:
-        if action_type == "save_time_entry":
-            entry = TimeEntry(
-                student_id=student_id,
-                activity=data.get("activity", "未命名活動"),
-                duration_minutes=data.get("duration_minutes", 30),
-                half_life=data.get("half_life", "long"),
-                benefit_value=data.get("benefit_value", 3),
-            )
-            db.add(entry)
+        async with db.begin_nested():
+            for items in groups.values():
+                db.add_all([obj for _, obj in items])
             await db.flush()
-            result["success"] = True
-            result["entry_id"] = entry.id
-            logger.info(f"Agent 保存時間記錄: {entry.activity}")
-
-        elif action_type == "save_goal":
-            goal = Goal(
-                student_id=student_id,
-                scenario=conversation.scenario,
-                title=data.get("title", "未命名目標"),
-                description=data.get("description"),
-                five_year_vision=data.get("five_year_vision"),
-            )
-            db.add(goal)
-            await db.flush()
-            result["success"] = True
-            result["goal_id"] = goal.id
-            logger.info(f"Agent 保存目標: {goal.title}")
-
-        elif action_type == "save_action_plan":
-            plan = ActionPlan(
-                student_id=student_id,
-                title=data.get("title", "未命名計劃"),
-                core_tasks=data.get("core_tasks", []),
-                support_tasks=data.get("support_tasks", []),
-            )
-            db.add(plan)
-            await db.flush()
-            result["success"] = True
-            result["plan_id"] = plan.id
-            logger.info(f"Agent 保存行動計劃: {plan.title}")
-
-        elif action_type == "save_learning_record":
-            record = LearningRecord(
-                student_id=student_id,
-                module=data.get("module", "learning_dojo"),
-                scenario=conversation.scenario,
-                content=data.get("content", ""),
-            )
-            db.add(record)
-            await db.flush()
-            result["success"] = True
-            result["record_id"] = record.id
-            logger.info(f"Agent 保存學習記錄")
-
-        else:
-            logger.warning(f"未知 ACTION 類型: {action_type}")
-
     except Exception as e:
         logger.error(f"執行 ACTION 失敗: {e}")
-        result["error"] = str(e)
+        for items in groups.values():
+            for result, _ in items:
+                result["error"] = str(e)
+        return results
+
+    artifacts = []
+    for action_type, items in groups.items():
+        _, id_key, kind = ACTION_HANDLERS[action_type]
+        for result, obj in items:
+            result["success"] = True
+            result[id_key] = obj.id
+            artifacts.append(ConversationArtifact(conversation_id=conversation.id, kind=kind, target_id=obj.id))
+    # 關聯記錄隨調用方的下一次 flush 寫入
+    db.add_all(artifacts)
+    logger.info(
+        "Agent 保存記錄: "
+        + ", ".join(f"{action_type} x{len(items)}" for action_type, items in groups.items())
+    )
+    return results
 
-    return result
+
+def phase_transition(
+    current: str,
+    phase_context: Optional[dict],
+    phase_complete_data: dict,
+) -> Optional[tuple[dict, Optional[str]]]:
+    """計算完成當前階段後的 (phase_context, 下一階段 key)；下一階段為 None 表示旅程完成，未知階段返回 None"""
+    phase_def = PHASES.get(current)
+    if not phase_def:
+        return None
+    ctx = dict(phase_context or {})
+    ctx[current] = {
+        "summary": phase_complete_data.get("summary", "已完成"),
+    }
+    return ctx, phase_def.get("next")
 
 
 async def advance_phase(
@@ -150,20 +201,16 @@ async def advance_phase(
 ) -> Optional[str]:
     """推進到下一階段，返回新的階段 key"""
     current = conversation.current_phase
-    phase_def = PHASES.get(current)
-    if not phase_def:
+    transition = phase_transition(current, conversation.phase_context, phase_complete_data)
+    if transition is None:
         return None
 
     # 保存當前階段小結到 phase_context
-    ctx = dict(conversation.phase_context or {})
-    ctx[current] = {
-        "summary": phase_complete_data.get("summary", "已完成"),
-    }
+    ctx, next_phase = transition
     conversation.phase_context = ctx
     flag_modified(conversation, "phase_context")
 
     # 推進到下一階段
-    next_phase = phase_def.get("next")
     if next_phase:
         conversation.current_phase = next_phase
         logger.info(f"階段流轉: {current} -> {next_phase}")
@@ -176,35 +223,83 @@ async def advance_phase(
 
 # ===================== 對話上下文組裝 =====================
 
+async def load_recent_messages(
+    db: AsyncSession,
+    conversation_id: int,
+    limit: int = HISTORY_WINDOW,
+) -> list[ChatMessage]:
+    """取對話最近 limit 條消息（按時間順序），走 (conversation_id, created_at, id) 索引"""
+    result = await db.execute(
+        select(ChatMessage)
+        .where(ChatMessage.conversation_id == conversation_id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(limit)
+    )
+    rows = list(result.scalars().all())
+    rows.reverse()
+    return rows
+
+
 async def build_messages(
     db: AsyncSession,
     conversation: Conversation,
     user_message: str,
 ) -> list[dict]:
-    """組裝發送給 AI 的完整 messages 列表"""
-    student = await get_student_full(db, conversation.student_id)
-    student_ctx_str = build_student_context(student_to_context(student)) if student else ""
+    """組裝發送給 AI 的完整 messages 列表
 
-    # 組裝 system prompt
-    system_prompt = build_agent_system_prompt(
+    按 Agent 輸入預算分配：system prompt 核心和當前消息固定保留；
+    個人檔案最多佔用扣除歷史預留後的剩餘預算；
+    其餘預算從最新往前填充歷史消息（只查詢最近 HISTORY_WINDOW 條），
+    更早的消息由後台併入 conversation.history_digest，作為 system prompt 的一部分帶入。
+    """
+    budget = INPUT_BUDGETS["agent"]
+    student_info = await get_student_context(db, conversation.student_id)
+
+    # 組裝 system prompt（先不含個人檔案，計算固定部分的開銷）
+    scenario = conversation.scenario.value if hasattr(conversation.scenario, 'value') else str(conversation.scenario)
+    phase_context = conversation.phase_context or {}
+    history_digest = conversation.history_digest or ""
+    current_prompt.set(agent_prompt_fingerprint(conversation.current_phase, scenario))
+    core_prompt = build_agent_system_prompt(
         phase_key=conversation.current_phase,
-        scenario=conversation.scenario.value if hasattr(conversation.scenario, 'value') else str(conversation.scenario),
-        student_context=student_ctx_str,
-        phase_context=conversation.phase_context or {},
+        scenario=scenario,
+        student_context="",
+        phase_context=phase_context,
+        history_digest=history_digest,
     )
+    core_tokens = estimate_tokens(core_prompt)
+    fixed = core_tokens + estimate_tokens(user_message) + 2 * MESSAGE_OVERHEAD_TOKENS
 
-    messages = [{"role": "system", "content": system_prompt}]
-
-    # 加入歷史消息（最近 30 條，避免 token 過長）
-    history = conversation.messages[-30:] if conversation.messages else []
-    for msg in history:
+    # 加入歷史消息（最近 HISTORY_WINDOW 條，對 assistant 消息清理掉標記）
+    history = []
+    for msg in await load_recent_messages(db, conversation.id):
         if msg.role in ("user", "assistant"):
-            # 對 assistant 消息清理掉標記
             content = msg.content
             if msg.role == "assistant":
-                content = ACTION_PATTERN.sub("", content)
-                content = PHASE_COMPLETE_PATTERN.sub("", content).strip()
-            messages.append({"role": msg.role, "content": content})
+                content = strip_markers(content)
+            history.append({"role": msg.role, "content": content})
+
+    # 個人檔案：預算與當輪歷史 / 消息長度無關
+    student_ctx_str = ""
+    if student_info:
+        student_ctx_str = build_student_context(
+            student_info, max_tokens=max(0, budget - core_tokens - HISTORY_RESERVE_TOKENS),
+            memo=render_memo(student_info),
+        )
+        system_prompt = build_agent_system_prompt(
+            phase_key=conversation.current_phase,
+            scenario=scenario,
+            student_context=student_ctx_str,
+            phase_context=phase_context,
+            history_digest=history_digest,
+        )
+    else:
+        system_prompt = core_prompt
+
+    history = fit_history(history, budget - fixed - estimate_tokens(student_ctx_str))
+
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(history)
 
     # 加入當前用戶消息
     messages.append({"role": "user", "content": user_message})
@@ -212,168 +307,216 @@ async def build_messages(
     return messages
 
 
-# ===================== 流式對話主函數 =====================
-
-async def agent_chat_stream(
-    db: AsyncSession,
-    conversation: Conversation,
-    user_message: str,
-) -> AsyncGenerator[str, None]:
-    """
-    Agent 對話主流程（流式）
-    1. 保存用戶消息
-    2. 組裝上下文
-    3. 調用 AI 流式回覆
-    4. 收集完整回覆後解析標記
-    5. 執行副作用
-    6. 保存 AI 回覆
-    7. yield 清理後的文本 chunk
-    """
-    # 1. 保存用戶消息
-    user_msg = ChatMessage(
-        conversation_id=conversation.id,
-        role="user",
-        content=user_message,
-        phase_at_time=conversation.current_phase,
-    )
-    db.add(user_msg)
-    await db.flush()
+# ===================== 對話輪次：讀取 → 流式 → 持久化 =====================
+#
+# 一輪對話分三段，只有首尾兩段短事務佔用數據庫連接，LLM 流式輸出期間不持有連接：
+# 1. prepare_*_turn：讀取對話狀態、組裝 messages，生成 TurnContext 後即釋放連接
+# 2. stream_reply：流式調用 AI，MarkerScanner 增量過濾標記；結束後 finish_turn 得到 TurnResult
+# 3. 持久化：保存消息、執行 ACTION、推進階段。路由交給 services.turn_writer 後台批量寫入，
+#    並用 preview_state 立即回覆狀態；persist_turn 為單輪寫入（寫入隊列的兜底路徑）。
+#    Conversation.version 為樂觀鎖，並發修改時重新讀取並重放，最多 PERSIST_ATTEMPTS 次
 
-    # 2. 組裝上下文
-    messages = await build_messages(db, conversation, user_message)
+AI_UNAVAILABLE_MESSAGE = "抱歉，AI 服務暫時不可用，請稍後再試。"
+PERSIST_ATTEMPTS = 3
 
-    # 3. 流式調用 AI — 帶末尾緩衝，避免標記閃爍
-    #    策略：緩衝最後 N 個字符。如果緩衝區內無標記起始符 "<!--"，
-    #    就安全地 flush 給前端；否則繼續緩衝直到流結束再統一處理。
-    MARKER_PREFIX = "<!--"
-    BUFFER_SIZE = 6  # 緩衝足夠檢測 "<!--" 的字符數
 
-    full_response = ""
-    buffer = ""
-    try:
-        stream = chat_completion_stream(messages)
-        async for chunk in stream:
-            full_response += chunk
-            buffer += chunk
-
-            # 檢查緩衝區是否包含可能的標記起始
-            marker_pos = buffer.find(MARKER_PREFIX)
-            if marker_pos >= 0:
-                # 標記起始之前的內容可以安全輸出
-                if marker_pos > 0:
-                    yield buffer[:marker_pos]
-                # 把標記及之後的內容留在緩衝區
-                buffer = buffer[marker_pos:]
-            elif len(buffer) > BUFFER_SIZE:
-                # 沒有標記跡象，輸出除最後 BUFFER_SIZE 個字符外的內容
-                safe = buffer[:-BUFFER_SIZE]
-                buffer = buffer[-BUFFER_SIZE:]
-                yield safe
-    except Exception as e:
-        logger.error(f"AI 調用失敗: {e}")
-        error_msg = "抱歉，AI 服務暫時不可用，請稍後再試。"
-        full_response = error_msg
-        buffer = error_msg
+class TurnContext(NamedTuple):
+    """第一段讀取到的對話快照"""
+    conversation_id: int
+    phase: str                      # 生成回覆時所處階段
+    version: int                    # 讀取時的 Conversation.version
+    phase_context: dict             # 讀取時的 phase_context
+    status: str                     # 讀取時的對話狀態
+    messages: list[dict]            # 發送給 AI 的 messages
+    user_message: Optional[str]     # 本輪用戶消息（開場白為 None）
+    started_at: datetime            # 用戶消息的發送時間
 
-    # 流結束：清理緩衝區，移除標記後輸出剩餘文本
-    remaining = ACTION_PATTERN.sub("", buffer)
-    remaining = PHASE_COMPLETE_PATTERN.sub("", remaining).strip()
-    if remaining:
-        yield remaining
 
-    # 4. 解析標記
-    clean_text, action_data, phase_data = parse_markers(full_response)
+class TurnResult(NamedTuple):
+    """一輪對話的完整結果，待持久化"""
+    turn: TurnContext
+    reply: str                      # AI 回覆原文（含標記）
+    actions: list[dict]             # 本輪全部 ACTION 標記（按出現順序）
+    phase_complete: Optional[dict]
+    finished_at: datetime
 
-    # 5. 構建消息 action_metadata
-    msg_metadata = {}
 
-    # 6. 執行 ACTION
-    if action_data:
-        action_result = await execute_action(
-            db, conversation.student_id, conversation, action_data
-        )
-        msg_metadata["action"] = action_result
-
-    # 7. 執行 PHASE_COMPLETE
-    new_phase = None
-    if phase_data:
-        new_phase = await advance_phase(db, conversation, phase_data)
-        msg_metadata["phase_complete"] = {
-            "summary": phase_data.get("summary", ""),
-            "new_phase": new_phase,
-        }
-
-    # 8. 保存 AI 回覆
-    ai_msg = ChatMessage(
+def _turn_context(conversation: Conversation, messages: list[dict], user_message: Optional[str]) -> TurnContext:
+    status = conversation.status
+    return TurnContext(
         conversation_id=conversation.id,
-        role="assistant",
-        content=full_response,
-        phase_at_time=conversation.current_phase,
-        action_metadata=msg_metadata if msg_metadata else None,
+        phase=conversation.current_phase,
+        version=conversation.version,
+        phase_context=dict(conversation.phase_context or {}),
+        status=status.value if hasattr(status, "value") else str(status),
+        messages=messages,
+        user_message=user_message,
+        started_at=datetime.utcnow(),
     )
-    db.add(ai_msg)
 
-    # 更新 conversation 時間
-    from datetime import datetime
-    conversation.updated_at = datetime.utcnow()
 
-    await db.flush()
+async def prepare_chat_turn(
+    db: AsyncSession,
+    conversation: Conversation,
+    user_message: str,
+) -> TurnContext:
+    """第一段：組裝一輪對話的上下文（只讀）"""
+    messages = await build_messages(db, conversation, user_message)
+    return _turn_context(conversation, messages, user_message)
 
 
-async def start_conversation_stream(
+async def prepare_start_turn(
     db: AsyncSession,
     conversation: Conversation,
-) -> AsyncGenerator[str, None]:
-    """
-    啟動新對話 — 讓 AI 發出第一條引導消息
-    """
+) -> TurnContext:
+    """第一段：組裝開場白的上下文（以階段開場提示作為觸發 AI 的用戶消息，不入庫）"""
     opening_hint = get_phase_opening(
         conversation.current_phase,
         conversation.phase_context or {},
     )
-
-    # 用 system hint 作為用戶消息來觸發 AI 的開場白
     messages = await build_messages(db, conversation, opening_hint)
+    return _turn_context(conversation, messages, None)
 
-    full_response = ""
-    buffer = ""
-    MARKER_PREFIX = "<!--"
-    BUFFER_SIZE = 6
 
+async def stream_reply(
+    messages: list[dict],
+    scanner: MarkerScanner,
+    error_label: str,
+) -> AsyncGenerator[str, None]:
+    """第二段：流式調用 AI，經 scanner 過濾標記後逐段 yield 可見文本；出錯時以提示語代替整條回覆"""
     try:
-        stream = chat_completion_stream(messages)
-        async for chunk in stream:
-            full_response += chunk
-            buffer += chunk
-
-            marker_pos = buffer.find(MARKER_PREFIX)
-            if marker_pos >= 0:
-                if marker_pos > 0:
-                    yield buffer[:marker_pos]
-                buffer = buffer[marker_pos:]
-            elif len(buffer) > BUFFER_SIZE:
-                safe = buffer[:-BUFFER_SIZE]
-                buffer = buffer[-BUFFER_SIZE:]
-                yield safe
+        async for chunk in chat_completion_stream(messages, priority="interactive"):
+            for event in scanner.feed(chunk):
+                if event.kind == "text":
+                    yield event.text
+        events = scanner.finish()
     except Exception as e:
-        logger.error(f"AI 開場調用失敗: {e}")
-        error_msg = "抱歉，AI 服務暫時不可用，請稍後再試。"
-        full_response = error_msg
-        buffer = error_msg
+        logger.error(f"{error_label}: {e}")
+        events = scanner.abort(AI_UNAVAILABLE_MESSAGE)
+    for event in events:
+        if event.kind == "text":
+            yield event.text
+
+
+def finish_turn(turn: TurnContext, scanner: MarkerScanner) -> TurnResult:
+    return TurnResult(
+        turn=turn,
+        reply=scanner.raw_text,
+        actions=scanner.all("action"),
+        phase_complete=scanner.first("phase_complete"),
+        finished_at=datetime.utcnow(),
+    )
 
-    remaining = ACTION_PATTERN.sub("", buffer)
-    remaining = PHASE_COMPLETE_PATTERN.sub("", remaining).strip()
-    if remaining:
-        yield remaining
 
-    # 解析並保存
-    clean_text, action_data, phase_data = parse_markers(full_response)
+def preview_state(result: TurnResult) -> dict:
+    """按第一段快照和本輪標記推算寫入後的對話狀態（不訪問數據庫），用於立即回覆 state_update"""
+    turn = result.turn
+    phase, phase_context, status = turn.phase, turn.phase_context, turn.status
+    if result.phase_complete:
+        transition = phase_transition(turn.phase, turn.phase_context, result.phase_complete)
+        if transition is not None:
+            phase_context, next_phase = transition
+            if next_phase:
+                phase = next_phase
+            else:
+                status = "completed"
+    return {
+        "type": "state_update",
+        "current_phase": phase,
+        "phase_context": phase_context,
+        "status": status,
+    }
 
-    ai_msg = ChatMessage(
-        conversation_id=conversation.id,
-        role="assistant",
-        content=full_response,
-        phase_at_time=conversation.current_phase,
-    )
-    db.add(ai_msg)
-    await db.flush()
+
+async def apply_turn(
+    db: AsyncSession,
+    conversation: Conversation,
+    result: TurnResult,
+) -> list[dict]:
+    """在當前事務中執行本輪的 ACTION 和階段推進，返回待插入的 chat_messages 行（由調用方批量插入）
+
+    開場白（user_message 為 None）只保存 AI 回覆，不執行標記、不更新對話時間。
+    """
+    turn = result.turn
+    if turn.user_message is None:
+        return [{
+            "conversation_id": conversation.id,
+            "role": "assistant",
+            "content": result.reply,
+            "phase_at_time": conversation.current_phase,
+            "action_metadata": None,
+            "created_at": result.finished_at,
+        }]
+    rows = []
+    # 1. 用戶消息（時間取發送時刻，保證排在 AI 回覆之前）
+    rows.append({
+        "conversation_id": conversation.id,
+        "role": "user",
+        "content": turn.user_message,
+        "phase_at_time": turn.phase,
+        "action_metadata": None,
+        "created_at": turn.started_at,
+    })
+
+    msg_metadata = {}
+
+    # 2. 執行 ACTION
+    if result.actions:
+        msg_metadata["actions"] = await execute_actions(
+            db, conversation.student_id, conversation, result.actions
+        )
+
+    # 3. 執行 PHASE_COMPLETE：流式期間階段已被改變（如跳過階段）時不再重複推進
+    if result.phase_complete:
+        if conversation.current_phase != turn.phase:
+            logger.warning(
+                f"對話 {conversation.id} 在回覆期間已由 {turn.phase} 變為 "
+                f"{conversation.current_phase}，忽略本輪 PHASE_COMPLETE"
+            )
+        else:
+            new_phase = await advance_phase(db, conversation, result.phase_complete)
+            msg_metadata["phase_complete"] = {
+                "summary": result.phase_complete.get("summary", ""),
+                "new_phase": new_phase,
+            }
+
+    # 4. AI 回覆
+    rows.append({
+        "conversation_id": conversation.id,
+        "role": "assistant",
+        "content": result.reply,
+        "phase_at_time": conversation.current_phase,
+        "action_metadata": msg_metadata if msg_metadata else None,
+        "created_at": result.finished_at,
+    })
+
+    # 更新 conversation 時間（同時遞增 version）
+    conversation.updated_at = result.finished_at
+    return rows
+
+
+async def persist_turn(result: TurnResult) -> Optional[Conversation]:
+    """單獨持久化一輪結果，返回提交後的對話（對話已被刪除時返回 None）"""
+    turn = result.turn
+    for attempt in range(1, PERSIST_ATTEMPTS + 1):
+        async with async_session() as db:
+            try:
+                conversation = await db.get(Conversation, turn.conversation_id)
+                if conversation is None:
+                    logger.warning(f"對話 {turn.conversation_id} 在回覆期間已被刪除，本輪結果丟棄")
+                    return None
+                if conversation.version != turn.version:
+                    logger.info(
+                        f"對話 {turn.conversation_id} 在回覆期間被修改 "
+                        f"(version {turn.version} -> {conversation.version})，基於最新狀態寫入"
+                    )
+                rows = await apply_turn(db, conversation, result)
+                await db.flush()
+                await db.execute(insert(ChatMessage), rows)
+                await db.commit()
+                return conversation
+            except StaleDataError:
+                await db.rollback()
+                if attempt == PERSIST_ATTEMPTS:
+                    raise
+                logger.info(f"對話 {turn.conversation_id} 寫入衝突，重試 ({attempt}/{PERSIST_ATTEMPTS})")
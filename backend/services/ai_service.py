@@ -2,30 +2,359 @@
 DeepSeek AI 服務封裝
 支持流式 (SSE) 和非流式調用
 所有輸出均經過繁體中文轉換
+
+所有 LLM 調用共用一個 httpx.AsyncClient（連接池 + keep-alive），
+由 main.py 的 lifespan 建立與關閉，避免每次請求重新 DNS + TCP + TLS 握手。
 """
-import json
+import asyncio
+import logging
+import time
 from typing import AsyncGenerator, Optional
 import httpx
 from config import get_settings
-from prompts.templates import build_full_prompt
-from services.chinese_converter import to_traditional
+from prompts.templates import build_full_prompt, get_module_template
+from services.chinese_converter import to_traditional, StreamingConverter
+from services.llm_governor import governor
+from services.llm_cache import response_cache, make_cache_key, replay_as_stream
+from services.llm_singleflight import single_flight, stream_group
+from services.sse_parser import iter_sse_json, chunk_content
+from services.student_context import render_memo
+from services.llm_usage import current_prompt, usage_tracker
+from services.token_budget import (
+    INPUT_BUDGETS, MESSAGE_OVERHEAD_TOKENS, estimate_tokens, estimate_messages_tokens,
+)
+from services.llm_resilience import (
+    breaker, ttft_tracker, is_retryable, backoff_delay, LLMFirstTokenTimeout,
+)
 
 settings = get_settings()
+logger = logging.getLogger("jingjin.ai")
 
 DEEPSEEK_CHAT_URL = f"{settings.DEEPSEEK_BASE_URL}/v1/chat/completions"
 
 
+# ===================== 共享 HTTP 連接池 =====================
+
+_http_client: Optional[httpx.AsyncClient] = None
+_request_stats = {
+    "requests": 0, "in_flight": 0, "errors": 0,
+    "prompt_tokens_est": 0, "completion_tokens_est": 0,
+}
+_resilience_stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "first_token_timeouts": 0}
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要可選依賴 h2"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """按配置建立帶連接池的 AsyncClient"""
+    http2 = settings.DEEPSEEK_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("DEEPSEEK_HTTP2 已開啟但未安裝 h2，回退到 HTTP/1.1（pip install h2）")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=settings.DEEPSEEK_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.DEEPSEEK_MAX_KEEPALIVE,
+        keepalive_expiry=settings.DEEPSEEK_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.DEEPSEEK_TIMEOUT, connect=settings.DEEPSEEK_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(
+        headers={
+            "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        limits=limits,
+        timeout=timeout,
+        http2=http2,
+    )
+
+
+async def init_http_client() -> None:
+    """建立全局共享的 HTTP client（在 lifespan 啟動時調用）"""
+    global _http_client
+    if _http_client is None:
+        _http_client = _build_http_client()
+        logger.info(
+            f"✓ DeepSeek 連接池就緒 (max={settings.DEEPSEEK_MAX_CONNECTIONS}, "
+            f"keepalive={settings.DEEPSEEK_MAX_KEEPALIVE}, http2={settings.DEEPSEEK_HTTP2})"
+        )
+
+
+async def close_http_client() -> None:
+    """關閉共享 HTTP client，釋放所有連接（在 lifespan 結束時調用）"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """獲取共享 HTTP client；未經 lifespan 初始化時（如腳本中）惰性建立"""
+    global _http_client
+    if _http_client is None:
+        _http_client = _build_http_client()
+    return _http_client
+
+
+def get_pool_stats() -> dict:
+    """連接池統計：請求計數 + 當前連接狀態"""
+    stats = dict(_request_stats)
+    stats["http2"] = bool(_http_client and settings.DEEPSEEK_HTTP2 and _http2_available())
+    # httpcore 連接池未提供公開 API，按屬性探測，取不到時僅返回計數
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is not None:
+        stats["connections"] = len(connections)
+        stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+        stats["active_connections"] = stats["connections"] - stats["idle_connections"]
+    return stats
+
+
+def get_llm_stats() -> dict:
+    """匯總 LLM 調用相關的運行指標（供健康檢查端點使用）"""
+    return {
+        "pool": get_pool_stats(),
+        "governor": governor.get_stats(),
+        "cache": response_cache.get_stats(),
+        "single_flight": single_flight.get_stats(),
+        "stream_group": stream_group.get_stats(),
+        "usage": usage_tracker.get_stats(),
+        "resilience": {
+            **_resilience_stats,
+            "circuit": breaker.get_stats(),
+            "first_token_latency": ttft_tracker.get_stats(),
+        },
+    }
+
+
+def _log_token_usage(payload: dict, priority: str, completion: str, elapsed: float) -> None:
+    """記錄單次請求的輸入 / 輸出 token 估算值、耗時和 Prompt 模板指紋"""
+    prompt_tokens = estimate_messages_tokens(payload["messages"])
+    completion_tokens = estimate_tokens(completion)
+    _request_stats["prompt_tokens_est"] += prompt_tokens
+    _request_stats["completion_tokens_est"] += completion_tokens
+    usage_tracker.record_latency(elapsed)
+    logger.info(
+        f"LLM 請求完成 [{priority}] prompt_fp={current_prompt.get() or '-'} messages={len(payload['messages'])} "
+        f"prompt≈{prompt_tokens} completion≈{completion_tokens} tokens {elapsed:.2f}s"
+    )
+
+
+async def _post_attempt(payload: dict, priority: str) -> str:
+    """發送一次非流式請求（佔用一個並發槽位）"""
+    client = get_http_client()
+    probe = breaker.acquire()
+    outcome: Optional[bool] = None
+    try:
+        async with governor.slot(priority):
+            _request_stats["requests"] += 1
+            _request_stats["in_flight"] += 1
+            try:
+                # 沿用 client 的默認超時（含 DEEPSEEK_CONNECT_TIMEOUT 連接超時）
+                response = await client.post(DEEPSEEK_CHAT_URL, json=payload)
+                response.raise_for_status()
+                data = response.json()
+                if data.get("usage"):
+                    usage_tracker.record(data["usage"])
+                content = data["choices"][0]["message"]["content"]
+                outcome = True
+                return to_traditional(content)
+            except Exception as e:
+                _request_stats["errors"] += 1
+                outcome = False if is_retryable(e) else None
+                raise
+            finally:
+                _request_stats["in_flight"] -= 1
+    finally:
+        # 排隊被拒 / 取消時也要釋放，否則半開狀態的探測名額永遠不會歸還
+        breaker.release(outcome, probe)
+
+
+async def _post_completion(payload: dict, priority: str) -> str:
+    """非流式請求：暫時性故障按退避重試"""
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            content = await _post_attempt(payload, priority)
+            _log_token_usage(payload, priority, content, time.perf_counter() - started)
+            return content
+        except Exception as e:
+            if attempt >= settings.LLM_MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            attempt += 1
+            _resilience_stats["retries"] += 1
+            logger.warning(f"DeepSeek 請求失敗（{e!r}），{delay:.1f}s 後第 {attempt} 次重試")
+            await asyncio.sleep(delay)
+
+
+async def _stream_attempt(payload: dict, priority: str) -> AsyncGenerator[str, None]:
+    """發送一次流式請求並逐 delta 返回原文（佔用一個並發槽位直至流結束）"""
+    client = get_http_client()
+    probe = breaker.acquire()
+    outcome: Optional[bool] = None
+    timeout = httpx.Timeout(
+        settings.DEEPSEEK_STREAM_TIMEOUT,
+        connect=settings.DEEPSEEK_CONNECT_TIMEOUT,
+        read=settings.LLM_STREAM_IDLE_TIMEOUT,     # 連續無數據即視為上游卡死
+    )
+    try:
+        async with governor.slot(priority):
+            _request_stats["requests"] += 1
+            _request_stats["in_flight"] += 1
+            try:
+                async with client.stream("POST", DEEPSEEK_CHAT_URL, json=payload, timeout=timeout) as response:
+                    response.raise_for_status()
+                    async for data in iter_sse_json(response.aiter_bytes()):
+                        content = chunk_content(data)
+                        if content:
+                            yield content
+                        elif data.get("usage"):
+                            # 末尾 chunk 攜帶 usage（含上下文緩存命中 / 未命中 token 數）
+                            usage_tracker.record(data["usage"])
+                outcome = True
+            except Exception as e:
+                _request_stats["errors"] += 1
+                outcome = False if is_retryable(e) else None
+                raise
+            finally:
+                _request_stats["in_flight"] -= 1
+    finally:
+        breaker.release(outcome, probe)
+
+
+async def _next_delta(stream: AsyncGenerator[str, None]) -> str:
+    return await stream.__anext__()
+
+
+def _hedge_delay() -> Optional[float]:
+    """對沖觸發點：首 token 延遲的歷史分位數（不低於下限）；未開啟或樣本不足時為 None"""
+    if not settings.LLM_HEDGE_ENABLED:
+        return None
+    p = ttft_tracker.percentile(settings.LLM_HEDGE_PERCENTILE)
+    return None if p is None else max(p, settings.LLM_HEDGE_MIN_DELAY)
+
+
+async def _open_stream(payload: dict, priority: str) -> tuple[AsyncGenerator[str, None], str]:
+    """
+    發起流式請求並等待首個 token，返回 (剩餘流, 首個 delta)
+    首 token 超過對沖觸發點且仍有空閒槽位時，再發一個相同請求，先出 token 者勝出，另一個取消。
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + settings.LLM_FIRST_TOKEN_TIMEOUT
+    hedge_delay = _hedge_delay()
+    hedge_at = started + hedge_delay if hedge_delay is not None else None
+
+    contenders: dict[asyncio.Task, tuple[AsyncGenerator[str, None], float, bool]] = {}
+
+    def launch(hedged: bool) -> None:
+        stream = _stream_attempt(payload, priority)
+        contenders[asyncio.ensure_future(_next_delta(stream))] = (stream, loop.time(), hedged)
+
+    launch(hedged=False)
+    error: Optional[BaseException] = None
+    try:
+        while contenders:
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, _ = await asyncio.wait(
+                contenders, timeout=max(0.0, wake - loop.time()), return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                stream, launched_at, hedged = contenders.pop(task)
+                exc = task.exception()
+                if exc is None or isinstance(exc, StopAsyncIteration):
+                    ttft_tracker.record(loop.time() - launched_at)
+                    if hedged:
+                        _resilience_stats["hedge_wins"] += 1
+                    return stream, "" if exc else task.result()
+                error = exc
+            if done:
+                continue
+            now = loop.time()
+            if now >= deadline:
+                _resilience_stats["first_token_timeouts"] += 1
+                breaker.record_failure()
+                raise LLMFirstTokenTimeout(f"{settings.LLM_FIRST_TOKEN_TIMEOUT}s 內未收到首個 token")
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if governor.has_capacity() and breaker.state == "closed":
+                    _resilience_stats["hedges"] += 1
+                    launch(hedged=True)
+        raise error
+    finally:
+        # 落敗 / 超時的請求：取消即釋放槽位和連接
+        for task in contenders:
+            task.cancel()
+
+
+async def _stream_completion(payload: dict, priority: str) -> AsyncGenerator[str, None]:
+    """流式請求：首 token 前的暫時性故障按退避重試，之後逐 token 轉繁體返回"""
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            stream, first = await _open_stream(payload, priority)
+            break
+        except Exception as e:
+            if attempt >= settings.LLM_MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            attempt += 1
+            _resilience_stats["retries"] += 1
+            logger.warning(f"DeepSeek 流式請求失敗（{e!r}），{delay:.1f}s 後第 {attempt} 次重試")
+            await asyncio.sleep(delay)
+
+    # 已開始輸出後不再重試（避免重複內容），中途錯誤直接拋給調用方
+    converter = StreamingConverter()
+    completion_parts: list[str] = [first]
+    try:
+        converted = converter.feed(first)
+        if converted:
+            yield converted
+        async for content in stream:
+            completion_parts.append(content)
+            converted = converter.feed(content)
+            if converted:
+                yield converted
+        tail = converter.flush()
+        if tail:
+            yield tail
+        _log_token_usage(payload, priority, "".join(completion_parts), time.perf_counter() - started)
+    finally:
+        await stream.aclose()
+
+
+def admit_stream(priority: str) -> None:
+    """
+    流式響應開始後無法再改狀態碼，先做准入檢查：
+    熔斷中拋 LLMCircuitOpenError（503），隊列已滿拋 LLMQueueFullError（429）
+    """
+    breaker.check()
+    governor.check_admission(priority)
+
+
 async def chat_completion(
     messages: list[dict],
     model: str = "deepseek-chat",
     temperature: float = 0.7,
     max_tokens: int = 2000,
+    priority: str = "batch",
+    cache: bool = False,
 ) -> str:
-    """非流式調用 DeepSeek API"""
-    headers = {
-        "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json",
-    }
+    """非流式調用 DeepSeek API
+
+    cache=True 時先查內容尋址緩存，未命中再請求並寫回。
+    相同請求同時在途時只向上游發一次（single-flight）。
+    """
     payload = {
         "model": model,
         "messages": messages,
@@ -33,13 +362,23 @@ async def chat_completion(
         "max_tokens": max_tokens,
         "stream": False,
     }
+    key = make_cache_key(model, messages, temperature, max_tokens)
+
+    use_cache = cache and settings.LLM_CACHE_ENABLED
+    if use_cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            return cached
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(DEEPSEEK_CHAT_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        content = data["choices"][0]["message"]["content"]
-        return to_traditional(content)
+    async def fetch() -> str:
+        content = await _post_completion(payload, priority)
+        if use_cache:
+            await response_cache.set(key, content)
+        return content
+
+    if settings.LLM_SINGLE_FLIGHT:
+        return await single_flight.do(key, fetch)
+    return await fetch()
 
 
 async def chat_completion_stream(
@@ -47,36 +386,65 @@ async def chat_completion_stream(
     model: str = "deepseek-chat",
     temperature: float = 0.7,
     max_tokens: int = 2000,
+    priority: str = "module",
+    cache: bool = False,
 ) -> AsyncGenerator[str, None]:
-    """流式調用 DeepSeek API，逐 token 返回"""
-    headers = {
-        "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json",
-    }
+    """流式調用 DeepSeek API，逐 token 返回
+
+    cache=True 時命中緩存則直接回放為 chunk；未命中則邊轉發邊收集，完整結束後寫回緩存。
+    相同請求同時在途時共享同一個上游流，每個訂閱者獨立從頭回放。
+    """
     payload = {
         "model": model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
         "stream": True,
+        "stream_options": {"include_usage": True},
     }
+    key = make_cache_key(model, messages, temperature, max_tokens)
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        async with client.stream("POST", DEEPSEEK_CHAT_URL, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    data_str = line[6:]
-                    if data_str.strip() == "[DONE]":
-                        break
-                    try:
-                        data = json.loads(data_str)
-                        delta = data["choices"][0].get("delta", {})
-                        content = delta.get("content", "")
-                        if content:
-                            yield to_traditional(content)
-                    except (json.JSONDecodeError, KeyError, IndexError):
-                        continue
+    use_cache = cache and settings.LLM_CACHE_ENABLED
+    if use_cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            async for chunk in replay_as_stream(cached):
+                yield chunk
+            return
+
+    async def fetch() -> AsyncGenerator[str, None]:
+        parts = []
+        async for chunk in _stream_completion(payload, priority):
+            parts.append(chunk)
+            yield chunk
+        if use_cache:
+            await response_cache.set(key, "".join(parts))
+
+    stream = stream_group.subscribe(key, fetch) if settings.LLM_SINGLE_FLIGHT else fetch()
+    async for chunk in stream:
+        yield chunk
+
+
+def build_module_messages(
+    module: str,
+    scenario: Optional[str],
+    student_info: Optional[dict],
+    user_message: str,
+) -> list[dict]:
+    """組裝模組端點的 messages：用戶消息完整保留，個人檔案在剩餘預算內裁剪
+
+    用戶消息較短時 system prompt 預算固定為總預算的一半，保證同一學生的 system prompt 逐字節不變。
+    """
+    remaining = INPUT_BUDGETS["module"] - estimate_tokens(user_message) - 2 * MESSAGE_OVERHEAD_TOKENS
+    budget = min(INPUT_BUDGETS["module"] // 2, remaining)
+    current_prompt.set(get_module_template(module, scenario).fingerprint)
+    system_prompt = build_full_prompt(
+        module, scenario, student_info, max_tokens=budget, memo=render_memo(student_info),
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message},
+    ]
 
 
 async def get_ai_response(
@@ -85,22 +453,20 @@ async def get_ai_response(
     student_info: Optional[dict],
     user_message: str,
     stream: bool = True,
+    cache: bool = False,
 ) -> AsyncGenerator[str, None] | str:
     """
     精進學習系統的統一 AI 調用接口
 
     自動組裝 system prompt（模組 + 場景 + 個人檔案）
     """
-    system_prompt = build_full_prompt(module, scenario, student_info)
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_message},
-    ]
+    messages = build_module_messages(module, scenario, student_info, user_message)
 
     if stream:
-        return chat_completion_stream(messages)
+        admit_stream("module")
+        return chat_completion_stream(messages, priority="module", cache=cache)
     else:
-        return await chat_completion(messages)
+        return await chat_completion(messages, priority="batch", cache=cache)
 
 
 async def get_ai_response_full(
@@ -108,11 +474,8 @@ async def get_ai_response_full(
     scenario: Optional[str],
     student_info: Optional[dict],
     user_message: str,
+    cache: bool = False,
 ) -> str:
     """非流式版本，返回完整回覆"""
-    system_prompt = build_full_prompt(module, scenario, student_info)
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_message},
-    ]
-    return await chat_completion(messages)
+    messages = build_module_messages(module, scenario, student_info, user_message)
+    return await chat_completion(messages, priority="batch", cache=cache)
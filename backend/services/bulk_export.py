@@ -0,0 +1,259 @@
+"""
+批量導出（學年歸檔）
+一次導出一個或多個學生的全部精進旅程和學習記錄，兩種格式：
+
+- zip：每個旅程一個 Markdown 文件（與單個旅程導出內容相同），
+  每個學生另有 learning_records.jsonl
+- ndjson：每行一個 JSON 對象（conversation / message / artifact / learning_record / checkpoint / end）
+
+響應邊生成邊發送，內存佔用與導出總量無關：
+- 旅程列表按 (student_id, id) 分頁讀取（短事務）；消息和學習記錄用服務端游標流式讀取
+  （每次取 EXPORT_BULK_YIELD_PER 行）
+- ZIP 寫入只保留待發送的壓縮數據，每寫一段就發送並清空
+
+斷點續傳：每導出完一個旅程或一條學習記錄就前進一次游標「<學生ID>:c:<旅程ID>」/「<學生ID>:r:<記錄ID>」，
+帶 cursor 重新請求即從其後繼續。ndjson 在 checkpoint 行給出游標；
+zip 中旅程文件名以「c<旅程ID>_」開頭，learning_records.jsonl 每行帶 cursor 字段。
+"""
+import json
+import logging
+import zipfile
+from datetime import datetime
+from typing import AsyncGenerator, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from config import get_settings
+from database.connection import async_session
+from database.models import ChatMessage, Conversation, LearningRecord
+from services.agent_engine import strip_markers
+from services.conversation_artifacts import load_artifacts
+from services.conversation_export import (
+    export_cache, render_artifacts, render_footer, render_header, render_messages,
+)
+from services.turn_writer import turn_writer
+
+logger = logging.getLogger("jingjin.agent")
+settings = get_settings()
+
+SECTION_CONVERSATIONS = "c"
+SECTION_RECORDS = "r"
+SECTION_ORDER = (SECTION_CONVERSATIONS, SECTION_RECORDS)
+
+
+class ExportCursor(NamedTuple):
+    """已導出到的位置：學生 → 分區（旅程 / 學習記錄）→ 記錄 ID"""
+    student_id: int
+    section: str
+    last_id: int
+
+    def __str__(self) -> str:
+        return f"{self.student_id}:{self.section}:{self.last_id}"
+
+
+def parse_cursor(raw: Optional[str]) -> Optional[ExportCursor]:
+    """解析續傳游標，格式不對時拋 ValueError"""
+    if not raw:
+        return None
+    parts = raw.split(":")
+    if len(parts) != 3 or parts[1] not in SECTION_ORDER or not parts[0].isdigit() or not parts[2].isdigit():
+        raise ValueError(f"無效的導出游標: {raw}")
+    return ExportCursor(int(parts[0]), parts[1], int(parts[2]))
+
+
+def _after(cursor: Optional[ExportCursor], student_id: int, section: str) -> Optional[int]:
+    """該學生該分區應從哪個 ID 之後開始；整個分區已導出時返回 None"""
+    if cursor is None or student_id > cursor.student_id:
+        return 0
+    if student_id < cursor.student_id:
+        return None
+    position = SECTION_ORDER.index(section) - SECTION_ORDER.index(cursor.section)
+    if position < 0:
+        return None
+    return cursor.last_id if position == 0 else 0
+
+
+# ===================== 讀取 =====================
+
+async def _iter_conversations(student_id: int, after_id: int) -> AsyncGenerator[Conversation, None]:
+    """按 ID 分頁讀取學生的旅程（每頁一個短事務，不在導出全程佔用連接）"""
+    page_size = settings.EXPORT_BULK_YIELD_PER
+    last_id = after_id
+    while True:
+        async with async_session() as db:
+            result = await db.execute(
+                select(Conversation)
+                .where(Conversation.student_id == student_id, Conversation.id > last_id)
+                .order_by(Conversation.id)
+                .limit(page_size)
+            )
+            page = result.scalars().all()
+        for conv in page:
+            yield conv
+        if len(page) < page_size:
+            return
+        last_id = page[-1].id
+
+
+async def _stream_rows(stmt) -> AsyncGenerator[list, None]:
+    """用服務端游標流式讀取，每次產出一批 ORM 對象"""
+    async with async_session() as db:
+        result = await db.stream(stmt.execution_options(yield_per=settings.EXPORT_BULK_YIELD_PER))
+        async for partition in result.scalars().partitions():
+            yield partition
+
+
+def _messages_of(conversation_id: int):
+    return (
+        select(ChatMessage)
+        .where(ChatMessage.conversation_id == conversation_id)
+        .order_by(ChatMessage.created_at, ChatMessage.id)
+    )
+
+
+def _records_of(student_id: int, after_id: int):
+    return (
+        select(LearningRecord)
+        .where(LearningRecord.student_id == student_id, LearningRecord.id > after_id)
+        .order_by(LearningRecord.id)
+    )
+
+
+# ===================== 序列化 =====================
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value.value if hasattr(value, "value") else value
+
+
+def _columns(obj) -> dict:
+    return {col.key: _plain(getattr(obj, col.key)) for col in obj.__table__.columns}
+
+
+def _json_line(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+async def _conversation_markdown(conv: Conversation) -> AsyncGenerator[bytes, None]:
+    """單個旅程的 Markdown（與單個導出相同）；命中導出緩存時直接使用，未命中不寫入，免得擠掉日常導出的條目"""
+    cached = export_cache.get(conv)
+    if cached is not None:
+        yield cached
+    else:
+        yield render_header(conv).encode("utf-8")
+        async for batch in _stream_rows(_messages_of(conv.id)):
+            yield render_messages(batch).encode("utf-8")
+    async with async_session() as db:
+        artifacts = await load_artifacts(db, conv.id)
+    yield render_artifacts(artifacts).encode("utf-8")
+    yield render_footer().encode("utf-8")
+
+
+async def _conversation_ndjson(conv: Conversation) -> AsyncGenerator[str, None]:
+    conv_data = _columns(conv)
+    for internal in ("history_digest", "digest_upto_id", "version"):
+        conv_data.pop(internal, None)
+    yield _json_line({"type": "conversation", **conv_data})
+    async for batch in _stream_rows(_messages_of(conv.id)):
+        yield "".join(
+            _json_line({
+                "type": "message",
+                "id": msg.id,
+                "conversation_id": msg.conversation_id,
+                "role": msg.role,
+                "content": strip_markers(msg.content),
+                "phase_at_time": msg.phase_at_time,
+                "action_metadata": msg.action_metadata,
+                "created_at": _plain(msg.created_at),
+            })
+            for msg in batch if msg.role != "system"
+        )
+    async with async_session() as db:
+        artifacts = await load_artifacts(db, conv.id)
+    for kind, objs in artifacts.items():
+        for obj in objs:
+            yield _json_line({"type": "artifact", "conversation_id": conv.id, "kind": kind, "record": _columns(obj)})
+
+
+def _record_line(student_id: int, record: LearningRecord) -> str:
+    cursor = ExportCursor(student_id, SECTION_RECORDS, record.id)
+    return _json_line({"type": "learning_record", "cursor": str(cursor), **_columns(record)})
+
+
+# ===================== 導出 =====================
+
+async def export_ndjson(student_ids: list[int], cursor: Optional[ExportCursor]) -> AsyncGenerator[bytes, None]:
+    counts = {"conversations": 0, "learning_records": 0}
+    for sid in student_ids:
+        after = _after(cursor, sid, SECTION_CONVERSATIONS)
+        if after is not None:
+            async for conv in _iter_conversations(sid, after):
+                await turn_writer.barrier(conv.id)
+                async for chunk in _conversation_ndjson(conv):
+                    yield chunk.encode("utf-8")
+                counts["conversations"] += 1
+                checkpoint = ExportCursor(sid, SECTION_CONVERSATIONS, conv.id)
+                yield _json_line({"type": "checkpoint", "cursor": str(checkpoint)}).encode("utf-8")
+
+        after = _after(cursor, sid, SECTION_RECORDS)
+        if after is not None:
+            async for batch in _stream_rows(_records_of(sid, after)):
+                yield "".join(_record_line(sid, r) for r in batch).encode("utf-8")
+                counts["learning_records"] += len(batch)
+    yield _json_line({"type": "end", **counts}).encode("utf-8")
+
+
+class _ZipSink:
+    """ZipFile 的輸出目標：只緩存尚未發送的字節（不可 seek，ZipFile 改用數據描述符記錄大小）"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _entry_name(conv: Conversation) -> str:
+    safe_title = (conv.title or "").replace("/", "_")[:30]
+    return f"student_{conv.student_id}/c{conv.id}_{safe_title}.md"
+
+
+async def export_zip(student_ids: list[int], cursor: Optional[ExportCursor]) -> AsyncGenerator[bytes, None]:
+    async for data in _write_zip(student_ids, cursor):
+        if data:
+            yield data
+
+
+async def _write_zip(student_ids: list[int], cursor: Optional[ExportCursor]) -> AsyncGenerator[bytes, None]:
+    """每寫入一段就產出 ZipFile 已輸出的字節（可能為空）"""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for sid in student_ids:
+            after = _after(cursor, sid, SECTION_CONVERSATIONS)
+            if after is not None:
+                async for conv in _iter_conversations(sid, after):
+                    await turn_writer.barrier(conv.id)
+                    with zf.open(_entry_name(conv), "w") as entry:
+                        async for chunk in _conversation_markdown(conv):
+                            entry.write(chunk)
+                            yield sink.drain()
+                    yield sink.drain()
+
+            after = _after(cursor, sid, SECTION_RECORDS)
+            if after is not None:
+                with zf.open(f"student_{sid}/learning_records.jsonl", "w") as entry:
+                    async for batch in _stream_rows(_records_of(sid, after)):
+                        entry.write("".join(_record_line(sid, r) for r in batch).encode("utf-8"))
+                        yield sink.drain()
+                yield sink.drain()
+    yield sink.drain()
@@ -3,6 +3,8 @@
 統一使用繁體中文（正體中文）作為系統輸出語言。
 所有中文輸出（AI 回覆、語音識別、數據庫存儲）都必須經過此模組轉換。
 """
+from typing import Optional
+
 from opencc import OpenCC
 
 # s2t = Simplified to Traditional (簡體 → 繁體)
@@ -11,14 +13,141 @@ _s2t = OpenCC('s2t')
 # t2s = Traditional to Simplified (繁體 → 簡體，用於檢測)
 _t2s = OpenCC('t2s')
 
+# OpenCC 的分句符（空白、標點），任何詞條都不會跨越它們
+_SEPARATOR_RE = _s2t.split_chars_re
+
+
+def _build_s2t_index() -> tuple[int, Optional[frozenset], bool]:
+    """
+    從 s2t 字典推導流式轉換所需的信息：
+    - 最長詞條長度（決定需要保留的前瞻字數）
+    - 可能被改寫的字符集合（不含這些字符的文本轉換結果必然與原文相同）
+    - 所有詞條是否等長映射（等長才能用左側上下文轉換後按位置截取）
+    字典結構屬於 opencc-python-reimplemented 的內部實現，讀取失敗時退化為保守策略。
+    """
+    try:
+        max_len = 1
+        changing = set()
+        length_preserving = True
+        for group in _s2t._dict_chain_data:
+            for max_key_len, _min_key_len, mapping in group:
+                max_len = max(max_len, max_key_len)
+                for key, value in mapping.items():
+                    value = value.split(" ")[0]
+                    if len(key) != len(value):
+                        length_preserving = False
+                        changing.update(key)
+                        continue
+                    for src, dst in zip(key, value):
+                        if src != dst:
+                            changing.add(src)
+        return max_len, frozenset(changing), length_preserving
+    except (AttributeError, TypeError, ValueError):
+        return 16, None, False
+
+
+_MAX_PHRASE_LEN, _CHANGING_CHARS, _LENGTH_PRESERVING = _build_s2t_index()
+
+
+def _needs_conversion(text: str) -> bool:
+    return _CHANGING_CHARS is None or not _CHANGING_CHARS.isdisjoint(text)
+
 
 def to_traditional(text: str) -> str:
     """將簡體中文轉換為繁體中文。已是繁體的文字不受影響。"""
-    if not text:
+    if not text or not _needs_conversion(text):
         return text
     return _s2t.convert(text)
 
 
+class StreamingConverter:
+    """
+    流式簡→繁轉換器（用於 LLM 逐 token 輸出）
+
+    逐 delta 調用 to_traditional 既慢（每 1-3 個字一次字典匹配），
+    又會把跨 delta 的詞組轉錯（如「头」「发」分兩次到達）。本轉換器：
+    1. 遇到分句符時整句轉換輸出 —— 詞條不會跨越分句符
+    2. 未閉合的分句中，不含可轉換字符的前綴立即原樣輸出
+    3. 含可轉換字符時只保留最長詞條所需的前瞻字數，其餘帶左右兩側上下文轉換後輸出
+    4. 流結束時 flush() 輸出剩餘內容
+
+    用法：
+        conv = StreamingConverter()
+        for delta in stream: out = conv.feed(delta)
+        tail = conv.flush()
+    """
+
+    def __init__(self):
+        self._lookahead = _MAX_PHRASE_LEN - 1
+        self._pending = ""      # 已收到、尚未輸出的原文
+        self._context = ""      # 當前分句中已輸出的原文（只作為左側上下文，最多 lookahead 字）
+
+    def _convert(self, text: str, right: str = "") -> str:
+        """
+        帶左側上下文（已輸出部分）和右側上下文 right（尚未確定的前瞻）轉換 text，
+        只返回 text 對應的部分。跨越 text 末尾的詞組需要 right 才能與整段轉換一致。
+        """
+        if not _LENGTH_PRESERVING or (not self._context and not right):
+            return to_traditional(text)
+        converted = to_traditional(self._context + text + right)
+        start = len(self._context)
+        return converted[start:start + len(text)]
+
+    def _advance_context(self, emitted: str) -> None:
+        self._context = (self._context + emitted)[-self._lookahead:] if self._lookahead else ""
+
+    def feed(self, delta: str) -> str:
+        if not delta:
+            return ""
+        self._pending += delta
+        out = []
+
+        # 1. 最後一個分句符之前的內容已完整，整段轉換輸出
+        last_sep_end = 0
+        for m in _SEPARATOR_RE.finditer(self._pending):
+            last_sep_end = m.end()
+        if last_sep_end:
+            out.append(self._convert(self._pending[:last_sep_end]))
+            self._pending = self._pending[last_sep_end:]
+            self._context = ""
+
+        pending = self._pending
+        if not pending:
+            return "".join(out)
+
+        # 2. 未閉合分句：不會被改寫的字符無需等待
+        if not _needs_conversion(pending):
+            out.append(pending)
+            self._advance_context(pending)
+            self._pending = ""
+            return "".join(out)
+
+        first = next(i for i, ch in enumerate(pending) if ch in _CHANGING_CHARS) \
+            if _CHANGING_CHARS is not None else 0
+        if first:
+            out.append(pending[:first])
+            self._advance_context(pending[:first])
+            pending = pending[first:]
+
+        # 3. 保留最長詞條所需的前瞻，其餘部分可以確定
+        #    （詞條不等長時無法按位置截取，只能等到分句符或 flush）
+        if _LENGTH_PRESERVING and len(pending) > self._lookahead:
+            cut = len(pending) - self._lookahead
+            out.append(self._convert(pending[:cut], pending[cut:]))
+            self._advance_context(pending[:cut])
+            pending = pending[cut:]
+
+        self._pending = pending
+        return "".join(out)
+
+    def flush(self) -> str:
+        """流結束：轉換並輸出所有剩餘內容"""
+        out = self._convert(self._pending) if self._pending else ""
+        self._pending = ""
+        self._context = ""
+        return out
+
+
 def to_simplified(text: str) -> str:
     """將繁體中文轉換為簡體中文。僅用於檢測目的。"""
     if not text:
@@ -31,7 +160,7 @@ def has_simplified(text: str) -> bool:
     檢測文本中是否包含簡體字。
     原理：將文本轉繁體後比對，如果有差異則說明原文含簡體。
     """
-    if not text:
+    if not text or not _needs_conversion(text):
         return False
     converted = _s2t.convert(text)
     return converted != text
@@ -0,0 +1,175 @@
+"""
+旅程關聯記錄（conversation_artifacts）
+execute_actions 每保存一條記錄，同時寫入一行 (conversation_id, kind, target_id)。
+刪除、導出、列出旅程數據都按 (conversation_id, kind, target_id) 唯一索引批量操作，
+不再加載整段對話逐條解析 action_metadata。
+
+該表上線前的歷史對話由 backfill_artifacts 從 action_metadata 補建（可重複執行，已存在的行跳過）：
+啟動時在後台執行，完成後記入 data_migrations，未完成（被打斷 / 失敗）時下次啟動重試；
+也可用 scripts/backfill_conversation_artifacts.py 手動執行。刪除旅程前會先補建該對話，
+不依賴全量補建是否已完成。
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.connection import async_session
+from database.models import (
+    ActionPlan, ChatMessage, ConversationArtifact, DataMigration, Goal, LearningRecord, TimeEntry,
+)
+
+logger = logging.getLogger("jingjin.agent")
+
+BACKFILL_MIGRATION = "conversation_artifacts_backfill"
+
+# kind → 記錄所在的模型
+ARTIFACT_MODELS = {
+    "time_entry": TimeEntry,
+    "goal": Goal,
+    "action_plan": ActionPlan,
+    "learning_record": LearningRecord,
+}
+
+# action_metadata 中各類 ACTION 結果的記錄 ID 鍵 → kind
+RESULT_ID_KINDS = {
+    "entry_id": "time_entry",
+    "goal_id": "goal",
+    "plan_id": "action_plan",
+    "record_id": "learning_record",
+}
+
+
+def artifacts_from_metadata(meta) -> list[tuple[str, int]]:
+    """從一條消息的 action_metadata 解析成功保存的記錄 (kind, target_id)（兼容舊的單個 "action"）"""
+    if not meta or not isinstance(meta, dict):
+        return []
+    actions = meta.get("actions") or []
+    if isinstance(meta.get("action"), dict):
+        actions = [meta["action"], *actions]
+    found = []
+    for action in actions:
+        if not isinstance(action, dict) or not action.get("success"):
+            continue
+        for id_key, kind in RESULT_ID_KINDS.items():
+            target_id = action.get(id_key)
+            if isinstance(target_id, int):
+                found.append((kind, target_id))
+    return found
+
+
+async def load_artifacts(db: AsyncSession, conversation_id: int) -> dict[str, list]:
+    """按 kind 加載旅程創建的記錄（每類一條 IN 子查詢，按創建順序）"""
+    loaded = {}
+    for kind, model in ARTIFACT_MODELS.items():
+        ids = (
+            select(ConversationArtifact.target_id)
+            .where(ConversationArtifact.conversation_id == conversation_id, ConversationArtifact.kind == kind)
+        )
+        result = await db.execute(select(model).where(model.id.in_(ids)).order_by(model.id))
+        loaded[kind] = list(result.scalars().all())
+    return loaded
+
+
+async def delete_artifacts(db: AsyncSession, conversation_id: int) -> dict[str, int]:
+    """批量刪除旅程創建的記錄及其關聯行，返回各表刪除的行數"""
+
+    def target_ids(kind: str):
+        return (
+            select(ConversationArtifact.target_id)
+            .where(ConversationArtifact.conversation_id == conversation_id, ConversationArtifact.kind == kind)
+        )
+
+    deleted = {}
+    r = await db.execute(delete(TimeEntry).where(TimeEntry.id.in_(target_ids("time_entry"))))
+    if r.rowcount:
+        deleted["time_entries"] = r.rowcount
+    # 先刪除關聯到這些目標的 action_plans（goal_id FK）
+    await db.execute(delete(ActionPlan).where(ActionPlan.goal_id.in_(target_ids("goal"))))
+    r = await db.execute(delete(Goal).where(Goal.id.in_(target_ids("goal"))))
+    if r.rowcount:
+        deleted["goals"] = r.rowcount
+    r = await db.execute(delete(ActionPlan).where(ActionPlan.id.in_(target_ids("action_plan"))))
+    if r.rowcount:
+        deleted["action_plans"] = r.rowcount
+    r = await db.execute(delete(LearningRecord).where(LearningRecord.id.in_(target_ids("learning_record"))))
+    if r.rowcount:
+        deleted["learning_records"] = r.rowcount
+    await db.execute(delete(ConversationArtifact).where(ConversationArtifact.conversation_id == conversation_id))
+    return deleted
+
+
+async def backfill_artifacts(batch_size: int = 500, conversation_id: Optional[int] = None) -> int:
+    """從已有消息的 action_metadata 補建關聯記錄（按消息 ID 分頁，每頁一個短事務），返回新增行數"""
+    added = 0
+    last_id = 0
+    while True:
+        async with async_session() as db:
+            stmt = (
+                select(ChatMessage.id, ChatMessage.conversation_id, ChatMessage.action_metadata,
+                       ChatMessage.created_at)
+                .where(ChatMessage.id > last_id, ChatMessage.action_metadata.is_not(None))
+                .order_by(ChatMessage.id)
+                .limit(batch_size)
+            )
+            if conversation_id is not None:
+                stmt = stmt.where(ChatMessage.conversation_id == conversation_id)
+            page = (await db.execute(stmt)).all()
+            if not page:
+                break
+            last_id = page[-1].id
+
+            wanted = {}
+            for msg in page:
+                for kind, target_id in artifacts_from_metadata(msg.action_metadata):
+                    wanted.setdefault((msg.conversation_id, kind, target_id), msg.created_at)
+            if wanted:
+                existing = await db.execute(
+                    select(ConversationArtifact.conversation_id, ConversationArtifact.kind,
+                           ConversationArtifact.target_id)
+                    .where(tuple_(
+                        ConversationArtifact.conversation_id, ConversationArtifact.kind,
+                        ConversationArtifact.target_id,
+                    ).in_(list(wanted)))
+                )
+                for row in existing:
+                    wanted.pop(tuple(row), None)
+            if wanted:
+                await db.execute(insert(ConversationArtifact), [
+                    {"conversation_id": cid, "kind": kind, "target_id": target_id, "created_at": created_at}
+                    for (cid, kind, target_id), created_at in wanted.items()
+                ])
+                await db.commit()
+                added += len(wanted)
+    if added:
+        logger.info(f"已從 action_metadata 補建 {added} 條旅程關聯記錄")
+    return added
+
+
+async def backfill_completed() -> bool:
+    async with async_session() as db:
+        return await db.get(DataMigration, BACKFILL_MIGRATION) is not None
+
+
+async def mark_backfill_completed() -> None:
+    async with async_session() as db:
+        if await db.get(DataMigration, BACKFILL_MIGRATION) is None:
+            db.add(DataMigration(name=BACKFILL_MIGRATION))
+            await db.commit()
+
+
+async def _run_backfill() -> None:
+    try:
+        if await backfill_completed():
+            return
+        await backfill_artifacts()
+        await mark_backfill_completed()
+    except Exception as e:
+        logger.error(f"旅程關聯記錄補建失敗（下次啟動重試，或用 scripts/backfill_conversation_artifacts.py）: {e}")
+
+
+def start_backfill() -> asyncio.Task:
+    """在後台執行補建（不阻塞啟動；已記錄完成時直接返回）"""
+    return asyncio.create_task(_run_backfill())
@@ -0,0 +1,254 @@
+"""
+旅程 Markdown 導出
+以生成器逐段產出文檔，配合 StreamingResponse 邊生成邊發送，不在內存中拼出整份文檔：
+
+- 對話記錄按 (created_at, id) 索引分頁讀取（每頁 EXPORT_PAGE_SIZE 條，每頁一個短事務，
+  客戶端下載較慢時不長時間佔用數據庫連接）
+- 行動數據只取本旅程 conversation_artifacts 登記的記錄，每次導出都重新讀取
+  （記錄可能在其他頁面被編輯或刪除，不會改動對話的 updated_at）
+- 頁首和對話記錄的渲染結果按對話緩存，鍵為 (updated_at, version)：
+  對話有新消息、階段推進或重命名後自動失效；緩存總大小上限 EXPORT_CACHE_MAX_BYTES
+"""
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncGenerator, NamedTuple, Optional
+
+from sqlalchemy import and_, or_, select
+
+from config import get_settings
+from database.connection import async_session
+from database.models import ChatMessage, Conversation
+from prompts.agent_prompts import PHASES, PHASE_ORDER
+from services.agent_engine import strip_markers
+from services.conversation_artifacts import load_artifacts
+
+logger = logging.getLogger("jingjin.agent")
+settings = get_settings()
+
+SCENARIO_LABELS = {"academic": "學科提升", "expression": "表達提升", "interview": "面試提升"}
+STATUS_LABELS = {"active": "進行中", "completed": "已完成", "archived": "已歸檔"}
+HALF_LIFE_LABELS = {"long": "長半衰期", "short": "短半衰期"}
+PHASE_NAMES = {p: PHASES[p]["name"] for p in PHASE_ORDER}
+
+
+def _value(field) -> str:
+    return field.value if hasattr(field, "value") else str(field)
+
+
+# ===================== 渲染 =====================
+
+def render_header(conv: Conversation) -> str:
+    lines: list[str] = []
+
+    # --- Header ---
+    lines.append(f"# 精進旅程：{conv.title}")
+    lines.append("")
+    scn = _value(conv.scenario)
+    sts = _value(conv.status)
+    lines.append(f"- **場景**：{SCENARIO_LABELS.get(scn, scn)}")
+    lines.append(f"- **狀態**：{STATUS_LABELS.get(sts, sts)}")
+    created = conv.created_at.strftime("%Y-%m-%d %H:%M") if conv.created_at else "—"
+    updated = conv.updated_at.strftime("%Y-%m-%d %H:%M") if conv.updated_at else "—"
+    lines.append(f"- **時間**：{created} ~ {updated}")
+    lines.append("")
+
+    # --- Phase overview ---
+    lines.append("## 旅程總覽")
+    lines.append("")
+    ctx = conv.phase_context or {}
+    current_idx = PHASE_ORDER.index(conv.current_phase) if conv.current_phase in PHASE_ORDER else 0
+    for i, key in enumerate(PHASE_ORDER):
+        name = PHASE_NAMES[key]
+        if key in ctx:
+            mark = "[x]"
+        elif i == current_idx and sts != "completed":
+            mark = "[-]"  # current
+        else:
+            mark = "[ ]"
+        lines.append(f"- {mark} **{i+1}. {name}** — {PHASES[key]['book_chapter']}")
+    lines.append("")
+
+    # --- Phase summaries ---
+    if ctx:
+        lines.append("## 各階段成果")
+        lines.append("")
+        for key in PHASE_ORDER:
+            if key not in ctx:
+                continue
+            phase_data = ctx[key]
+            name = PHASE_NAMES[key]
+            summary = phase_data.get("summary", "") if isinstance(phase_data, dict) else str(phase_data)
+            lines.append(f"### {PHASES[key]['order']}. {name}")
+            lines.append("")
+            lines.append(f"**小結**：{summary}")
+            lines.append("")
+
+    # --- Chat transcript ---
+    lines.append("## 完整對話記錄")
+    lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def render_messages(messages) -> str:
+    lines: list[str] = []
+    for msg in messages:
+        if msg.role == "system":
+            continue
+        role_label = "學生" if msg.role == "user" else "教練"
+        phase_label = PHASE_NAMES.get(msg.phase_at_time, msg.phase_at_time or "")
+        content = strip_markers(msg.content)
+        ts = msg.created_at.strftime("%H:%M") if msg.created_at else ""
+        lines.append(f"**{role_label}**（{phase_label} {ts}）：")
+        lines.append("")
+        lines.append(content)
+        lines.append("")
+        lines.append("---")
+        lines.append("")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def render_artifacts(artifacts: dict[str, list]) -> str:
+    entries = artifacts["time_entry"]
+    goals = artifacts["goal"]
+    plans = artifacts["action_plan"]
+    if not (entries or goals or plans):
+        return ""
+
+    lines = ["## 行動數據", ""]
+    if entries:
+        lines.append("### 時間記錄")
+        lines.append("")
+        for e in entries:
+            hl = HALF_LIFE_LABELS.get(e.half_life, e.half_life or "")
+            lines.append(f"- {e.activity}（{e.duration_minutes} 分鐘，{hl}，收益值 {e.benefit_value}/5）")
+        lines.append("")
+
+    if goals:
+        lines.append("### 目標")
+        lines.append("")
+        for g in goals:
+            lines.append(f"- **{g.title}**")
+            if g.description:
+                lines.append(f"  - 描述：{g.description}")
+            if g.five_year_vision:
+                lines.append(f"  - 五年願景：{g.five_year_vision}")
+        lines.append("")
+
+    if plans:
+        lines.append("### 行動計劃")
+        lines.append("")
+        for p in plans:
+            lines.append(f"- **{p.title}**")
+            if p.core_tasks:
+                lines.append(f"  - 核心任務：{', '.join(p.core_tasks)}")
+            if p.support_tasks:
+                lines.append(f"  - 支撐任務：{', '.join(p.support_tasks)}")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def render_footer() -> str:
+    return f"---\n\n*由精進學習系統導出 · {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC*"
+
+
+async def _render_transcript(conv: Conversation) -> AsyncGenerator[str, None]:
+    """逐段產出頁首和分頁讀取的對話記錄"""
+    yield render_header(conv)
+
+    page_size = settings.EXPORT_PAGE_SIZE
+    last: Optional[tuple[datetime, int]] = None
+    while True:
+        stmt = select(ChatMessage).where(ChatMessage.conversation_id == conv.id)
+        if last is not None:
+            stmt = stmt.where(or_(
+                ChatMessage.created_at > last[0],
+                and_(ChatMessage.created_at == last[0], ChatMessage.id > last[1]),
+            ))
+        async with async_session() as db:
+            result = await db.execute(
+                stmt.order_by(ChatMessage.created_at, ChatMessage.id).limit(page_size)
+            )
+            page = result.scalars().all()
+        if page:
+            chunk = render_messages(page)
+            if chunk:
+                yield chunk
+            last = (page[-1].created_at, page[-1].id)
+        if len(page) < page_size:
+            break
+
+
+# ===================== 緩存 =====================
+
+class _CachedExport(NamedTuple):
+    key: tuple
+    body: bytes
+
+
+class ExportCache:
+    """按對話緩存渲染好的頁首和對話記錄；鍵為 (updated_at, version)，對話變化後自然失效"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[int, _CachedExport] = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def cache_key(conv: Conversation) -> tuple:
+        return (conv.updated_at, conv.version)
+
+    def get(self, conv: Conversation) -> Optional[bytes]:
+        entry = self._entries.get(conv.id)
+        if entry is None or entry.key != self.cache_key(conv):
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(conv.id)
+        self._stats["hits"] += 1
+        return entry.body
+
+    def put(self, conv: Conversation, body: bytes) -> None:
+        if len(body) > self.max_bytes // 4:
+            # 單份超過總量四分之一的長對話不緩存，免得擠掉其他條目
+            logger.info(f"對話 {conv.id} 導出內容 {len(body)} 字節，超出緩存單條上限，不緩存")
+            return
+        self.discard(conv.id)
+        self._entries[conv.id] = _CachedExport(self.cache_key(conv), body)
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= len(old.body)
+            self._stats["evictions"] += 1
+
+    def discard(self, conversation_id: int) -> None:
+        old = self._entries.pop(conversation_id, None)
+        if old is not None:
+            self._bytes -= len(old.body)
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "size": len(self._entries), "bytes": self._bytes}
+
+
+export_cache = ExportCache(max_bytes=settings.EXPORT_CACHE_MAX_BYTES)
+
+
+async def export_markdown(conv: Conversation) -> AsyncGenerator[bytes, None]:
+    """導出旅程 Markdown（UTF-8 字節流）；對話記錄命中緩存時直接發送，否則邊渲染邊發送並寫入緩存"""
+    body = export_cache.get(conv)
+    if body is not None:
+        yield body
+    else:
+        parts: list[bytes] = []
+        async for chunk in _render_transcript(conv):
+            data = chunk.encode("utf-8")
+            parts.append(data)
+            yield data
+        export_cache.put(conv, b"".join(parts))
+
+    async with async_session() as db:
+        artifacts = await load_artifacts(db, conv.id)
+    chunk = render_artifacts(artifacts)
+    if chunk:
+        yield chunk.encode("utf-8")
+    yield render_footer().encode("utf-8")
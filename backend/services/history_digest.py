@@ -0,0 +1,153 @@
+"""
+Agent 對話滾動摘要
+每輪對話提交後在後台檢查：移出歷史窗口（最近 HISTORY_WINDOW 條）且尚未摘要的消息累計達到
+AGENT_DIGEST_BATCH 條時，調用 AI 把它們併入 Conversation.history_digest，並記錄 digest_upto_id。
+build_messages 將摘要放入 system prompt，使 prompt 長度固定的同時保留整段旅程的記憶。
+
+壓縮以 batch 優先級在後台任務中執行，不佔用互動請求的延遲；同一對話同一時間只有一個壓縮任務。
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import select, update
+
+from config import get_settings
+from database.connection import async_session
+from database.models import ChatMessage, Conversation
+from prompts.agent_prompts import HISTORY_DIGEST_FINGERPRINT, build_history_digest_messages
+from services.agent_engine import HISTORY_WINDOW, strip_markers
+from services.ai_service import chat_completion
+from services.llm_usage import current_endpoint, current_prompt
+from services.token_budget import CJK_TOKENS_PER_CHAR
+
+logger = logging.getLogger("jingjin.agent")
+settings = get_settings()
+
+DIGEST_MAX_CHARS = int(settings.AGENT_DIGEST_MAX_TOKENS / CJK_TOKENS_PER_CHAR)
+MAX_MESSAGES_PER_RUN = 60        # 單次壓縮最多納入的消息數（積壓更多時分多次完成）
+MESSAGE_CHAR_LIMIT = 400         # 每條消息納入摘要請求的字數上限
+
+_running: set[int] = set()
+_tasks: set[asyncio.Task] = set()
+_stats = {"runs": 0, "messages": 0, "failures": 0}
+
+
+def schedule_compaction(conversation_id: int) -> None:
+    """在後台為對話安排一次摘要壓縮（已有任務在途時跳過）"""
+    if not settings.AGENT_DIGEST_ENABLED or conversation_id in _running:
+        return
+    _running.add(conversation_id)
+    task = asyncio.create_task(_run(conversation_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _run(conversation_id: int) -> None:
+    current_endpoint.set("background history_digest")
+    current_prompt.set(HISTORY_DIGEST_FINGERPRINT)
+    try:
+        # 積壓較多時（如功能開啟前的長對話）連續壓縮，直到不足一批
+        while await compact_conversation(conversation_id):
+            pass
+    except Exception as e:
+        _stats["failures"] += 1
+        logger.warning(f"對話摘要壓縮失敗: conv={conversation_id}, {e}")
+    finally:
+        _running.discard(conversation_id)
+
+
+def _transcript(messages: list[ChatMessage]) -> str:
+    lines = []
+    for msg in messages:
+        content = strip_markers(msg.content) if msg.role == "assistant" else msg.content.strip()
+        if len(content) > MESSAGE_CHAR_LIMIT:
+            content = content[:MESSAGE_CHAR_LIMIT] + "…"
+        lines.append(f"{'學生' if msg.role == 'user' else '教練'}：{content}")
+    return "\n".join(lines)
+
+
+async def compact_conversation(conversation_id: int) -> bool:
+    """把窗口外未摘要的消息併入摘要；返回是否完成了一次壓縮"""
+    async with async_session() as db:
+        conv = await db.get(Conversation, conversation_id)
+        if conv is None:
+            return False
+        upto_id = conv.digest_upto_id
+        previous = conv.history_digest or ""
+
+        window = await db.execute(
+            select(ChatMessage.id)
+            .where(ChatMessage.conversation_id == conversation_id)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+            .limit(HISTORY_WINDOW)
+        )
+        window_ids = set(window.scalars().all())
+        if len(window_ids) < HISTORY_WINDOW:
+            return False
+
+        stmt = select(ChatMessage).where(
+            ChatMessage.conversation_id == conversation_id,
+            ChatMessage.id.not_in(window_ids),
+            ChatMessage.role.in_(("user", "assistant")),
+        )
+        if upto_id is not None:
+            stmt = stmt.where(ChatMessage.id > upto_id)
+        result = await db.execute(
+            stmt.order_by(ChatMessage.created_at, ChatMessage.id).limit(MAX_MESSAGES_PER_RUN)
+        )
+        pending = list(result.scalars().all())
+        if len(pending) < settings.AGENT_DIGEST_BATCH:
+            return False
+
+    # 調用 AI 期間不持有數據庫連接
+    digest = await chat_completion(
+        build_history_digest_messages(previous, _transcript(pending), DIGEST_MAX_CHARS),
+        temperature=0.3,
+        max_tokens=settings.AGENT_DIGEST_MAX_TOKENS * 2,
+        priority="batch",
+    )
+    digest = digest.strip()
+    if len(digest) > DIGEST_MAX_CHARS:
+        digest = "…" + digest[-DIGEST_MAX_CHARS:]
+    new_upto = max(m.id for m in pending)
+
+    async with async_session() as db:
+        # 只在摘要未被其他進程更新時寫入；保持 updated_at 不變，不影響對話列表排序
+        condition = (
+            Conversation.digest_upto_id.is_(None) if upto_id is None
+            else Conversation.digest_upto_id == upto_id
+        )
+        result = await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, condition)
+            .values(
+                history_digest=digest,
+                digest_upto_id=new_upto,
+                updated_at=Conversation.updated_at,
+            )
+        )
+        await db.commit()
+    if result.rowcount != 1:
+        return False
+
+    _stats["runs"] += 1
+    _stats["messages"] += len(pending)
+    logger.info(f"對話摘要已更新: conv={conversation_id}, 新增 {len(pending)} 條, 摘要 {len(digest)} 字")
+    return True
+
+
+async def drain(timeout: Optional[float] = 10.0) -> None:
+    """關閉時等待在途的壓縮任務，超時則取消"""
+    if not _tasks:
+        return
+    done, pending = await asyncio.wait(set(_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.info(f"已取消 {len(pending)} 個未完成的對話摘要任務")
+
+
+def get_stats() -> dict:
+    return {**_stats, "in_flight": len(_running)}
@@ -29,6 +29,7 @@ async def get_student_full(db: AsyncSession, student_id: int) -> Optional[Studen
 def student_to_context(student: Student) -> dict:
     """將 Student ORM 對象轉換為 AI Prompt 上下文字典"""
     ctx = {
+        "id": student.id,
         "name": student.name,
         "grade": student.grade,
         "school": student.school,
@@ -0,0 +1,197 @@
+"""
+LLM 回覆內容尋址緩存
+key = sha256(model, messages, temperature, max_tokens)，兩級存儲：
+1. 內存 LRU —— 進程內熱點，零 IO
+2. 本地 SQLite —— 跨重啟保留，按 TTL 和總大小淘汰
+
+僅對調用方顯式開啟 cache=True 的請求生效（題目生成、反饋摘要等近似確定性的任務）。
+緩存命中時也可通過 replay_as_stream() 以 SSE chunk 的形式回放給流式端點。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Optional
+
+from config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger("jingjin.ai.cache")
+
+
+def make_cache_key(
+    model: str,
+    messages: list[dict],
+    temperature: float,
+    max_tokens: int,
+) -> str:
+    """對請求參數做規範化序列化後取 sha256"""
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+async def replay_as_stream(text: str, chunk_size: int = 8) -> AsyncGenerator[str, None]:
+    """把完整回覆切成小段逐個 yield，模擬流式輸出"""
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i + chunk_size]
+        await asyncio.sleep(0)
+
+
+class ResponseCache:
+    """內存 LRU + SQLite 兩級緩存"""
+
+    def __init__(
+        self,
+        path: str,
+        ttl: int,
+        memory_items: int,
+        disk_max_bytes: int,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    # ---------- SQLite（在線程池中執行，避免阻塞事件循環） ----------
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[tuple[float, str]]:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            return expires_at, value
+
+    def _disk_set(self, key: str, value: str, expires_at: float) -> int:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires_at, now),
+            )
+            db.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict < 50:
+                return 0
+            self._writes_since_evict = 0
+            return self._disk_evict(now)
+
+    def _disk_evict(self, now: float) -> int:
+        """刪除過期項；總大小超限時按最近訪問時間淘汰最舊的項"""
+        db = self._db()
+        evicted = db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,)).rowcount
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total > self.disk_max_bytes:
+            excess = total - self.disk_max_bytes
+            freed = 0
+            victims = []
+            for key, size in db.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at"):
+                victims.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            db.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+            evicted += len(victims)
+        db.commit()
+        return evicted
+
+    # ---------- 對外接口 ----------
+
+    def _memory_put(self, key: str, expires_at: float, value: str) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._memory.get(key)
+        if item:
+            expires_at, value = item
+            if expires_at >= time.time():
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+            del self._memory[key]
+
+        try:
+            item = await asyncio.to_thread(self._disk_get, key)
+        except sqlite3.Error as e:
+            logger.warning(f"讀取磁盤緩存失敗: {e}")
+            item = None
+        if item:
+            expires_at, value = item
+            self._memory_put(key, expires_at, value)
+            self._stats["disk_hits"] += 1
+            return value
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, expires_at, value)
+        self._stats["stores"] += 1
+        try:
+            self._stats["evictions"] += await asyncio.to_thread(self._disk_set, key, value, expires_at)
+        except sqlite3.Error as e:
+            logger.warning(f"寫入磁盤緩存失敗: {e}")
+
+    def get_stats(self) -> dict:
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "memory_size": len(self._memory),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache(
+    path=os.path.join(settings.LLM_CACHE_DIR, "llm_cache.sqlite3"),
+    ttl=settings.LLM_CACHE_TTL,
+    memory_items=settings.LLM_CACHE_MEMORY_ITEMS,
+    disk_max_bytes=settings.LLM_CACHE_DISK_MAX_MB * 1024 * 1024,
+)
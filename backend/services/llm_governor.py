@@ -0,0 +1,155 @@
+"""
+LLM 並發准入控制
+對所有 DeepSeek 調用施加全局並發上限，超出上限的請求按優先級排隊：
+  interactive（Agent 對話） > module（模組流式端點） > batch（生成 / 分析類任務）
+隊列已滿時立即拋出 LLMQueueFullError，由 main.py 轉為 429 + Retry-After。
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from config import get_settings
+
+settings = get_settings()
+
+PRIORITIES = {
+    "interactive": 0,
+    "module": 1,
+    "batch": 2,
+}
+
+
+class LLMQueueFullError(Exception):
+    """LLM 排隊已滿，請求被拒絕"""
+
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(f"AI 服務繁忙（{priority} 隊列已滿），請 {retry_after} 秒後重試")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class LLMGovernor:
+    """按優先級排隊的全局並發信號量"""
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._hold_ewma = 0.0          # 單個請求佔用槽位的平均秒數
+        self._stats = {
+            p: {"admitted": 0, "queued": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for p in PRIORITIES
+        }
+        self._recent_waits = {p: deque(maxlen=200) for p in PRIORITIES}
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    def has_capacity(self) -> bool:
+        """是否有空閒槽位且無人排隊（對沖請求只在此時發起）"""
+        return self._active < self.max_concurrency and not self.queue_depth
+
+    def _is_full(self) -> bool:
+        return self._active >= self.max_concurrency and self.queue_depth >= self.max_queue
+
+    def retry_after(self) -> int:
+        """按當前隊列深度和平均佔用時長估算重試等待秒數"""
+        if self._hold_ewma <= 0:
+            return settings.LLM_QUEUE_RETRY_AFTER
+        estimate = (self.queue_depth + 1) * self._hold_ewma / self.max_concurrency
+        return max(1, math.ceil(estimate))
+
+    def check_admission(self, priority: str) -> None:
+        """非阻塞檢查：隊列已滿時立即拒絕（用於流式響應開始前快速返回 429）"""
+        if self._is_full():
+            self._stats[priority]["rejected"] += 1
+            raise LLMQueueFullError(priority, self.retry_after())
+
+    async def acquire(self, priority: str) -> float:
+        """獲取一個並發槽位，返回排隊等待秒數"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的 LLM 優先級: {priority}")
+        stats = self._stats[priority]
+
+        if self._active < self.max_concurrency and not self.queue_depth:
+            self._active += 1
+            stats["admitted"] += 1
+            self._recent_waits[priority].append(0.0)
+            return 0.0
+
+        if self.queue_depth >= self.max_queue:
+            stats["rejected"] += 1
+            raise LLMQueueFullError(priority, self.retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._seq), fut))
+        stats["queued"] += 1
+        started = time.monotonic()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 已被分配槽位但調用方取消：把槽位交還給下一個等待者
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+        waited = time.monotonic() - started
+        stats["admitted"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        self._recent_waits[priority].append(waited)
+        return waited
+
+    def release(self, held_seconds: Optional[float] = None) -> None:
+        """釋放槽位；有等待者時直接移交給優先級最高者"""
+        if held_seconds is not None:
+            self._hold_ewma = held_seconds if self._hold_ewma <= 0 else 0.8 * self._hold_ewma + 0.2 * held_seconds
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: str):
+        """`async with governor.slot("interactive"):` 包裹一次 LLM 調用"""
+        await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def get_stats(self) -> dict:
+        by_priority = {}
+        for p, s in self._stats.items():
+            waits = sorted(self._recent_waits[p])
+            p95 = waits[math.ceil(len(waits) * 0.95) - 1] if waits else 0.0
+            avg = s["wait_total"] / s["queued"] if s["queued"] else 0.0
+            by_priority[p] = {
+                "admitted": s["admitted"],
+                "queued": s["queued"],
+                "rejected": s["rejected"],
+                "avg_queue_wait": round(avg, 3),
+                "p95_queue_wait": round(p95, 3),
+                "max_queue_wait": round(s["wait_max"], 3),
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queue_depth": self.queue_depth,
+            "priorities": by_priority,
+        }
+
+
+governor = LLMGovernor(settings.LLM_MAX_CONCURRENCY, settings.LLM_MAX_QUEUE)
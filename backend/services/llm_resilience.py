@@ -0,0 +1,153 @@
+"""
+LLM 調用容錯：重試退避、首 token 延遲統計（用於對沖請求）、熔斷器
+
+- 連接失敗 / 首字節前超時 / 429 / 5xx 屬於可重試錯誤，按帶抖動的指數退避重試
+- 首 token 延遲超過歷史分位數時可發起一個對沖請求，先出 token 者勝出
+- 連續失敗達到閾值後熔斷，冷卻期內直接拋出 LLMCircuitOpenError（main.py 轉為 503），
+  冷卻結束後放行一個探測請求，成功即恢復
+"""
+import math
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+from config import get_settings
+
+settings = get_settings()
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMCircuitOpenError(Exception):
+    """DeepSeek 熔斷中，請求被快速拒絕"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"AI 服務暫時不可用，請 {retry_after} 秒後重試")
+        self.retry_after = retry_after
+
+
+class LLMFirstTokenTimeout(httpx.TimeoutException):
+    """在限定時間內未收到首個 token"""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """是否屬於上游暫時性故障（可重試，且計入熔斷）"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    if isinstance(exc, httpx.PoolTimeout):
+        return False    # 本地連接池耗盡，與上游無關
+    return isinstance(exc, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError))
+
+
+def backoff_delay(attempt: int, exc: Optional[BaseException] = None) -> float:
+    """第 attempt 次重試前的等待秒數（full jitter）；429 帶 Retry-After 時優先採用"""
+    cap = settings.LLM_RETRY_MAX_DELAY
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = exc.response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), cap)
+    return random.uniform(0, min(cap, settings.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class LatencyTracker:
+    """最近 N 次首 token 延遲，用於計算對沖觸發點"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """樣本不足時返回 None"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+
+    def get_stats(self) -> dict:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "samples": len(self._samples),
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class CircuitBreaker:
+    """
+    三態熔斷器：closed → open（連續失敗達到閾值）→ half_open（冷卻結束）→ closed / open
+
+    每次上游調用前 probe = acquire()，結束後 release(success, probe)：
+    success=True 成功，False 上游故障，None 與上游無關的中止（如客戶端斷開、對沖落敗）；
+    probe 為半開狀態下的探測憑證，只有探測請求本身釋放時才歸還探測名額
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe: Optional[object] = None     # 進行中的探測請求憑證
+        self._stats = {"opened": 0, "rejected": 0}
+
+    def _retry_after(self) -> int:
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        return max(1, math.ceil(remaining))
+
+    def check(self) -> None:
+        """不佔用探測名額的檢查（用於流式響應開始前快速失敗）"""
+        if self.state == "open" and time.monotonic() - self._opened_at < self.reset_timeout:
+            self._stats["rejected"] += 1
+            raise LLMCircuitOpenError(self._retry_after())
+
+    def acquire(self) -> Optional[object]:
+        """放行一次調用；半開狀態下返回探測憑證，其餘情況返回 None"""
+        if self.state == "open":
+            self.check()
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probe is not None:
+                self._stats["rejected"] += 1
+                raise LLMCircuitOpenError(max(1, math.ceil(self.reset_timeout / 2)))
+            self._probe = object()
+            return self._probe
+        return None
+
+    def release(self, success: Optional[bool], probe: Optional[object] = None) -> None:
+        # 熔斷前已放行的請求在半開期間結束時，不能歸還仍在進行的探測名額
+        if probe is not None and probe is self._probe:
+            self._probe = None
+        if success is True:
+            self._failures = 0
+            self.state = "closed"
+        elif success is False:
+            self.record_failure()
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self._stats["opened"] += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probe = None
+
+    def get_stats(self) -> dict:
+        stats = {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            **self._stats,
+        }
+        if self.state == "open":
+            stats["retry_after"] = self._retry_after()
+        return stats
+
+
+breaker = CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_TIMEOUT)
+ttft_tracker = LatencyTracker()
@@ -0,0 +1,145 @@
+"""
+LLM 請求單飛（single-flight）合併
+同一時刻內容完全相同的請求（key 同緩存 key）只向上游發出一次：
+- 非流式：後到者等待同一個 Future
+- 流式：上游 token 由一個後台任務寫入共享緩衝，每個訂閱者從頭獨立回放，
+  中途加入的訂閱者也能拿到完整回覆
+
+全班同時打開同一模組、同一場景/難度的題目生成等場景可大幅減少上游調用。
+"""
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Optional
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    """避免無人等待時出現 'Task exception was never retrieved'"""
+    if not task.cancelled():
+        task.exception()
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """非流式請求合併"""
+
+    def __init__(self):
+        self._calls: dict[str, _Call] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(_consume_exception)
+            task.add_done_callback(lambda _t: self._calls.pop(key, None))
+            call = self._calls[key] = _Call(task)
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            # shield：單個等待者被取消不影響其他等待者
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._calls)}
+
+
+class SharedStream:
+    """一個上游流 + 可被多個訂閱者獨立回放的 chunk 緩衝"""
+
+    def __init__(self, source: AsyncIterator[str], on_finish: Callable[[], None]):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_finish = on_finish
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = ConnectionAbortedError("上游流已取消")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._on_finish()
+            self._notify()
+
+    def subscribe(self) -> AsyncGenerator[str, None]:
+        """返回獨立的回放迭代器（開始迭代時才登記為訂閱者）"""
+        return self._replay()
+
+    async def _replay(self) -> AsyncGenerator[str, None]:
+        """從第一個 chunk 開始回放，追上後等待新 chunk"""
+        i = 0
+        # 在生成器內計數：遞增和 finally 中的遞減成對執行，從未迭代的訂閱不會讓上游永遠無法取消
+        self.subscribers += 1
+        try:
+            while True:
+                if i < len(self.chunks):
+                    yield self.chunks[i]
+                    i += 1
+                    continue
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self._task.cancel()
+
+
+class StreamGroup:
+    """流式請求合併：相同 key 的訂閱者共享同一個 SharedStream"""
+
+    def __init__(self):
+        self._streams: dict[str, SharedStream] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    def subscribe(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]],
+    ) -> AsyncGenerator[str, None]:
+        shared = self._streams.get(key)
+        if shared is None or shared.done:
+            shared = SharedStream(factory(), on_finish=lambda: self._forget(key))
+            self._streams[key] = shared
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        return shared.subscribe()
+
+    def _forget(self, key: str) -> None:
+        shared = self._streams.get(key)
+        if shared is not None and shared.done:
+            del self._streams[key]
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._streams)}
+
+
+single_flight = SingleFlight()
+stream_group = StreamGroup()
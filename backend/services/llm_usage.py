@@ -0,0 +1,111 @@
+"""
+LLM 用量統計（按端點）
+記錄 DeepSeek 返回的 usage，包括上下文緩存命中 / 未命中的 token 數，用於跟蹤各端點的緩存命中率。
+
+端點名由 EndpointContextMiddleware 在請求進入時寫入 contextvar，
+路徑中的數字 ID 歸一化為 {id}（如 /api/agent/{id}/conversations/{id}/chat），避免基數爆炸。
+單飛合併 / 共享流的後台任務在創建時複製上下文，因此記在發起請求的端點名下。
+
+組裝 messages 時把 Prompt 模板指紋（prompts.compiled）寫入 current_prompt，
+用量和耗時另按指紋累計，Prompt 改版前後的緩存命中率和延遲可直接對比。
+"""
+import re
+from contextvars import ContextVar
+
+current_endpoint: ContextVar[str] = ContextVar("llm_endpoint", default="internal")
+current_prompt: ContextVar[str] = ContextVar("llm_prompt", default="")
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def normalize_path(path: str) -> str:
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+class EndpointContextMiddleware:
+    """純 ASGI 中間件：為每個 HTTP 請求設置 current_endpoint（不包裝響應體，不影響 SSE 流式輸出）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = current_endpoint.set(f"{scope['method']} {normalize_path(scope['path'])}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_endpoint.reset(token)
+
+
+def _empty_stats() -> dict:
+    return {
+        "requests": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cache_hit_tokens": 0,
+        "cache_miss_tokens": 0,
+    }
+
+
+class UsageTracker:
+    """按端點和 Prompt 模板指紋累計 usage"""
+
+    def __init__(self):
+        self._by_endpoint: dict[str, dict] = {}
+        self._by_prompt: dict[str, dict] = {}
+
+    def record(self, usage: dict) -> None:
+        endpoint = current_endpoint.get()
+        stats = self._by_endpoint.get(endpoint)
+        if stats is None:
+            stats = self._by_endpoint[endpoint] = _empty_stats()
+        targets = [stats]
+        prompt = current_prompt.get()
+        if prompt:
+            prompt_stats = self._by_prompt.get(prompt)
+            if prompt_stats is None:
+                prompt_stats = self._by_prompt[prompt] = {**_empty_stats(), "latency": 0.0, "timed": 0}
+            targets.append(prompt_stats)
+        for stats in targets:
+            stats["requests"] += 1
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["completion_tokens"] += usage.get("completion_tokens") or 0
+            stats["cache_hit_tokens"] += usage.get("prompt_cache_hit_tokens") or 0
+            stats["cache_miss_tokens"] += usage.get("prompt_cache_miss_tokens") or 0
+
+    def record_latency(self, elapsed: float) -> None:
+        """記錄一次完成請求的耗時（按當前 Prompt 模板指紋）"""
+        prompt = current_prompt.get()
+        if not prompt:
+            return
+        stats = self._by_prompt.get(prompt)
+        if stats is None:
+            stats = self._by_prompt[prompt] = {**_empty_stats(), "latency": 0.0, "timed": 0}
+        stats["latency"] += elapsed
+        stats["timed"] += 1
+
+    @staticmethod
+    def _hit_rate(stats: dict) -> float:
+        total = stats["cache_hit_tokens"] + stats["cache_miss_tokens"]
+        return round(stats["cache_hit_tokens"] / total, 3) if total else 0.0
+
+    def get_stats(self) -> dict:
+        totals = _empty_stats()
+        endpoints = {}
+        for endpoint, stats in sorted(self._by_endpoint.items()):
+            endpoints[endpoint] = {**stats, "cache_hit_rate": self._hit_rate(stats)}
+            for k in totals:
+                totals[k] += stats[k]
+        prompts = {
+            prompt: {
+                "requests": stats["requests"],
+                "cache_hit_rate": self._hit_rate(stats),
+                "avg_latency": round(stats["latency"] / stats["timed"], 3) if stats["timed"] else 0.0,
+            }
+            for prompt, stats in sorted(self._by_prompt.items())
+        }
+        return {**totals, "cache_hit_rate": self._hit_rate(totals), "endpoints": endpoints, "prompts": prompts}
+
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,168 @@
+"""
+Agent 回覆標記的增量掃描器
+逐 chunk 掃描 LLM 流式輸出，按線性時間把它切分為：
+- text 事件：學生可見的文本，可立即推送給前端
+- action / phase_complete 事件：<!--ACTION:{...}--> / <!--PHASE_COMPLETE:{...}--> 標記閉合時立即產出解析後的數據
+
+每個字符只被檢查一次（跨 chunk 邊界只攜帶最多 3 個字符的前綴），不再反覆拼接整段回覆並做全文正則匹配。
+"""
+import json
+import logging
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger("jingjin.agent")
+
+MARKER_OPEN = "<!--"
+MARKER_CLOSE = "-->"
+MARKER_KINDS = {
+    "ACTION:": "action",
+    "PHASE_COMPLETE:": "phase_complete",
+}
+
+
+class MarkerEvent(NamedTuple):
+    kind: str                     # "text" / "action" / "phase_complete"
+    text: str = ""                # text 事件的文本；標記事件為原始標記內容
+    data: Optional[dict] = None   # 標記事件解析後的 JSON
+
+
+def _partial_suffix(text: str, token: str) -> int:
+    """text 末尾可能是 token 前綴的最長長度（用於跨 chunk 邊界的匹配）"""
+    for n in range(min(len(token) - 1, len(text)), 0, -1):
+        if text.endswith(token[:n]):
+            return n
+    return 0
+
+
+class MarkerScanner:
+    """
+    用法：
+        scanner = MarkerScanner()
+        for chunk in stream:
+            for event in scanner.feed(chunk): ...
+        for event in scanner.finish(): ...
+        scanner.raw_text / scanner.markers / scanner.first("phase_complete") / scanner.all("action")
+    """
+
+    def __init__(self):
+        self._raw: list[str] = []          # 完整原文（含標記），用於存庫
+        self._in_marker = False
+        self._carry = ""                   # 尚未確定的尾部（可能是標記起始符或結束符的前綴）
+        self._marker: list[str] = []       # 當前未閉合標記的內容
+        self._space = ""                   # 暫緩輸出的尾部空白（回覆末尾的空白會被丟棄）
+        self.markers: list[MarkerEvent] = []
+
+    @property
+    def raw_text(self) -> str:
+        if len(self._raw) > 1:
+            self._raw = ["".join(self._raw)]
+        return self._raw[0] if self._raw else ""
+
+    def _text(self, text: str, events: list[MarkerEvent]) -> None:
+        """輸出可見文本；尾部空白先暫存，等到後面出現非空白字符再一起輸出"""
+        if not text:
+            return
+        if not text[-1].isspace():
+            events.append(MarkerEvent("text", self._space + text if self._space else text))
+            self._space = ""
+            return
+        stripped = text.rstrip()
+        if stripped:
+            events.append(MarkerEvent("text", self._space + stripped))
+            self._space = text[len(stripped):]
+        else:
+            self._space += text
+
+    def _close_marker(self, events: list[MarkerEvent]) -> None:
+        body = "".join(self._marker)
+        self._marker = []
+        for prefix, kind in MARKER_KINDS.items():
+            if body.startswith(prefix):
+                payload = body[len(prefix):]
+                try:
+                    data = json.loads(payload)
+                except json.JSONDecodeError:
+                    logger.warning(f"無法解析 {prefix[:-1]} 標記: {payload}")
+                    return
+                event = MarkerEvent(kind, body, data if isinstance(data, dict) else None)
+                self.markers.append(event)
+                events.append(event)
+                return
+        # 其他 HTML 註釋不是引擎標記，原樣作為文本
+        self._text(MARKER_OPEN + body + MARKER_CLOSE, events)
+
+    def feed(self, chunk: str) -> list[MarkerEvent]:
+        events: list[MarkerEvent] = []
+        if not chunk:
+            return events
+        self._raw.append(chunk)
+        # 快速路徑：普通文本 chunk（絕大多數情況）
+        if not self._in_marker and not self._carry and "<" not in chunk:
+            if chunk[-1].isspace():
+                self._text(chunk, events)
+            else:
+                events.append(MarkerEvent("text", self._space + chunk if self._space else chunk))
+                self._space = ""
+            return events
+        text = self._carry + chunk
+        self._carry = ""
+        pos = 0
+        while pos < len(text):
+            if not self._in_marker:
+                start = text.find(MARKER_OPEN, pos)
+                if start < 0:
+                    keep = _partial_suffix(text, MARKER_OPEN)
+                    self._text(text[pos:len(text) - keep], events)
+                    self._carry = text[len(text) - keep:]
+                    break
+                self._text(text[pos:start], events)
+                self._in_marker = True
+                pos = start + len(MARKER_OPEN)
+            else:
+                end = text.find(MARKER_CLOSE, pos)
+                if end < 0:
+                    keep = _partial_suffix(text, MARKER_CLOSE)
+                    self._marker.append(text[pos:len(text) - keep])
+                    self._carry = text[len(text) - keep:]
+                    break
+                self._marker.append(text[pos:end])
+                self._in_marker = False
+                self._close_marker(events)
+                pos = end + len(MARKER_CLOSE)
+        return events
+
+    def finish(self) -> list[MarkerEvent]:
+        """流結束：輸出剩餘文本；未閉合的引擎標記直接丟棄，不洩露給學生"""
+        events: list[MarkerEvent] = []
+        if self._in_marker:
+            body = "".join(self._marker) + self._carry
+            # 標記名本身被截斷（如 "<!--ACT"）也按引擎標記處理
+            if not any(body.startswith(p) or p.startswith(body) for p in MARKER_KINDS):
+                self._text(MARKER_OPEN + body, events)
+            else:
+                logger.warning(f"回覆結束時標記未閉合，已丟棄: {body[:80]}")
+        else:
+            self._text(self._carry, events)
+        self._in_marker = False
+        self._marker = []
+        self._carry = ""
+        self._space = ""
+        return events
+
+    def abort(self, text: str) -> list[MarkerEvent]:
+        """上游出錯：丟棄已收到的內容和標記，以 text 作為完整回覆"""
+        self._raw = [text]
+        self._in_marker = False
+        self._marker = []
+        self._carry = ""
+        self._space = ""
+        self.markers = []
+        return [MarkerEvent("text", text)]
+
+    def first(self, kind: str) -> Optional[dict]:
+        """第一個指定類型標記的數據"""
+        return next((m.data for m in self.markers if m.kind == kind), None)
+
+    def all(self, kind: str) -> list[dict]:
+        """所有指定類型標記的數據（按出現順序）"""
+        return [m.data for m in self.markers if m.kind == kind and m.data is not None]
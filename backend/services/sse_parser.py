@@ -0,0 +1,120 @@
+"""
+DeepSeek 流式響應（SSE）增量解析
+直接處理原始字節，不經過逐行解碼：
+- 按 \\n 切分事件，兼容 \\r\\n 結尾
+- ": keep-alive" 等註釋行直接跳過，不做任何解析
+- 多行 data 按 SSE 規範以 \\n 拼接
+- 安裝了 orjson 時用其解析 JSON（可選依賴：pip install orjson），否則回退到標準庫 json
+"""
+import json
+import logging
+from typing import AsyncGenerator, AsyncIterator, Optional
+
+logger = logging.getLogger("jingjin.ai.sse")
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _JSON_ERRORS: tuple = (orjson.JSONDecodeError,)
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _json_loads = json.loads
+    _JSON_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+    JSON_BACKEND = "json"
+
+DONE = b"[DONE]"
+_COLON = 0x3A    # 以 ':' 開頭的是註釋行（keep-alive）
+
+
+class SSEDecoder:
+    """
+    增量 SSE 解碼器：feed() 接收任意切分的字節塊，返回已完整的事件 data
+
+    用法：
+        decoder = SSEDecoder()
+        async for raw in response.aiter_bytes():
+            for payload in decoder.feed(raw): ...
+        for payload in decoder.flush(): ...
+    """
+
+    def __init__(self):
+        self._buf = b""
+        self._data: list[bytes] = []
+
+    def _line(self, line: bytes, events: list[bytes]) -> None:
+        if line.endswith(b"\r"):
+            line = line[:-1]
+        if not line:
+            # 空行：事件結束
+            if self._data:
+                events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+                self._data = []
+            return
+        if line[0] == _COLON:
+            return
+        if line.startswith(b"data:"):
+            value = line[5:]
+            if value[:1] == b" ":
+                value = value[1:]
+            self._data.append(value)
+        # event: / id: / retry: 等字段 DeepSeek 不使用，忽略
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        buf = self._buf + chunk if self._buf else chunk
+        events: list[bytes] = []
+        start = 0
+        while True:
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            self._line(buf[start:nl], events)
+            start = nl + 1
+        self._buf = buf[start:]
+        return events
+
+    def flush(self) -> list[bytes]:
+        """連接關閉：處理未以空行結尾的最後一個事件"""
+        events: list[bytes] = []
+        if self._buf:
+            self._line(self._buf, events)
+            self._buf = b""
+        self._line(b"", events)
+        return events
+
+
+def parse_payload(payload: bytes) -> Optional[dict]:
+    """解析一個 data 負載，格式錯誤時返回 None"""
+    try:
+        data = _json_loads(payload)
+    except _JSON_ERRORS:
+        logger.debug(f"跳過無法解析的 SSE 負載: {payload[:80]!r}")
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def chunk_content(data: dict) -> str:
+    """取出 chat.completion.chunk 中的增量文本"""
+    choices = data.get("choices")
+    if not choices:
+        return ""
+    delta = choices[0].get("delta")
+    return (delta.get("content") or "") if delta else ""
+
+
+async def iter_sse_json(byte_stream: AsyncIterator[bytes]) -> AsyncGenerator[dict, None]:
+    """把響應字節流解析為 JSON 事件，遇到 [DONE] 結束"""
+    decoder = SSEDecoder()
+    async for raw in byte_stream:
+        for payload in decoder.feed(raw):
+            if payload == DONE:
+                return
+            data = parse_payload(payload)
+            if data is not None:
+                yield data
+    for payload in decoder.flush():
+        if payload == DONE:
+            return
+        data = parse_payload(payload)
+        if data is not None:
+            yield data
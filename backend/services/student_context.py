@@ -0,0 +1,135 @@
+"""
+學生 Prompt 上下文緩存
+Agent 每輪和各模組端點都需要學生檔案上下文，原本每次都要 get_student_full（三條 selectin 查詢）
+→ student_to_context → build_student_context。這裡按學生緩存上下文字典及其渲染結果：
+
+- 每個學生有一個進程內版本號；Student / AbilityProfile / InterestItem / FeedbackSummary
+  有寫入並提交後自動遞增（監聽 ORM flush / commit），緩存條目版本不一致即失效
+- 內存 LRU，條目數上限 STUDENT_CONTEXT_CACHE_ITEMS；另設 TTL，
+  兜底多進程部署時其他 worker 的寫入
+- 渲染結果按 max_tokens 記在緩存條目中（條目與版本一一對應），經 render_memo 交給 build_student_context
+
+返回的上下文字典在多個請求間共享，調用方只讀不改。
+"""
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import get_settings
+from database.models import AbilityProfile, FeedbackSummary, InterestItem, Student
+from services.learning_engine import get_student_full, student_to_context
+
+settings = get_settings()
+
+_PROFILE_CHILDREN = (AbilityProfile, InterestItem, FeedbackSummary)
+
+
+class _Entry(NamedTuple):
+    version: int
+    loaded_at: float
+    context: dict
+    rendered: dict          # max_tokens -> 渲染後的上下文文本
+
+
+class StudentContextCache:
+    """按學生 ID 的版本化 LRU 緩存"""
+
+    def __init__(self, max_items: int, ttl: float):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._versions: dict[int, int] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def version(self, student_id: int) -> int:
+        return self._versions.get(student_id, 0)
+
+    def bump(self, student_id: int) -> None:
+        """學生檔案有變更：遞增版本並丟棄緩存條目"""
+        self._versions[student_id] = self.version(student_id) + 1
+        if self._entries.pop(student_id, None) is not None:
+            self._stats["invalidations"] += 1
+
+    async def get(self, db: AsyncSession, student_id: int) -> Optional[dict]:
+        """獲取學生上下文字典；學生不存在時返回 None"""
+        entry = self._entries.get(student_id)
+        version = self.version(student_id)
+        if entry is not None and entry.version == version and time.monotonic() - entry.loaded_at < self.ttl:
+            self._entries.move_to_end(student_id)
+            self._stats["hits"] += 1
+            return entry.context
+
+        self._stats["misses"] += 1
+        student = await get_student_full(db, student_id)
+        if student is None:
+            return None
+        context = student_to_context(student)
+        # 查詢期間版本被遞增（有並發寫入）時不寫入緩存，避免以新版本號緩存舊數據
+        if self.version(student_id) == version:
+            self._entries[student_id] = _Entry(version, time.monotonic(), context, {})
+            self._entries.move_to_end(student_id)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return context
+
+    def render_memo(self, context: dict) -> Optional[dict]:
+        """context 是當前版本的緩存條目時返回其渲染記錄，否則（已失效 / 未緩存）返回 None"""
+        entry = self._entries.get(context.get("id"))
+        if entry is None or entry.context is not context or entry.version != self.version(context["id"]):
+            return None
+        return entry.rendered
+
+    def get_stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "size": len(self._entries),
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+student_context_cache = StudentContextCache(
+    max_items=settings.STUDENT_CONTEXT_CACHE_ITEMS,
+    ttl=settings.STUDENT_CONTEXT_CACHE_TTL,
+)
+
+
+async def get_student_context(db: AsyncSession, student_id: int) -> Optional[dict]:
+    """取代 get_student_full + student_to_context 的緩存版本"""
+    return await student_context_cache.get(db, student_id)
+
+
+def render_memo(context: Optional[dict]) -> Optional[dict]:
+    """供 build_student_context / build_full_prompt 使用的渲染記錄"""
+    return student_context_cache.render_memo(context) if context else None
+
+
+# ===================== 版本遞增（ORM 事件） =====================
+
+@event.listens_for(Session, "after_flush")
+def _collect_profile_changes(session: Session, flush_context) -> None:
+    """記錄本次事務中檔案有變更的學生，提交後再遞增版本"""
+    changed = session.info.setdefault("changed_student_ids", set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Student):
+            changed.add(obj.id)
+        elif isinstance(obj, _PROFILE_CHILDREN):
+            changed.add(obj.student_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_after_commit(session: Session) -> None:
+    for student_id in session.info.pop("changed_student_ids", ()):
+        if student_id is not None:
+            student_context_cache.bump(student_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop("changed_student_ids", None)
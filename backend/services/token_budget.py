@@ -0,0 +1,50 @@
+"""
+Token 估算與輸入預算
+DeepSeek 分詞器下，中文約 0.6 token/字，英文 / 數字 / 半角符號約 0.3 token/字。
+估算只用 UTF-8 字節數推算各類字符數量（全部在 C 層完成），不逐字遍歷，可在每次請求時調用。
+
+各端點的輸入預算見 INPUT_BUDGETS；超出預算時由調用方按優先級裁剪：
+歷史消息（從最舊的開始）→ 反饋摘要 → 興趣 → 檔案中的長文本欄位。
+"""
+import math
+
+from config import get_settings
+
+settings = get_settings()
+
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+MESSAGE_OVERHEAD_TOKENS = 4      # 每條消息的 role / 分隔符開銷
+
+INPUT_BUDGETS = {
+    "agent": settings.LLM_AGENT_INPUT_BUDGET,
+    "module": settings.LLM_MODULE_INPUT_BUDGET,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本 token 數（中文字符按 3 字節計，其餘按 1 字節計）"""
+    if not text:
+        return 0
+    chars = len(text)
+    wide = (len(text.encode("utf-8")) - chars) // 2     # 3 字節字符（中文及全角標點）的近似數量
+    wide = min(wide, chars)
+    return math.ceil(wide * CJK_TOKENS_PER_CHAR + (chars - wide) * OTHER_TOKENS_PER_CHAR)
+
+
+def estimate_messages_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def fit_history(history: list[dict], budget: int) -> list[dict]:
+    """從最新的消息往前保留，直到用完預算；返回按時間順序排列的子列表"""
+    kept = []
+    used = 0
+    for msg in reversed(history):
+        cost = estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+    return kept
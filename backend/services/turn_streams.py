@@ -0,0 +1,249 @@
+"""
+Agent 對話輪次的串行化、冪等重放與斷點續傳
+同一對話的 /start、/chat 以前各自並行：雙擊或移動端重試會讓兩個請求同時調用 AI、
+同時追加消息並爭奪 current_phase；客戶端斷線後流也無法接續，只能重發消息再調用一次 AI。
+這裡為每輪對話建立一個 TurnStream：
+
+- 每個對話一把輪次鎖：同一對話同一時間只有一輪在生成，後到的請求排隊，
+  拿到鎖後再經 turn_writer.barrier 讀到上一輪已落庫的狀態
+- 輪次在後台任務中生成，產出的 SSE 事件編號（id: <輪次ID>:<序號>）後緩存在 TurnStream 中，
+  HTTP 響應只是它的訂閱者；斷線後帶 Last-Event-ID 重連即從下一個事件續傳
+- 帶冪等鍵（Idempotency-Key）的請求：同鍵的重試直接訂閱在途的輪次，
+  或重放已完成的結果，不再重複調用 AI；同鍵不同消息返回 IdempotencyConflict
+- 訂閱者全部斷開後輪次繼續生成，AGENT_TURN_ORPHAN_GRACE 秒內仍無人接上才取消；
+  客戶端主動停止生成時調用 cancel
+- 已完成的輪次保留 AGENT_TURN_REPLAY_TTL 秒，最多 AGENT_TURN_REPLAY_MAX 輪，超出時先淘汰最早完成的
+
+註冊表在進程內，多 worker 部署時需按對話 ID 做粘性路由。
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from typing import AsyncGenerator, Callable, Optional
+
+from config import get_settings
+
+logger = logging.getLogger("jingjin.agent")
+settings = get_settings()
+
+
+class IdempotencyConflict(Exception):
+    """冪等鍵已用於同一對話中內容不同的請求"""
+
+    def __init__(self, key: str):
+        super().__init__(f"冪等鍵 {key} 已用於另一條消息")
+        self.key = key
+
+
+def parse_event_id(event_id: Optional[str]) -> tuple[Optional[str], int]:
+    """解析 Last-Event-ID（<輪次ID>:<序號>），格式不對時返回 (None, 0)"""
+    if not event_id:
+        return None, 0
+    turn_id, _, seq = event_id.strip().rpartition(":")
+    if not turn_id or not seq.isdigit():
+        return None, 0
+    return turn_id, int(seq)
+
+
+class TurnStream:
+    """一輪對話的 SSE 事件緩衝，可被多個請求訂閱"""
+
+    def __init__(self, conversation_id: int, key: Optional[str], fingerprint: str):
+        self.turn_id = uuid.uuid4().hex[:16]
+        self.conversation_id = conversation_id
+        self.key = key
+        self.fingerprint = fingerprint
+        self.events: list[str] = []
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str) -> None:
+        self.events.append(f"id: {self.turn_id}:{len(self.events) + 1}\n{event}")
+        self._notify()
+
+    def close(self) -> None:
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(
+        self, after: int, on_leave: Callable[["TurnStream"], None],
+    ) -> AsyncGenerator[str, None]:
+        """從序號 after 之後的事件開始重放，再跟隨後續事件直到本輪結束"""
+        self.subscribers += 1
+        try:
+            sent = min(max(after, 0), len(self.events))
+            while True:
+                while sent < len(self.events):
+                    yield self.events[sent]
+                    sent += 1
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                on_leave(self)
+
+
+class TurnRegistry:
+    def __init__(self, replay_ttl: float, replay_max: int, orphan_grace: float):
+        self.replay_ttl = replay_ttl
+        self.replay_max = replay_max
+        self.orphan_grace = orphan_grace
+        self._turns: dict[str, TurnStream] = {}                  # 輪次 ID → 輪次（在途 + 已完成）
+        self._finished: OrderedDict[str, None] = OrderedDict()   # 已完成輪次（按完成順序）
+        self._by_key: dict[tuple[int, str], TurnStream] = {}
+        self._latest: dict[int, TurnStream] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._lock_users: dict[int, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._stats = {
+            "turns": 0, "replays": 0, "resumes": 0, "conflicts": 0,
+            "cancelled": 0, "waited": 0, "evicted": 0,
+        }
+
+    def attach(self, conversation_id: int, key: Optional[str], fingerprint: str) -> Optional[TurnStream]:
+        """查找同鍵的在途或已完成輪次；不存在時返回 None，內容不同時拋 IdempotencyConflict"""
+        if not key:
+            return None
+        stream = self._by_key.get((conversation_id, key))
+        if stream is None:
+            return None
+        if stream.fingerprint != fingerprint:
+            self._stats["conflicts"] += 1
+            raise IdempotencyConflict(key)
+        self._stats["replays"] += 1
+        logger.info(f"對話 {conversation_id} 冪等鍵 {key} 命中，{'重放結果' if stream.done else '接入在途輪次'}")
+        return stream
+
+    def find(self, conversation_id: int, turn_id: Optional[str] = None) -> Optional[TurnStream]:
+        """按輪次 ID 查找（未指定時取該對話最近一輪）；輪次不屬於該對話或已過期時返回 None"""
+        stream = self._turns.get(turn_id) if turn_id else self._latest.get(conversation_id)
+        if stream is None or stream.conversation_id != conversation_id:
+            return None
+        return stream
+
+    def start(
+        self,
+        conversation_id: int,
+        key: Optional[str],
+        fingerprint: str,
+        produce: Callable[[], AsyncGenerator[str, None]],
+    ) -> TurnStream:
+        """登記一輪新對話並在後台開始生成（須在同一事件循環步內緊跟 attach 調用）"""
+        stream = TurnStream(conversation_id, key, fingerprint)
+        self._turns[stream.turn_id] = stream
+        self._latest[conversation_id] = stream
+        if key:
+            self._by_key[(conversation_id, key)] = stream
+        stream.task = asyncio.create_task(self._drive(stream, produce))
+        self._tasks.add(stream.task)
+        stream.task.add_done_callback(self._tasks.discard)
+        self._stats["turns"] += 1
+        return stream
+
+    async def _drive(self, stream: TurnStream, produce: Callable[[], AsyncGenerator[str, None]]) -> None:
+        cid = stream.conversation_id
+        lock = self._locks.setdefault(cid, asyncio.Lock())
+        self._lock_users[cid] = self._lock_users.get(cid, 0) + 1
+        cancelled = False
+        try:
+            if lock.locked():
+                self._stats["waited"] += 1
+            async with lock:
+                async for event in produce():
+                    stream.publish(event)
+        except asyncio.CancelledError:
+            # 被取消的輪次不可重放或續傳，同鍵重試重新生成
+            cancelled = True
+            self._stats["cancelled"] += 1
+            self._forget(stream)
+            raise
+        except Exception as e:
+            logger.error(f"對話 {cid} 輪次生成異常: {e}")
+        finally:
+            stream.close()
+            self._lock_users[cid] -= 1
+            if not self._lock_users[cid]:
+                del self._lock_users[cid]
+                del self._locks[cid]
+            if not cancelled:
+                self._retain(stream)
+
+    def _retain(self, stream: TurnStream) -> None:
+        """已完成輪次保留 replay_ttl 秒；超出條數上限時淘汰最早完成的"""
+        self._finished[stream.turn_id] = None
+        asyncio.get_running_loop().call_later(self.replay_ttl, self._forget, stream)
+        while len(self._finished) > self.replay_max:
+            oldest = self._turns.get(next(iter(self._finished)))
+            if oldest is None:
+                self._finished.popitem(last=False)
+                continue
+            self._forget(oldest)
+            self._stats["evicted"] += 1
+
+    def _forget(self, stream: TurnStream) -> None:
+        if self._turns.get(stream.turn_id) is stream:
+            del self._turns[stream.turn_id]
+        self._finished.pop(stream.turn_id, None)
+        if stream.key and self._by_key.get((stream.conversation_id, stream.key)) is stream:
+            del self._by_key[(stream.conversation_id, stream.key)]
+        if self._latest.get(stream.conversation_id) is stream:
+            del self._latest[stream.conversation_id]
+
+    def subscribe(self, stream: TurnStream, after: int = 0) -> AsyncGenerator[str, None]:
+        if after:
+            self._stats["resumes"] += 1
+        return stream.subscribe(after, self._on_leave)
+
+    def _on_leave(self, stream: TurnStream) -> None:
+        """最後一個訂閱者斷開：輪次繼續生成，等待重連"""
+        if self.orphan_grace <= 0:
+            stream.task.cancel()
+            return
+        asyncio.get_running_loop().call_later(self.orphan_grace, self._cancel_orphan, stream)
+
+    def _cancel_orphan(self, stream: TurnStream) -> None:
+        if stream.subscribers == 0 and not stream.done:
+            logger.info(f"對話 {stream.conversation_id} 輪次 {stream.turn_id} 無人接入，已取消")
+            stream.task.cancel()
+
+    def cancel(self, conversation_id: int) -> int:
+        """停止該對話正在生成（或排隊中）的輪次，返回取消的輪次數"""
+        streams = [s for s in self._turns.values() if s.conversation_id == conversation_id and not s.done]
+        for stream in streams:
+            stream.task.cancel()
+        return len(streams)
+
+    async def drain(self, timeout: Optional[float] = 30.0) -> None:
+        """關閉時等待在途輪次生成完畢並提交到後寫隊列，超時則取消"""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.info(f"已取消 {len(pending)} 個未完成的對話輪次")
+
+    def get_stats(self) -> dict:
+        return {
+            "in_flight": len(self._tasks),
+            **self._stats,
+            "active_conversations": len(self._locks),
+            "retained": len(self._finished),
+        }
+
+
+turn_registry = TurnRegistry(
+    replay_ttl=settings.AGENT_TURN_REPLAY_TTL,
+    replay_max=settings.AGENT_TURN_REPLAY_MAX,
+    orphan_grace=settings.AGENT_TURN_ORPHAN_GRACE,
+)
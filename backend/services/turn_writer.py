@@ -0,0 +1,177 @@
+"""
+Agent 對話結果的後寫（write-behind）隊列
+路由在流式輸出結束後立即用 preview_state 回覆狀態，把 TurnResult 交給本隊列，由後台任務寫庫：
+
+- 合併批量：一個事務內寫入多個對話的結果，chat_messages 以單條多行 INSERT 插入，
+  對話行一次查詢取出；ACTION 記錄和階段推進仍逐輪執行（需要拿到新記錄的 ID）
+- 批量事務失敗（如樂觀鎖衝突）時逐輪回退到 persist_turn，各自重試，互不影響
+- 讀己之寫：同一對話的讀取方先 await barrier(conversation_id)，等該對話已提交的結果全部落庫
+- 優雅關閉時 stop() 寫完隊列中剩餘的結果；進程被強制終止時隊列中未寫入的結果會丟失
+"""
+import asyncio
+import logging
+import time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import insert, select
+
+from config import get_settings
+from database.connection import async_session
+from database.models import ChatMessage, Conversation
+from services.agent_engine import TurnResult, apply_turn, persist_turn
+from services.history_digest import schedule_compaction
+
+logger = logging.getLogger("jingjin.agent")
+settings = get_settings()
+
+
+class _Job(NamedTuple):
+    result: TurnResult
+    done: asyncio.Future
+
+
+class TurnWriter:
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._pending: dict[int, set[asyncio.Future]] = {}
+        self._closed = False
+        self._stats = {"turns": 0, "batches": 0, "rows": 0, "fallbacks": 0, "failures": 0, "write_time": 0.0}
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, result: TurnResult) -> None:
+        """提交一輪結果；隊列已滿時等待（背壓），已關閉時直接同步寫入"""
+        if self._closed:
+            await self._write_one(result)
+            return
+        self._ensure_worker()
+        done = asyncio.get_running_loop().create_future()
+        cid = result.turn.conversation_id
+        self._pending.setdefault(cid, set()).add(done)
+        done.add_done_callback(lambda f: self._forget(cid, f))
+        await self._queue.put(_Job(result, done))
+
+    def _forget(self, conversation_id: int, done: asyncio.Future) -> None:
+        pending = self._pending.get(conversation_id)
+        if pending is not None:
+            pending.discard(done)
+            if not pending:
+                del self._pending[conversation_id]
+
+    async def barrier(self, conversation_id: int) -> None:
+        """等待該對話已提交的結果全部寫入（無待寫結果時立即返回）"""
+        pending = self._pending.get(conversation_id)
+        if pending:
+            # 用 wait 而非 gather：等待方被取消時不能連帶取消共享的 done future，
+            # 否則該輪尚未落庫，之後的 barrier 卻會直接返回
+            await asyncio.wait(set(pending))
+
+    # ---------- 後台寫入 ----------
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            job = await self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    nxt = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        nxt = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if nxt is None:
+                    stopping = True
+                    break
+                batch.append(nxt)
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: list[_Job]) -> None:
+        started = time.perf_counter()
+        written: list[_Job] = []
+        try:
+            async with async_session() as db:
+                ids = {job.result.turn.conversation_id for job in batch}
+                result = await db.execute(select(Conversation).where(Conversation.id.in_(ids)))
+                conversations = {conv.id: conv for conv in result.scalars().all()}
+                rows = []
+                for job in batch:
+                    conv = conversations.get(job.result.turn.conversation_id)
+                    if conv is None:
+                        logger.warning(f"對話 {job.result.turn.conversation_id} 在回覆期間已被刪除，本輪結果丟棄")
+                        continue
+                    rows.extend(await apply_turn(db, conv, job.result))
+                    written.append(job)
+                await db.flush()
+                if rows:
+                    await db.execute(insert(ChatMessage), rows)
+                await db.commit()
+            self._stats["batches"] += 1
+            self._stats["rows"] += len(rows)
+        except Exception as e:
+            logger.warning(f"批量寫入 {len(batch)} 輪對話失敗，逐輪重試: {e}")
+            self._stats["fallbacks"] += 1
+            written = [job for job in batch if await self._write_one(job.result)]
+        finally:
+            self._stats["write_time"] += time.perf_counter() - started
+            self._stats["turns"] += len(batch)
+            for job in batch:
+                if not job.done.done():
+                    job.done.set_result(None)
+
+        for job in written:
+            if job.result.turn.user_message is not None:
+                # 移出歷史窗口的消息在後台併入對話摘要
+                schedule_compaction(job.result.turn.conversation_id)
+
+    async def _write_one(self, result: TurnResult) -> bool:
+        try:
+            return await persist_turn(result) is not None
+        except Exception as e:
+            self._stats["failures"] += 1
+            logger.error(f"對話 {result.turn.conversation_id} 本輪結果寫入失敗: {e}")
+            return False
+
+    async def stop(self) -> None:
+        """關閉：寫完隊列中剩餘的結果後退出"""
+        self._closed = True
+        if self._worker is None:
+            return
+        pending = self._queue.qsize()
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+        if pending:
+            logger.info(f"關閉前已寫入隊列中的 {pending} 輪對話結果")
+
+    def get_stats(self) -> dict:
+        batches = self._stats["batches"]
+        return {
+            **{k: v for k, v in self._stats.items() if k != "write_time"},
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "pending_conversations": len(self._pending),
+            "avg_batch_turns": round(self._stats["turns"] / batches, 2) if batches else 0.0,
+            "avg_write_ms": round(self._stats["write_time"] * 1000 / batches, 2) if batches else 0.0,
+        }
+
+
+turn_writer = TurnWriter(
+    batch_size=settings.AGENT_WRITE_BATCH_SIZE,
+    flush_interval=settings.AGENT_WRITE_FLUSH_INTERVAL,
+    max_queue=settings.AGENT_WRITE_MAX_QUEUE,
+)
@@ -30,6 +30,10 @@ export const ALL_PHASES: PhaseInfo[] = [
   { key: 'review_hub', order: 7, name: '成長復盤', book_chapter: '獨特的成功', goal: '反思提升' },
 ];
 
+const MAX_RESUME_ATTEMPTS = 3;
+const RESUME_DELAY_MS = 500;
+const MESSAGE_PAGE_SIZE = 50;
+
 function cleanMarkers(text: string): string {
   return text.replace(ACTION_RE, '').replace(PHASE_RE, '').trim();
 }
@@ -41,11 +45,16 @@ export function useAgentChat() {
   const [convStatus, setConvStatus] = useState('active');
   const [isStreaming, setIsStreaming] = useState(false);
   const [streamingText, setStreamingText] = useState('');
+  const [hasOlder, setHasOlder] = useState(false);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+  const olderCursorRef = useRef<string | null>(null);
   const abortRef = useRef<AbortController | null>(null);
+  const stopUrlRef = useRef<string | null>(null);
 
   const processSSE = useCallback(async (
     url: string,
     options: RequestInit,
+    resumeUrl: string,
     onComplete?: () => void,
   ) => {
     setIsStreaming(true);
@@ -53,15 +62,18 @@ export function useAgentChat() {
 
     const controller = new AbortController();
     abortRef.current = controller;
+    stopUrlRef.current = resumeUrl.replace(/\/stream$/, '/stop');
 
-    try {
-      const res = await fetch(url, { ...options, signal: controller.signal });
+    let accumulated = '';
+    let lastEventId = '';
+    let finished = false;
+
+    const readStream = async (res: Response) => {
       if (!res.ok || !res.body) throw new Error(`SSE Error: ${res.status}`);
 
       const reader = res.body.getReader();
       const decoder = new TextDecoder();
       let buffer = '';
-      let accumulated = '';
 
       while (true) {
         const { done, value } = await reader.read();
@@ -72,9 +84,17 @@ export function useAgentChat() {
         buffer = lines.pop() || '';
 
         for (const line of lines) {
+          // Event ids let a dropped stream resume where it stopped
+          if (line.startsWith('id: ')) {
+            lastEventId = line.slice(4).trim();
+            continue;
+          }
           if (!line.startsWith('data: ')) continue;
           const data = line.slice(6).trim();
-          if (data === '[DONE]') continue;
+          if (data === '[DONE]') {
+            finished = true;
+            continue;
+          }
 
           try {
             const parsed = JSON.parse(data);
@@ -96,6 +116,28 @@ export function useAgentChat() {
           }
         }
       }
+    };
+
+    try {
+      try {
+        await readStream(await fetch(url, { ...options, signal: controller.signal }));
+      } catch (err: any) {
+        if (err.name === 'AbortError' || !lastEventId) throw err;
+      }
+
+      // Connection dropped mid-reply: the backend keeps generating, so resume from the last event
+      for (let attempt = 0; !finished && lastEventId && attempt < MAX_RESUME_ATTEMPTS; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, RESUME_DELAY_MS * (attempt + 1)));
+        try {
+          await readStream(await fetch(resumeUrl, {
+            headers: { 'Last-Event-ID': lastEventId },
+            signal: controller.signal,
+          }));
+        } catch (err: any) {
+          if (err.name === 'AbortError') throw err;
+        }
+      }
+      if (!finished && lastEventId) throw new Error('SSE stream lost');
 
       // Finalize: add assistant message to list
       if (accumulated) {
@@ -120,6 +162,7 @@ export function useAgentChat() {
       setIsStreaming(false);
       setStreamingText('');
       abortRef.current = null;
+      stopUrlRef.current = null;
       onComplete?.();
     }
   }, [currentPhase]);
@@ -128,6 +171,7 @@ export function useAgentChat() {
     await processSSE(
       `/api/agent/${studentId}/conversations/${convId}/start`,
       { method: 'POST' },
+      `/api/agent/${studentId}/conversations/${convId}/stream`,
     );
   }, [processSSE]);
 
@@ -145,29 +189,55 @@ export function useAgentChat() {
       {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message }),
+        // One key per message: a retried request replays the same turn instead of calling the AI again
+        body: JSON.stringify({ message, idempotency_key: crypto.randomUUID() }),
       },
+      `/api/agent/${studentId}/conversations/${convId}/stream`,
     );
   }, [processSSE, currentPhase]);
 
+  // 消息分頁：後端已去掉標記，按時間正序返回；next_before 用於加載更早的一頁
+  const fetchMessagePage = async (studentId: number, convId: number, before: string | null) => {
+    const params = new URLSearchParams({ limit: String(MESSAGE_PAGE_SIZE) });
+    if (before) params.set('before', before);
+    const res = await fetch(`/api/agent/${studentId}/conversations/${convId}/messages?${params}`);
+    if (!res.ok) return null;
+    const page = await res.json();
+    olderCursorRef.current = page.next_before;
+    setHasOlder(page.has_more);
+    return page.messages as ChatMsg[];
+  };
+
   const loadConversation = useCallback(async (studentId: number, convId: number) => {
-    const res = await fetch(`/api/agent/${studentId}/conversations/${convId}`);
+    const res = await fetch(`/api/agent/${studentId}/conversations/${convId}?messages=false`);
     if (!res.ok) return;
     const data = await res.json();
     setCurrentPhase(data.current_phase || 'time_compass');
     setPhaseContext(data.phase_context || {});
     setConvStatus(data.status || 'active');
-    // Clean markers from historical messages
-    const msgs: ChatMsg[] = (data.messages || [])
-      .filter((m: any) => m.role !== 'system')
-      .map((m: any) => ({
-        ...m,
-        content: cleanMarkers(m.content),
-      }));
-    setMessages(msgs);
+    const msgs = await fetchMessagePage(studentId, convId, null);
+    setMessages(msgs || []);
   }, []);
 
+  // 返回是否插入了更早的消息
+  const loadOlderMessages = useCallback(async (studentId: number, convId: number) => {
+    if (!olderCursorRef.current || isLoadingOlder) return false;
+    setIsLoadingOlder(true);
+    try {
+      const older = await fetchMessagePage(studentId, convId, olderCursorRef.current);
+      if (!older?.length) return false;
+      setMessages(prev => [...older, ...prev]);
+      return true;
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  }, [isLoadingOlder]);
+
   const stopStreaming = useCallback(() => {
+    // Disconnecting no longer cancels the turn on the backend, so stop it explicitly
+    if (stopUrlRef.current) {
+      fetch(stopUrlRef.current, { method: 'POST' }).catch(() => {});
+    }
     abortRef.current?.abort();
   }, []);
 
@@ -181,6 +251,9 @@ export function useAgentChat() {
     startConversation,
     sendMessage,
     loadConversation,
+    loadOlderMessages,
+    hasOlder,
+    isLoadingOlder,
     stopStreaming,
   };
 }
@@ -1,4 +1,4 @@
-import { useState, useEffect, useRef } from 'react';
+import { useState, useEffect, useLayoutEffect, useRef } from 'react';
 import { Send, Plus, History, Mic, MicOff, Loader2, SkipForward, Volume2, VolumeX, Download, Pencil, Check, Trash2 } from 'lucide-react';
 import PhaseProgress from '../components/PhaseProgress';
 import ChatBubble, { StreamingBubble } from '../components/ChatBubble';
@@ -12,19 +12,29 @@ interface ConvItem {
   current_phase: string;
   status: string;
   updated_at: string;
+  message_count: number;
+  last_message: string | null;
+  completed_phases: number;
+  total_phases: number;
 }
 
+const CONV_PAGE_SIZE = 20;
+
 export default function AgentChat() {
   const studentId = Number(localStorage.getItem('studentId') || '0');
   const [convId, setConvId] = useState<number | null>(null);
   const [convTitle, setConvTitle] = useState('');
   const [convList, setConvList] = useState<ConvItem[]>([]);
+  const [convCursor, setConvCursor] = useState<string | null>(null);
   const [input, setInput] = useState('');
   const [showSidebar, setShowSidebar] = useState(false);
   const [scenario, setScenario] = useState('academic');
   const [isEditingTitle, setIsEditingTitle] = useState(false);
   const [editTitle, setEditTitle] = useState('');
   const bottomRef = useRef<HTMLDivElement>(null);
+  const chatAreaRef = useRef<HTMLDivElement>(null);
+  // 加載更早消息前的滾動高度，用於插入後保持可見位置不跳動
+  const prependFromHeightRef = useRef<number | null>(null);
   const titleInputRef = useRef<HTMLInputElement>(null);
   const textareaRef = useRef<HTMLTextAreaElement>(null);
 
@@ -38,6 +48,9 @@ export default function AgentChat() {
     startConversation,
     sendMessage,
     loadConversation,
+    loadOlderMessages,
+    hasOlder,
+    isLoadingOlder,
     stopStreaming,
   } = useAgentChat();
 
@@ -54,20 +67,58 @@ export default function AgentChat() {
     onEnd: (t) => setInput(prev => prev + t),
   });
 
-  // Load conversation list
+  // Load conversation list（按更新時間倒序分頁，下一頁游標在 X-Next-Cursor 響應頭中）
+  const fetchConvPage = async (cursor: string | null) => {
+    const params = new URLSearchParams({ limit: String(CONV_PAGE_SIZE) });
+    if (cursor) params.set('cursor', cursor);
+    const res = await fetch(`/api/agent/${studentId}/conversations?${params}`);
+    const items: ConvItem[] = await res.json();
+    return { items, next: res.headers.get('X-Next-Cursor') };
+  };
+
   useEffect(() => {
     if (!studentId) return;
-    fetch(`/api/agent/${studentId}/conversations`)
-      .then(r => r.json())
-      .then(setConvList)
+    fetchConvPage(null)
+      .then(({ items, next }) => {
+        setConvList(items);
+        setConvCursor(next);
+      })
       .catch(() => {});
   }, [studentId, convId]);
 
-  // Auto-scroll to bottom
-  useEffect(() => {
+  const handleLoadMore = async () => {
+    if (!convCursor) return;
+    try {
+      const { items, next } = await fetchConvPage(convCursor);
+      setConvList(prev => [...prev, ...items.filter(c => !prev.some(p => p.id === c.id))]);
+      setConvCursor(next);
+    } catch (err) {
+      console.error('加載對話列表失敗:', err);
+    }
+  };
+
+  // Auto-scroll to bottom（在頂部插入更早的消息時改為保持原位置）
+  useLayoutEffect(() => {
+    const area = chatAreaRef.current;
+    if (prependFromHeightRef.current !== null && area) {
+      area.scrollTop = area.scrollHeight - prependFromHeightRef.current;
+      prependFromHeightRef.current = null;
+      return;
+    }
     bottomRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages, streamingText]);
 
+  const handleChatScroll = () => {
+    const area = chatAreaRef.current;
+    if (!area || !convId || !hasOlder || isLoadingOlder) return;
+    if (area.scrollTop < 80) {
+      prependFromHeightRef.current = area.scrollHeight;
+      loadOlderMessages(studentId, convId)
+        .then((prepended) => { if (!prepended) prependFromHeightRef.current = null; })
+        .catch(() => { prependFromHeightRef.current = null; });
+    }
+  };
+
   const handleNewConversation = async () => {
     if (!studentId) return;
     const res = await fetch(`/api/agent/${studentId}/conversations`, {
@@ -266,7 +317,7 @@ export default function AgentChat() {
       )}
 
       {/* Chat Area */}
-      <div className="flex-1 overflow-y-auto px-4 py-4">
+      <div ref={chatAreaRef} onScroll={handleChatScroll} className="flex-1 overflow-y-auto px-4 py-4">
         {!convId ? (
           /* Landing: no conversation selected */
           <div className="flex flex-col items-center justify-center h-full text-center">
@@ -344,6 +395,11 @@ export default function AgentChat() {
         ) : (
           /* Messages */
           <div className="space-y-4">
+            {isLoadingOlder && (
+              <div className="flex justify-center text-slate-400">
+                <Loader2 size={16} className="animate-spin" />
+              </div>
+            )}
             {messages.map((msg) => (
               <ChatBubble key={msg.id} message={msg} />
             ))}
@@ -383,8 +439,12 @@ export default function AgentChat() {
                     <div className="font-medium">{c.title}</div>
                     <div className="text-xs text-slate-400 mt-0.5">
                       {ALL_PHASES.find(p => p.key === c.current_phase)?.name}
-                      {c.status === 'completed' && ' · 已完成'}
+                      {c.status === 'completed' ? ' · 已完成' : ` · ${c.completed_phases}/${c.total_phases}`}
+                      {` · ${c.message_count} 條消息`}
                     </div>
+                    {c.last_message && (
+                      <div className="text-xs text-slate-400 mt-0.5 truncate">{c.last_message}</div>
+                    )}
                   </button>
                   <button
                     onClick={(e) => handleDelete(c.id, e)}
@@ -395,6 +455,14 @@ export default function AgentChat() {
                   </button>
                 </div>
               ))}
+              {convCursor && (
+                <button
+                  onClick={handleLoadMore}
+                  className="w-full px-3 py-2 text-xs text-slate-500 hover:text-indigo-600 hover:bg-slate-50 rounded-lg"
+                >
+                  加載更多
+                </button>
+              )}
             </div>
           </div>
           <div className="flex-1 bg-black/20" onClick={() => setShowSidebar(false)} />
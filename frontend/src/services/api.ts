@@ -72,12 +72,14 @@ export const actionWorkshopApi = {
 
 // ===================== 精進旅程 Agent =====================
 export const agentApi = {
-  listConversations: (studentId: number) =>
-    request<any[]>(`/agent/${studentId}/conversations`),
+  listConversations: (studentId: number, cursor?: string, limit = 20) =>
+    request<any[]>(`/agent/${studentId}/conversations?limit=${limit}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`),
   createConversation: (studentId: number, data: { title?: string; scenario?: string }) =>
     request<any>(`/agent/${studentId}/conversations`, { method: 'POST', body: JSON.stringify(data) }),
   getConversation: (studentId: number, convId: number) =>
     request<any>(`/agent/${studentId}/conversations/${convId}`),
+  listMessages: (studentId: number, convId: number, before?: string, limit = 50) =>
+    request<any>(`/agent/${studentId}/conversations/${convId}/messages?limit=${limit}${before ? `&before=${encodeURIComponent(before)}` : ''}`),
   updateConversation: (studentId: number, convId: number, data: { title: string }) =>
     request<any>(`/agent/${studentId}/conversations/${convId}`, { method: 'PATCH', body: JSON.stringify(data) }),
   skipPhase: (studentId: number, convId: number) =>
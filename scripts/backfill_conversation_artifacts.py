@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+從已有消息的 action_metadata 補建 conversation_artifacts
+後端啟動時會在後台執行，直到完成並記入 data_migrations；中途被打斷或需要重新核對時可手動執行。
+可重複執行：已存在的關聯記錄會跳過。使用 backend/.env 中的數據庫配置。
+
+用法：
+  python scripts/backfill_conversation_artifacts.py
+  python scripts/backfill_conversation_artifacts.py --conversation 42 --batch-size 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+# 將 backend 加入 path，以便引用項目模組
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+from database.connection import engine, init_db
+from services.conversation_artifacts import backfill_artifacts, mark_backfill_completed
+
+
+async def main_async(args) -> None:
+    await init_db()
+    added = await backfill_artifacts(batch_size=args.batch_size, conversation_id=args.conversation)
+    print(f"新增 {added} 條旅程關聯記錄")
+    if args.conversation is None:
+        await mark_backfill_completed()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="從 action_metadata 補建 conversation_artifacts")
+    parser.add_argument("--batch-size", type=int, default=500, help="每頁處理的消息數")
+    parser.add_argument("--conversation", type=int, default=None, help="只處理指定對話")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Agent 每輪歷史加載成本檢查
+分別在 10 / 100 / 1000 條消息的對話上組裝一輪上下文，對比：
+  1. 舊實現：selectinload(Conversation.messages) 加載整段對話，再取 [-30:]
+  2. 新實現：只查對話元數據，build_messages 按 (conversation_id, created_at, id) 索引取最近 HISTORY_WINDOW 條
+
+輸出每輪加載的消息行數、SQL 語句數和平均耗時；新實現的加載行數隨對話長度變化時以非零狀態碼退出。
+默認使用內存 SQLite（需安裝 aiosqlite），也可用 --db-url 指向一個空的 MySQL 測試庫。
+
+用法：
+  python scripts/benchmarks/bench_history_window.py
+  python scripts/benchmarks/bench_history_window.py --sizes 10 100 1000 5000 --repeat 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# 將 backend 加入 path，以便引用項目模組
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "backend"))
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload
+
+from database.connection import Base
+from database.models import ChatMessage, Conversation, Student
+from services.agent_engine import HISTORY_WINDOW, build_messages
+
+REPLY = "我們先看看你每天的時間都花在哪裡。<!--ACTION:{\"type\":\"save_time_entry\",\"data\":{}}-->"
+
+
+async def seed(session_factory, size: int) -> int:
+    async with session_factory() as db:
+        student = Student(name=f"歷史窗口{size}", grade="初二")
+        db.add(student)
+        await db.flush()
+        conv = Conversation(student_id=student.id, scenario="academic", phase_context={})
+        db.add(conv)
+        await db.flush()
+        start = datetime.utcnow() - timedelta(seconds=size)
+        db.add_all(
+            ChatMessage(
+                conversation_id=conv.id,
+                role="user" if i % 2 == 0 else "assistant",
+                content=f"第 {i} 條消息。" if i % 2 == 0 else REPLY,
+                phase_at_time="time_compass",
+                created_at=start + timedelta(seconds=i),
+            )
+            for i in range(size)
+        )
+        await db.commit()
+        return conv.id
+
+
+async def old_turn(db: AsyncSession, conv_id: int) -> None:
+    result = await db.execute(
+        select(Conversation).options(selectinload(Conversation.messages)).where(Conversation.id == conv_id)
+    )
+    conv = result.scalar_one()
+    [m.content for m in conv.messages[-HISTORY_WINDOW:]]
+
+
+async def new_turn(db: AsyncSession, conv_id: int) -> None:
+    result = await db.execute(select(Conversation).where(Conversation.id == conv_id))
+    conv = result.scalar_one()
+    await build_messages(db, conv, "我想試試。")
+
+
+async def measure(session_factory, counter: dict, fn, conv_id: int, repeat: int) -> tuple[int, int, float]:
+    """返回 (每輪加載的消息行數, 每輪 SQL 語句數, 平均耗時 ms)"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        async with session_factory() as db:
+            counter["sql"] = counter["rows"] = 0
+            await fn(db, conv_id)
+    return counter["rows"], counter["sql"], (time.perf_counter() - started) * 1000 / repeat
+
+
+async def main_async(args) -> int:
+    engine = create_async_engine(args.db_url)
+    counter = {"sql": 0, "rows": 0}
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _count_sql(*_):
+        counter["sql"] += 1
+
+    @event.listens_for(ChatMessage, "load")
+    def _count_rows(*_):
+        counter["rows"] += 1
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    print(f"{'消息數':>7} | {'舊:行數':>7} {'SQL':>4} {'ms':>8} | {'新:行數':>7} {'SQL':>4} {'ms':>8}")
+    new_rows = set()
+    for size in args.sizes:
+        conv_id = await seed(session_factory, size)
+        o_rows, o_sql, o_ms = await measure(session_factory, counter, old_turn, conv_id, args.repeat)
+        n_rows, n_sql, n_ms = await measure(session_factory, counter, new_turn, conv_id, args.repeat)
+        if size >= HISTORY_WINDOW:
+            new_rows.add(n_rows)
+        print(f"{size:>7} | {o_rows:>7} {o_sql:>4} {o_ms:>8.2f} | {n_rows:>7} {n_sql:>4} {n_ms:>8.2f}")
+    await engine.dispose()
+
+    if len(new_rows) > 1:
+        print("✗ 新實現每輪加載的行數隨對話長度變化")
+        return 1
+    print(f"✓ 新實現每輪加載的行數恆定（對話長度 ≥ {HISTORY_WINDOW} 時）")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent 每輪歷史加載成本檢查")
+    parser.add_argument("--db-url", default="sqlite+aiosqlite:///:memory:", help="空測試庫的 SQLAlchemy async URL")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10, 100, 1000], help="對話消息數")
+    parser.add_argument("--repeat", type=int, default=20)
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
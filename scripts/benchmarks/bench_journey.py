@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+七步精進旅程端到端壓測
+每個虛擬學生：建立檔案 → 建立對話 → /start → 反覆 /chat 直至旅程完成（或達到輪數上限），
+記錄每輪的首字節時間（TTFB）和總耗時，最後匯總並打印後端 /api/health 中的 LLM 指標。
+
+配合 scripts/fake_deepseek/server.py 可在無網絡的筆記本上運行：
+  python scripts/fake_deepseek/server.py --port 8900 &
+  DEEPSEEK_BASE_URL=http://127.0.0.1:8900 uvicorn main:app --port 8000   # 在 backend/ 下
+  python scripts/benchmarks/bench_journey.py --users 20 --fake-url http://127.0.0.1:8900
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+import uuid
+
+import httpx
+
+USER_MESSAGES = [
+    "我每天放學後大概先寫一個小時作業，然後刷短影片，晚上再看一會兒書。",
+    "我覺得閱讀對我的幫助最大，短影片其實沒什麼用。",
+    "我想在數學上更精進，五年後希望能用數學分析真實的問題。",
+    "我可能一直覺得自己不擅長數學。",
+    "我可以每天花十五分鐘畫函數圖像。",
+    "單調性就是函數圖像往上或者往下走，和斜率的正負有關。",
+    "我覺得只刷題不一定有用，還要理解背後的原理。",
+    "我願意試試這個挑戰。",
+    "最大的收穫是學會了審視自己的時間。",
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+
+
+async def read_turn(client: httpx.AsyncClient, url: str, body: dict | None) -> dict:
+    """發起一輪 SSE 請求，返回 TTFB / 總耗時 / 最終狀態"""
+    started = time.perf_counter()
+    ttfb = None
+    state = None
+    error = None
+    async with client.stream("POST", url, json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"ttfb": None, "total": time.perf_counter() - started, "state": None,
+                    "error": f"HTTP {response.status_code}"}
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            payload = line[6:]
+            if payload == "[DONE]":
+                break
+            data = json.loads(payload)
+            if "content" in data and ttfb is None:
+                ttfb = time.perf_counter() - started
+            elif data.get("type") == "state_update":
+                state = data
+            elif "error" in data:
+                error = data["error"]
+    return {"ttfb": ttfb, "total": time.perf_counter() - started, "state": state, "error": error}
+
+
+async def run_journey(client: httpx.AsyncClient, index: int, run_id: str, max_turns: int, results: dict) -> None:
+    r = await client.post("/api/profile/students", json={"name": f"壓測學生{index}-{run_id}", "grade": "初二"})
+    r.raise_for_status()
+    student_id = r.json()["id"]
+    r = await client.post(f"/api/agent/{student_id}/conversations", json={"scenario": "academic"})
+    r.raise_for_status()
+    conv_url = f"/api/agent/{student_id}/conversations/{r.json()['id']}"
+
+    turns = [await read_turn(client, f"{conv_url}/start", None)]
+    for turn in range(max_turns):
+        message = USER_MESSAGES[turn % len(USER_MESSAGES)]
+        result = await read_turn(client, f"{conv_url}/chat", {"message": message})
+        turns.append(result)
+        if result["state"] and result["state"].get("status") == "completed":
+            results["completed"] += 1
+            break
+
+    for t in turns:
+        results["turns"] += 1
+        if t["error"]:
+            results["errors"].append(t["error"])
+        if t["ttfb"] is not None:
+            results["ttfb"].append(t["ttfb"])
+        results["total"].append(t["total"])
+
+
+async def main_async(args) -> None:
+    results = {"turns": 0, "completed": 0, "ttfb": [], "total": [], "errors": []}
+    run_id = uuid.uuid4().hex[:6]
+    limits = httpx.Limits(max_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_journey(client, i, run_id, args.max_turns, results) for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        health = (await client.get("/api/health")).json()
+
+    print(f"虛擬學生: {args.users}  完成旅程: {results['completed']}  總輪數: {results['turns']}  耗時: {elapsed:.1f}s")
+    print(f"吞吐: {results['turns'] / elapsed:.2f} 輪/秒  錯誤: {len(results['errors'])}")
+    for name in ("ttfb", "total"):
+        values = results[name]
+        print(
+            f"{name:<6} p50={percentile(values, 50):.3f}s  p95={percentile(values, 95):.3f}s  "
+            f"max={max(values, default=0):.3f}s"
+        )
+    if results["errors"]:
+        print("錯誤樣例:", results["errors"][:3])
+
+    llm = health.get("llm", {})
+    print("\n後端 LLM 指標:")
+    for key in ("pool", "governor", "resilience", "usage"):
+        if key in llm:
+            print(f"  {key}: {json.dumps(llm[key], ensure_ascii=False)}")
+
+    if args.fake_url:
+        async with httpx.AsyncClient(base_url=args.fake_url) as fake:
+            print(f"\nFake DeepSeek: {json.dumps((await fake.get('/fake/stats')).json(), ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="七步精進旅程端到端壓測")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="後端地址")
+    parser.add_argument("--fake-url", default=None, help="Fake DeepSeek 地址（打印其統計）")
+    parser.add_argument("--users", type=int, default=10, help="並發虛擬學生數")
+    parser.add_argument("--max-turns", type=int, default=30, help="每個旅程最多對話輪數")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
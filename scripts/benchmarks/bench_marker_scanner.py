@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Agent 標記掃描基準測試
+對比兩種處理 Agent 流式回覆的方式：
+  1. 舊實現：full_response += chunk、buffer += chunk、每個 chunk 做 buffer.find("<!--")，
+     結束時對整段回覆做正則替換和解析（標記之後的文本全部緩衝到流結束）
+  2. MarkerScanner：逐 chunk 線性掃描，標記閉合時立即產出事件
+
+回覆按 1-3 字切分，長度從 1K 到 64K 字；標記位於中段（舊實現會從此處開始整段緩衝）。
+
+用法：
+  python scripts/benchmarks/bench_marker_scanner.py
+  python scripts/benchmarks/bench_marker_scanner.py --sizes 1000 8000 --repeat 20
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+# 將 backend 加入 path，以便引用項目模組
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "backend"))
+
+from services.marker_scanner import MarkerScanner
+
+ACTION_PATTERN = re.compile(r"<!--ACTION:(.*?)-->", re.DOTALL)
+PHASE_COMPLETE_PATTERN = re.compile(r"<!--PHASE_COMPLETE:(.*?)-->", re.DOTALL)
+
+PARAGRAPH = "采銅說，盲目的努力只是緩慢的疊加，精準的方法才能帶來質的飛躍。我們先從一個好問題開始。"
+ACTION = '<!--ACTION:{"type":"save_learning_record","data":{"content":"用斜率解釋函數單調性","module":"learning_dojo"}}-->'
+PHASE = '<!--PHASE_COMPLETE:{"summary":"學生能以自己的方式解釋單調性"}-->'
+
+
+def make_reply(size: int) -> str:
+    body = (PARAGRAPH * (size // len(PARAGRAPH) + 1))[:size]
+    half = size // 2
+    return body[:half] + ACTION + body[half:] + PHASE
+
+
+def split(text: str, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    chunks, i = [], 0
+    while i < len(text):
+        n = rng.choice((1, 2, 2, 3))
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+
+def old_scan(chunks: list[str]) -> str:
+    MARKER_PREFIX = "<!--"
+    BUFFER_SIZE = 6
+    full_response = ""
+    buffer = ""
+    out = []
+    for chunk in chunks:
+        full_response += chunk
+        buffer += chunk
+        marker_pos = buffer.find(MARKER_PREFIX)
+        if marker_pos >= 0:
+            if marker_pos > 0:
+                out.append(buffer[:marker_pos])
+            buffer = buffer[marker_pos:]
+        elif len(buffer) > BUFFER_SIZE:
+            out.append(buffer[:-BUFFER_SIZE])
+            buffer = buffer[-BUFFER_SIZE:]
+    remaining = ACTION_PATTERN.sub("", buffer)
+    remaining = PHASE_COMPLETE_PATTERN.sub("", remaining).strip()
+    if remaining:
+        out.append(remaining)
+    # 結束時再對整段回覆做一次解析
+    ACTION_PATTERN.search(full_response)
+    PHASE_COMPLETE_PATTERN.search(full_response)
+    PHASE_COMPLETE_PATTERN.sub("", ACTION_PATTERN.sub("", full_response)).strip()
+    return "".join(out)
+
+
+def new_scan(chunks: list[str]) -> str:
+    scanner = MarkerScanner()
+    out = []
+    for chunk in chunks:
+        for event in scanner.feed(chunk):
+            if event.kind == "text":
+                out.append(event.text)
+    for event in scanner.finish():
+        if event.kind == "text":
+            out.append(event.text)
+    scanner.raw_text
+    return "".join(out)
+
+
+def bench(fn, chunks: list[str], repeat: int) -> float:
+    """返回單條回覆的平均耗時（毫秒）"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(chunks)
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent 標記掃描基準測試")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 4000, 16000, 64000], help="回覆字數")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'字數':>7} {'chunks':>7} {'舊(ms)':>9} {'新(ms)':>9} {'加速':>7}  一致")
+    for size in args.sizes:
+        chunks = split(make_reply(size))
+        same = old_scan(chunks) == new_scan(chunks)
+        old_ms = bench(old_scan, chunks, args.repeat)
+        new_ms = bench(new_scan, chunks, args.repeat)
+        print(f"{size:>7} {len(chunks):>7} {old_ms:>9.2f} {new_ms:>9.2f} {old_ms / new_ms:>6.1f}x  {'✓' if same else '✗'}")
+
+
+if __name__ == "__main__":
+    main()
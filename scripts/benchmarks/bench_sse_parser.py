@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+SSE 解析基準測試
+用錄製的 DeepSeek 流構造 httpx 響應，對比：
+  1. 舊實現：aiter_lines() + json.loads + 嵌套字典查找
+  2. iter_sse_json：原始字節增量解析（有 orjson 時使用 orjson）
+
+響應體按「每個事件一個網絡包」切分，與線上逐 token 到達的情況一致；
+--chunk N 可改為按固定字節數切分，用於驗證跨包切分的正確性。
+
+用法：
+  python scripts/benchmarks/bench_sse_parser.py
+  python scripts/benchmarks/bench_sse_parser.py --repeat 200 --chunk 7
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+
+# 將 backend 加入 path，以便引用項目模組
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "backend"))
+
+import httpx
+
+from services.sse_parser import JSON_BACKEND, chunk_content, iter_sse_json
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def split_body(body: bytes, chunk: int) -> list[bytes]:
+    if chunk:
+        return [body[i:i + chunk] for i in range(0, len(body), chunk)]
+    parts = body.split(b"\n\n")
+    return [p + b"\n\n" for p in parts[:-1]] + ([parts[-1]] if parts[-1] else [])
+
+
+def make_response(parts: list[bytes]) -> httpx.Response:
+    async def stream():
+        for part in parts:
+            yield part
+
+    return httpx.Response(200, content=stream())
+
+
+async def old_parse(parts: list[bytes]) -> str:
+    out = []
+    async for line in make_response(parts).aiter_lines():
+        if line.startswith("data: "):
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            try:
+                data = json.loads(data_str)
+                delta = data["choices"][0].get("delta", {})
+                content = delta.get("content", "")
+                if content:
+                    out.append(content)
+            except (json.JSONDecodeError, KeyError, IndexError):
+                continue
+    return "".join(out)
+
+
+async def new_parse(parts: list[bytes]) -> str:
+    out = []
+    async for data in iter_sse_json(make_response(parts).aiter_bytes()):
+        content = chunk_content(data)
+        if content:
+            out.append(content)
+    return "".join(out)
+
+
+async def bench(fn, parts: list[bytes], repeat: int) -> float:
+    """返回單個流的平均耗時（毫秒）"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await fn(parts)
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+async def run(paths: list[str], repeat: int, chunk: int) -> None:
+    print(f"JSON 後端: {JSON_BACKEND}；切分方式: {f'{chunk} 字節' if chunk else '每事件一包'}")
+    print(f"{'fixture':<32} {'bytes':>7} {'舊(ms)':>8} {'新(ms)':>8} {'加速':>6}  一致")
+    total_old = total_new = 0.0
+    for path in paths:
+        with open(path, "rb") as f:
+            body = f.read()
+        parts = split_body(body, chunk)
+        same = await old_parse(parts) == await new_parse(parts)
+
+        old_ms = await bench(old_parse, parts, repeat)
+        new_ms = await bench(new_parse, parts, repeat)
+        total_old += old_ms
+        total_new += new_ms
+        print(
+            f"{os.path.basename(path):<32} {len(body):>7} {old_ms:>8.3f} {new_ms:>8.3f} "
+            f"{old_ms / new_ms:>5.1f}x  {'✓' if same else '✗'}"
+        )
+    print(f"{'合計':<32} {'':>7} {total_old:>8.3f} {total_new:>8.3f} {total_old / total_new:>5.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 解析基準測試")
+    parser.add_argument("fixtures", nargs="*", help="SSE 錄製文件（默認 fixtures/*.sse）")
+    parser.add_argument("--repeat", type=int, default=50, help="每個流重複次數")
+    parser.add_argument("--chunk", type=int, default=0, help="按固定字節數切分響應體（0 = 每事件一包）")
+    args = parser.parse_args()
+
+    paths = args.fixtures or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.sse")))
+    if not paths:
+        print("未找到 SSE 錄製文件")
+        sys.exit(1)
+    asyncio.run(run(paths, args.repeat, args.chunk))
+
+
+if __name__ == "__main__":
+    main()
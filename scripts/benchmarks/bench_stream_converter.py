@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+流式簡繁轉換基準測試
+對比兩種處理 LLM 逐 token 輸出的方式：
+  1. 舊實現：每個 delta 單獨調用 OpenCC（to_traditional 不帶快速路徑）
+  2. StreamingConverter：按分句符 / 前瞻窗口轉換，跳過不含可轉換字符的片段
+
+同時檢查兩者輸出是否與「整段回覆一次轉換」一致（舊實現在詞組跨 delta 時會出錯）；
+新實現還會把整段回覆按 1-3 字隨機切分後再比對，任何不一致都以非零狀態退出。
+
+fixtures/ 下的 .sse 文件為 DeepSeek 流式響應格式的樣例，可直接替換為真實錄製的流。
+
+用法：
+  python scripts/benchmarks/bench_stream_converter.py
+  python scripts/benchmarks/bench_stream_converter.py --repeat 200 fixtures/xxx.sse
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+# 將 backend 加入 path，以便引用項目模組
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "backend"))
+
+from services.chinese_converter import _s2t, StreamingConverter
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_deltas(path: str) -> list[str]:
+    """從錄製的 SSE 流中提取 content delta"""
+    deltas = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            data = json.loads(line[6:])
+            if not data.get("choices"):
+                continue
+            content = data["choices"][0].get("delta", {}).get("content")
+            if content:
+                deltas.append(content)
+    return deltas
+
+
+def per_delta(deltas: list[str]) -> str:
+    return "".join(_s2t.convert(d) for d in deltas)
+
+
+def streaming(deltas: list[str]) -> str:
+    conv = StreamingConverter()
+    out = [conv.feed(d) for d in deltas]
+    out.append(conv.flush())
+    return "".join(out)
+
+
+def random_splits(text: str, rng: random.Random) -> list[str]:
+    """把文本切成 1-3 字的隨機 delta，模擬最壞情況下的詞組跨 delta"""
+    deltas, i = [], 0
+    while i < len(text):
+        n = rng.randint(1, 3)
+        deltas.append(text[i:i + n])
+        i += n
+    return deltas
+
+
+def bench(fn, deltas: list[str], repeat: int) -> float:
+    """返回單個流的平均耗時（毫秒）"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(deltas)
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式簡繁轉換基準測試")
+    parser.add_argument("fixtures", nargs="*", help="SSE 錄製文件（默認 fixtures/*.sse）")
+    parser.add_argument("--repeat", type=int, default=50, help="每個流重複次數")
+    args = parser.parse_args()
+
+    paths = args.fixtures or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.sse")))
+    if not paths:
+        print("未找到 SSE 錄製文件")
+        sys.exit(1)
+
+    print(f"{'fixture':<32} {'deltas':>6} {'chars':>6} {'舊(ms)':>8} {'新(ms)':>8} {'加速':>6}  正確性(舊/新)")
+    total_old = total_new = 0.0
+    mismatches = []
+    rng = random.Random(0)
+    for path in paths:
+        deltas = load_deltas(path)
+        expected = _s2t.convert("".join(deltas))
+        old_ok = per_delta(deltas) == expected
+        new_ok = streaming(deltas) == expected
+        new_ok = new_ok and all(
+            streaming(random_splits("".join(deltas), rng)) == expected for _ in range(20)
+        )
+        if not new_ok:
+            mismatches.append(os.path.basename(path))
+
+        old_ms = bench(per_delta, deltas, args.repeat)
+        new_ms = bench(streaming, deltas, args.repeat)
+        total_old += old_ms
+        total_new += new_ms
+        name = os.path.basename(path)
+        chars = sum(len(d) for d in deltas)
+        print(
+            f"{name:<32} {len(deltas):>6} {chars:>6} {old_ms:>8.3f} {new_ms:>8.3f} "
+            f"{old_ms / new_ms:>5.1f}x  {'✓' if old_ok else '✗'}/{'✓' if new_ok else '✗'}"
+        )
+
+    print(f"{'合計':<32} {'':>6} {'':>6} {total_old:>8.3f} {total_new:>8.3f} {total_old / total_new:>5.1f}x")
+
+    if mismatches:
+        print(f"StreamingConverter 輸出與整段轉換不一致：{', '.join(mismatches)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+後寫隊列讀己之寫檢查
+模擬 /stop 或客戶端斷開時取消一個正在 barrier() 上等待的請求，
+確認另一個 barrier() 仍會等到該輪結果寫入後才返回。不連接數據庫。
+
+用法：
+  python scripts/check-turn-writer-barrier.py
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+# 將 backend 加入 path，以便引用項目模組
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from services.turn_writer import TurnWriter
+
+CONVERSATION_ID = 1
+
+
+async def check() -> list[str]:
+    release = asyncio.Event()
+    written = []
+    writer = TurnWriter(batch_size=8, flush_interval=0.01, max_queue=16)
+
+    async def write_batch(batch):
+        # 代替真實寫庫：等待放行後才標記完成
+        await release.wait()
+        written.extend(batch)
+        for job in batch:
+            if not job.done.done():
+                job.done.set_result(None)
+
+    writer._write_batch = write_batch
+    result = SimpleNamespace(turn=SimpleNamespace(conversation_id=CONVERSATION_ID, user_message=None))
+    await writer.submit(result)
+
+    errors = []
+    first = asyncio.create_task(writer.barrier(CONVERSATION_ID))
+    await asyncio.sleep(0.05)
+    first.cancel()
+    await asyncio.gather(first, return_exceptions=True)
+
+    second = asyncio.create_task(writer.barrier(CONVERSATION_ID))
+    await asyncio.sleep(0.05)
+    if second.done():
+        errors.append("取消一個等待方後，另一個 barrier 在寫入前就返回了")
+
+    release.set()
+    await asyncio.wait_for(second, 1)
+    if not written:
+        errors.append("barrier 返回時該輪結果尚未寫入")
+    await writer.stop()
+    return errors
+
+
+def main():
+    errors = asyncio.run(check())
+    for error in errors:
+        print(f"✗ {error}")
+    if errors:
+        sys.exit(1)
+    print("✓ 取消等待方不影響其他 barrier 的讀己之寫保證")
+
+
+if __name__ == "__main__":
+    main()
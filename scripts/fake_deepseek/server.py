@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+離線 DeepSeek 替身（OpenAI 兼容 /v1/chat/completions）
+用於在無網絡、不消耗 token 的情況下壓測 agent_engine 和各模組路由。
+
+功能：
+  - 流式（SSE，與 DeepSeek 相同的 chunk 格式 + keep-alive 註釋 + 末尾 usage）和非流式響應
+  - 可配置首 token 延遲、輸出速率、錯誤注入（HTTP 錯誤 / 中途斷流 / 卡頓）
+  - 按 script.json 腳本回覆：Agent 對話按「當前階段」逐條返回預設回覆，
+    在腳本指定的位置帶上 <!--ACTION:...--> / <!--PHASE_COMPLETE:...--> 標記，可完整走完七步旅程
+  - 模擬前綴緩存：按 64 token 塊記錄見過的前綴，usage 中返回 prompt_cache_hit/miss_tokens
+
+用法：
+  python scripts/fake_deepseek/server.py --port 8900 --ttft 0.4 --tps 40
+  # backend/.env 中設置 DEEPSEEK_BASE_URL=http://127.0.0.1:8900，DEEPSEEK_API_KEY 填任意非空值
+
+運行時調整參數：
+  curl -X PATCH localhost:8900/fake/config -H 'Content-Type: application/json' -d '{"error_rate": 0.2}'
+  curl localhost:8900/fake/stats
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(__file__), "script.json")
+
+PHASE_RE = re.compile(r"當前階段：(\S+?)（第")
+STUDENT_RE = re.compile(r"【學生檔案】[^\n]*")
+CACHE_BLOCK_TOKENS = 64
+
+
+class FakeConfig:
+    """可在運行時通過 PATCH /fake/config 修改的參數"""
+
+    FIELDS = {
+        "ttft": float,            # 首 token 延遲（秒）
+        "ttft_jitter": float,     # 首 token 延遲隨機抖動（±秒）
+        "tps": float,             # 每秒輸出 token（delta）數，0 = 不限速
+        "error_rate": float,      # 直接返回 HTTP 錯誤的概率
+        "error_status": int,      # 注入錯誤的狀態碼（429 / 500 / 503 ...）
+        "drop_rate": float,       # 流式輸出中途斷開連接的概率
+        "stall_rate": float,      # 流式輸出中途卡住的概率
+        "stall_seconds": float,   # 卡住的秒數
+        "keepalive": float,       # 等待首 token 期間發送 ": keep-alive" 的間隔（秒）
+    }
+
+    def __init__(self, **values):
+        for name, cast in self.FIELDS.items():
+            setattr(self, name, cast(values[name]))
+
+    def update(self, values: dict) -> None:
+        for name, value in values.items():
+            if name in self.FIELDS:
+                setattr(self, name, self.FIELDS[name](value))
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算：中文約 0.6 token/字，其他字符約 0.3 token/字"""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+class PrefixCache:
+    """模擬 DeepSeek 硬盤緩存：以 64 token 為單位記錄前綴，命中最長已見前綴"""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._seen: OrderedDict[str, None] = OrderedDict()
+
+    def lookup_and_store(self, prompt: str) -> tuple[int, int]:
+        """返回 (hit_tokens, miss_tokens)"""
+        total = estimate_tokens(prompt)
+        if not prompt:
+            return 0, 0
+        chars_per_block = max(1, round(len(prompt) * CACHE_BLOCK_TOKENS / max(total, 1)))
+        h = hashlib.sha256()
+        hit_blocks = 0
+        missed = False
+        for block, i in enumerate(range(chars_per_block, len(prompt) + 1, chars_per_block), start=1):
+            h.update(prompt[i - chars_per_block:i].encode("utf-8"))
+            digest = h.copy().hexdigest()
+            if not missed and digest in self._seen:
+                self._seen.move_to_end(digest)
+                hit_blocks = block
+            else:
+                missed = True
+                self._seen[digest] = None
+                if len(self._seen) > self.max_entries:
+                    self._seen.popitem(last=False)
+        hit = min(total, hit_blocks * CACHE_BLOCK_TOKENS)
+        return hit, total - hit
+
+
+class Scripter:
+    """根據請求內容挑選回覆"""
+
+    def __init__(self, script: dict):
+        self.phases: dict[str, list[str]] = script.get("phases", {})
+        self.rules = [(re.compile(r["match"]), r["reply"]) for r in script.get("rules", [])]
+        self.default: list[str] = script.get("default") or ["好的。"]
+        self._turns: dict[str, int] = {}
+
+    def reply(self, messages: list[dict]) -> str:
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        last_user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+
+        for pattern, reply in self.rules:
+            if pattern.search(last_user):
+                return reply
+
+        phase = PHASE_RE.search(system)
+        if phase and phase.group(1) in self.phases:
+            replies = self.phases[phase.group(1)]
+            # 同一學生、同一階段按調用次數依次返回，最後一條（帶 PHASE_COMPLETE）之後循環
+            student = STUDENT_RE.search(system)
+            session = f"{phase.group(1)}|{student.group(0) if student else system}"
+            turn = self._turns.get(session, 0)
+            self._turns[session] = turn + 1
+            return replies[turn % len(replies)]
+
+        return random.choice(self.default)
+
+
+def split_tokens(text: str) -> list[str]:
+    """把回覆切成 1-3 字的 delta（標記同樣會被切開，與真實輸出一致）"""
+    out = []
+    i = 0
+    while i < len(text):
+        n = random.choice((1, 2, 2, 3))
+        out.append(text[i:i + n])
+        i += n
+    return out
+
+
+def create_app(config: FakeConfig, scripter: Scripter) -> FastAPI:
+    app = FastAPI(title="Fake DeepSeek")
+    cache = PrefixCache()
+    stats = {"requests": 0, "streams": 0, "errors_injected": 0, "drops": 0, "stalls": 0, "in_flight": 0}
+
+    def chunk(cid: str, created: int, model: str, delta: dict, finish: Optional[str] = None, usage=None) -> bytes:
+        body = {
+            "id": cid,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish}],
+        }
+        if usage is not None:
+            body["usage"] = usage
+        return b"data: " + json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n\n"
+
+    def usage_for(messages: list[dict], completion: str) -> dict:
+        prompt = json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+        hit, miss = cache.lookup_and_store(prompt)
+        completion_tokens = estimate_tokens(completion)
+        return {
+            "prompt_tokens": hit + miss,
+            "completion_tokens": completion_tokens,
+            "total_tokens": hit + miss + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": hit},
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": miss,
+        }
+
+    def first_token_delay() -> float:
+        return max(0.0, config.ttft + random.uniform(-config.ttft_jitter, config.ttft_jitter))
+
+    async def stream_body(cid, created, model, messages, text) -> AsyncGenerator[bytes, None]:
+        stats["in_flight"] += 1
+        try:
+            # 首 token 之前：按間隔發送 keep-alive
+            wait = first_token_delay()
+            deadline = time.monotonic() + wait
+            while (remaining := deadline - time.monotonic()) > 0:
+                await asyncio.sleep(min(remaining, config.keepalive) if config.keepalive > 0 else remaining)
+                if config.keepalive > 0 and deadline - time.monotonic() > 0:
+                    yield b": keep-alive\n\n"
+
+            yield chunk(cid, created, model, {"role": "assistant", "content": ""})
+            tokens = split_tokens(text)
+            drop_at = random.randrange(len(tokens)) if random.random() < config.drop_rate else -1
+            stall_at = random.randrange(len(tokens)) if random.random() < config.stall_rate else -1
+            interval = 1 / config.tps if config.tps > 0 else 0
+            for i, token in enumerate(tokens):
+                if i == drop_at:
+                    stats["drops"] += 1
+                    raise ConnectionResetError("fake: injected drop")
+                if i == stall_at:
+                    stats["stalls"] += 1
+                    await asyncio.sleep(config.stall_seconds)
+                yield chunk(cid, created, model, {"content": token})
+                if interval:
+                    await asyncio.sleep(interval)
+            yield chunk(cid, created, model, {"content": ""}, "stop", usage_for(messages, text))
+            yield b"data: [DONE]\n\n"
+        finally:
+            stats["in_flight"] -= 1
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "deepseek-chat")
+        stats["requests"] += 1
+
+        if random.random() < config.error_rate:
+            stats["errors_injected"] += 1
+            headers = {"Retry-After": "1"} if config.error_status == 429 else None
+            return JSONResponse(
+                status_code=config.error_status,
+                content={"error": {"message": "fake: injected error", "type": "server_error"}},
+                headers=headers,
+            )
+
+        text = scripter.reply(messages)
+        cid = f"chatcmpl-fake-{stats['requests']}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            stats["streams"] += 1
+            return StreamingResponse(
+                stream_body(cid, created, model, messages, text), media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(first_token_delay())
+        if config.tps > 0:
+            await asyncio.sleep(len(split_tokens(text)) / config.tps)
+        return {
+            "id": cid,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage_for(messages, text),
+        }
+
+    @app.get("/fake/config")
+    async def get_config():
+        return config.as_dict()
+
+    @app.patch("/fake/config")
+    async def patch_config(request: Request):
+        config.update(await request.json())
+        return config.as_dict()
+
+    @app.get("/fake/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="離線 DeepSeek 替身服務")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="回覆腳本（JSON）")
+    parser.add_argument("--seed", type=int, default=None, help="隨機種子（復現錯誤注入）")
+    parser.add_argument("--ttft", type=float, default=0.5)
+    parser.add_argument("--ttft-jitter", type=float, default=0.2)
+    parser.add_argument("--tps", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=60.0)
+    parser.add_argument("--keepalive", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    with open(args.script, encoding="utf-8") as f:
+        scripter = Scripter(json.load(f))
+    config = FakeConfig(**{name: getattr(args, name) for name in FakeConfig.FIELDS})
+
+    print(f"Fake DeepSeek 運行於 http://{args.host}:{args.port}  {config.as_dict()}")
+    uvicorn.run(create_app(config, scripter), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()